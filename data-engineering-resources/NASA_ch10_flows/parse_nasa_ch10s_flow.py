@@ -1,6 +1,5 @@
 import os
 import shutil
-import s3fs
 import tempfile
 import subprocess
 import yaml
@@ -8,6 +7,8 @@ import json
 import metaflow
 from metaflow import step, card
 import opal.flow
+from opal.flow.compression import codec_of, strip_codec_extension
+from opal.flow.bulk import unwrap
 import weave
 
 class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
@@ -48,7 +49,7 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
 
         return tip_metadata
 
-    def parse_basket(self, basket):
+    def parse_basket(self, basket, basket_contents=None):
         '''Parse a ch10 and extract metadata.
 
         Given a basket, check that there exists only one ch10 in that basket.
@@ -58,23 +59,32 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
         Parameters
         ----------
         basket (str): path to a basket of type ch10 in s3.
+        basket_contents (list): optional listing of the basket, if it was
+                                already fetched (see opal.flow.bulk_ls).
 
         Returns
         -------
         tip_metadata (dict): all metadata generated during tip_parse run
                              aggregated into one dict.
         '''
-        basket_contents = self.opal_s3fs.ls(basket)
+        if basket_contents is None:
+            basket_contents = self.opal_s3fs.ls(basket)
 
-        #check that there is one ch10 and get the path to it
-        rch10_path = [x for x in basket_contents if x.endswith('ch10')]
+        #check that there is one ch10 (possibly compressed) and get the path to it
+        rch10_path = [x for x in basket_contents
+                      if strip_codec_extension(x).endswith('ch10')]
         if len(rch10_path) != 1:
             raise Exception(f'there are {len(rch10_path)} ch10s in basket {basket}. skipping.')
         rch10_path = rch10_path[0]
 
-        ch10_filename = os.path.basename(rch10_path)
+        ch10_filename = os.path.basename(strip_codec_extension(rch10_path))
         ch10_path = os.path.join(self.local_dir_path, ch10_filename)
-        self.opal_s3fs.get(rch10_path, ch10_path)
+        if codec_of(rch10_path) is None:
+            self.opal_s3fs.get(rch10_path, ch10_path)
+        else:
+            with opal.flow.open_artifact(rch10_path, fs=self.opal_s3fs) as fin:
+                with open(ch10_path, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
 
         #run tip parse
         subprocess.run(
@@ -97,7 +107,8 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
 
         return tip_metadata
 
-    def upload_parsed_basket(self, basket, tip_metadata):
+    def upload_parsed_basket(self, basket, tip_metadata,
+                             basket_metadata=None, basket_manifest=None):
         '''Generate basket dicts and upload contents.
 
         From s3, get the name of the ch10 and uuid of the parent basket. Then
@@ -110,6 +121,10 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
         basket (str): path to a basket of type ch10 in s3.
         tip_metadata (dict): all metadata generated during tip_parse run
                              aggregated into one dict.
+        basket_metadata, basket_manifest (dict): optional contents of the
+                             basket's basket_metadata.json and
+                             basket_manifest.json, if they were already read
+                             (see opal.flow.bulk_cat_json).
 
         Returns
         -------
@@ -117,17 +132,18 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
                                   returned from self.metaflow_upload_basket
         '''
         #get ch10_name from basket_metadata
-        with self.opal_s3fs.open(os.path.join(basket, 'basket_metadata.json'), 'rb') as file:
-            basket_metadata = json.load(file)
-            ch10_name = basket_metadata['ch10name']
+        if basket_metadata is None:
+            with self.opal_s3fs.open(os.path.join(basket, 'basket_metadata.json'), 'rb') as file:
+                basket_metadata = json.load(file)
+        ch10_name = basket_metadata['ch10name']
 
         tip_metadata['ch10name'] = ch10_name
 
         #get parent_uuid from basket_manifest
-        parent_uuids = []
-        with self.opal_s3fs.open(os.path.join(basket, 'basket_manifest.json'), 'rb') as file:
-            basket_manifest = json.load(file)
-            parent_uuids.append(basket_manifest['uuid'])
+        if basket_manifest is None:
+            with self.opal_s3fs.open(os.path.join(basket, 'basket_manifest.json'), 'rb') as file:
+                basket_manifest = json.load(file)
+        parent_uuids = [basket_manifest['uuid']]
 
         #build upload_dicts
         upload_dicts = []
@@ -151,7 +167,7 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
         self.temp_dir = tempfile.TemporaryDirectory()
         self.local_dir_path = self.temp_dir.name
 
-        self.opal_s3fs = s3fs.S3FileSystem(client_kwargs = {'endpoint_url': os.environ['S3_ENDPOINT']})
+        self.opal_s3fs = opal.flow.minio_s3fs()
         if not self.opal_s3fs.exists(self.bucket_name):
             raise FileNotFoundError(f"Specified Bucket Not Found: {self.bucket_name}")
 
@@ -168,13 +184,34 @@ class NASAch10ParseFlow(opal.flow.OpalFlowSpec):
         if self.n is not None and self.n < len(self.ch10_baskets):
             self.ch10_baskets = self.ch10_baskets[:self.n]
 
-        num_ch10s = len(self.ch10_baskets)
-        for i, basket in enumerate(self.ch10_baskets):
+        # list every basket and read its metadata and manifest up front,
+        # concurrently, instead of a few round trips per basket in the loop.
+        # A failed lookup is kept as its exception and raised (by unwrap)
+        # for that basket only.
+        baskets = list(self.ch10_baskets)
+        listings = opal.flow.bulk_ls(baskets, fs=self.opal_s3fs,
+                                     return_exceptions=True)
+        basket_json = opal.flow.bulk_cat_json(
+            [os.path.join(b, name) for b in baskets
+             for name in ('basket_metadata.json', 'basket_manifest.json')],
+            fs=self.opal_s3fs,
+            return_exceptions=True
+        )
+
+        num_ch10s = len(baskets)
+        for i, basket in enumerate(baskets):
             try:
                 print(f'{i+1}/{num_ch10s}: {basket}')
 
-                tip_metadata = self.parse_basket(basket)
-                basket_upload_path = self.upload_parsed_basket(basket, tip_metadata)
+                tip_metadata = self.parse_basket(
+                    basket, unwrap(listings[basket])
+                )
+                basket_upload_path = self.upload_parsed_basket(
+                    basket,
+                    tip_metadata,
+                    unwrap(basket_json[os.path.join(basket, 'basket_metadata.json')]),
+                    unwrap(basket_json[os.path.join(basket, 'basket_manifest.json')])
+                )
                 print(f'basket successfully parsed and uploaded: {basket_upload_path}')
 
             except Exception as e:
@@ -1,5 +1,4 @@
 import os
-import s3fs
 import subprocess
 import yaml
 import pandas as pd
@@ -9,6 +8,7 @@ import json
 import shutil
 from metaflow import step, card
 import opal.flow
+from opal.flow.bulk import unwrap
 import weave
 
 class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
@@ -68,7 +68,12 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
 
         return translate_metadata
 
-    def translate_basket(self, basket):
+    def s3_parsed_path(self, basket, ch10_name):
+        '''Path to the parsed data of type <data_type> in a parsed basket.'''
+        return f"{basket}/{ch10_name}" \
+               f"{self.translate_options[self.data_type][1]}"
+
+    def translate_basket(self, basket, parsed_metadata=None, parsed_exists=None):
         '''Translate parsed data and extract metadata.
 
         Given a parsed basket of the type given from the <type> parameter, 
@@ -79,24 +84,29 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
         Parameters
         ----------
         basket (str): path to a basket of type ch10_parsed in s3.
+        parsed_metadata (dict): optional contents of the basket's
+                                basket_metadata.json, if it was already read
+                                (see opal.flow.bulk_cat_json).
+        parsed_exists (bool): optional, whether the parsed data was already
+                              found in the basket (see opal.flow.bulk_exists).
 
         Returns
         -------
         translate_metadata (dict): metadata generated during tip_translate.
         '''
-        opal_s3fs = s3fs.S3FileSystem(client_kwargs =
-                                      {'endpoint_url': os.environ['S3_ENDPOINT']})
+        opal_s3fs = opal.flow.minio_s3fs()
 
-        parsed_metadata = {}
-        metadata_path = os.path.join(basket, 'basket_metadata.json')
-        with opal_s3fs.open(metadata_path, 'rb') as file:
-            parsed_metadata = json.load(file)
+        if parsed_metadata is None:
+            metadata_path = os.path.join(basket, 'basket_metadata.json')
+            with opal_s3fs.open(metadata_path, 'rb') as file:
+                parsed_metadata = json.load(file)
 
         self.ch10_name = parsed_metadata['ch10name']
 
-        s3_parsed_path = f"{basket}/{self.ch10_name}" \
-                         f"{self.translate_options[self.data_type][1]}"
-        if not opal_s3fs.exists(s3_parsed_path):
+        s3_parsed_path = self.s3_parsed_path(basket, self.ch10_name)
+        if parsed_exists is None:
+            parsed_exists = opal_s3fs.exists(s3_parsed_path)
+        if not parsed_exists:
             raise Exception(f'Parsed data does not exist {s3_parsed_path}' \
                             f', skipping: {basket}')
 
@@ -135,7 +145,8 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
         )
         return self.extract_metadata()
 
-    def upload_translate_basket(self, basket, translate_metadata):
+    def upload_translate_basket(self, basket, translate_metadata,
+                                manifest_data=None):
         '''Upload translated data to MinIO.
 
         From s3, get the name of the ch10 and uuid of the parent basket. Then 
@@ -145,19 +156,20 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
         ----------
         basket (str): path to a basket of type ch10_parsed in s3.
         translate_metadata (dict): all metadata generated during tip_translate.
+        manifest_data (dict): optional contents of the basket's
+                              basket_manifest.json, if it was already read
+                              (see opal.flow.bulk_cat_json).
 
         Returns
         -------
         basket_upload_path (str): path to where the basket was uploaded,
                                   returned from self.metaflow_upload_basket
         '''
-        opal_s3fs = s3fs.S3FileSystem(client_kwargs =
-                                      {'endpoint_url': os.environ['S3_ENDPOINT']})
-
-        manifest_data = {}
-        manifest_path = os.path.join(basket, 'basket_manifest.json')
-        with opal_s3fs.open(manifest_path, 'rb') as file:
-            manifest_data = json.load(file)
+        if manifest_data is None:
+            opal_s3fs = opal.flow.minio_s3fs()
+            manifest_path = os.path.join(basket, 'basket_manifest.json')
+            with opal_s3fs.open(manifest_path, 'rb') as file:
+                manifest_data = json.load(file)
 
         self.parsed_id = manifest_data['uuid']
         parent_ids = [self.parsed_id, self.dts_id]
@@ -179,8 +191,7 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
     @step
     def start(self):
         '''Sanitize inputs and create temporary directories.'''
-        opal_s3fs = s3fs.S3FileSystem(client_kwargs =
-                                      {'endpoint_url': os.environ['S3_ENDPOINT']})
+        opal_s3fs = opal.flow.minio_s3fs()
 
         # sanitize inputs
         if self.n is not None:
@@ -209,8 +220,7 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
     @step
     def get_dts_file(self):
         '''Get latest DTS file from S3 and save locally for translation.'''
-        opal_s3fs = s3fs.S3FileSystem(client_kwargs =
-                                      {'endpoint_url': os.environ['S3_ENDPOINT']})
+        opal_s3fs = opal.flow.minio_s3fs()
 
         dts_index_df = self.basket_index.get_baskets_of_type(
             f"NASA_{self.data_type}_DTS"
@@ -247,8 +257,7 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
             and upload translated data as a ch10_translated_<type> 
             basket.
         '''
-        opal_s3fs = s3fs.S3FileSystem(client_kwargs =
-                                      {'endpoint_url': os.environ['S3_ENDPOINT']})
+        opal_s3fs = opal.flow.minio_s3fs()
 
         if not opal_s3fs.exists(self.bucket_name):
             raise FileNotFoundError(f"Specified Bucket Not Found: " \
@@ -260,15 +269,46 @@ class NASAch10TranslateFlow(opal.flow.OpalFlowSpec):
         if self.n is not None:
             self.ch10_parsed_baskets = self.ch10_parsed_baskets[:self.n]
 
-        num_baskets = len(self.ch10_parsed_baskets)
-        for i, basket in enumerate(self.ch10_parsed_baskets):
+        # read every basket's metadata and manifest, then check for every
+        # basket's parsed data, concurrently up front instead of a few
+        # round trips per basket in the loop. A failed lookup is kept as
+        # its exception and raised (by unwrap) for that basket only.
+        baskets = list(self.ch10_parsed_baskets)
+        metadata_paths = {b: os.path.join(b, 'basket_metadata.json')
+                          for b in baskets}
+        manifest_paths = {b: os.path.join(b, 'basket_manifest.json')
+                          for b in baskets}
+        basket_json = opal.flow.bulk_cat_json(
+            [*metadata_paths.values(), *manifest_paths.values()],
+            fs=opal_s3fs,
+            return_exceptions=True
+        )
+
+        parsed_paths = {}
+        for b in baskets:
+            metadata = basket_json[metadata_paths[b]]
+            if not isinstance(metadata, BaseException) and 'ch10name' in metadata:
+                parsed_paths[b] = self.s3_parsed_path(b, metadata['ch10name'])
+        parsed_exists = opal.flow.bulk_exists(parsed_paths.values(),
+                                              fs=opal_s3fs,
+                                              return_exceptions=True)
+
+        num_baskets = len(baskets)
+        for i, basket in enumerate(baskets):
             try:
                 print(f'-- translating {i + 1} of {num_baskets}: {basket}')
 
-                translate_metadata = self.translate_basket(basket)
-
-                basket_upload_path = self.upload_translate_basket(basket,
-                                                                  translate_metadata)
+                parsed_metadata = unwrap(basket_json[metadata_paths[basket]])
+                exists = parsed_exists.get(parsed_paths.get(basket))
+                translate_metadata = self.translate_basket(
+                    basket, parsed_metadata, unwrap(exists)
+                )
+
+                basket_upload_path = self.upload_translate_basket(
+                    basket,
+                    translate_metadata,
+                    unwrap(basket_json[manifest_paths[basket]])
+                )
 
                 print(f"basket successfully translated and uploaded: " \
                       f" {basket_upload_path}")
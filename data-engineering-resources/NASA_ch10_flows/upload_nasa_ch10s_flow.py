@@ -1,5 +1,4 @@
 import os
-import s3fs
 import tempfile
 import metaflow
 from random import sample
@@ -31,6 +30,15 @@ class NASAc10UploadFlow(opal.flow.OpalFlowSpec):
         default='basket-data'
     )
 
+    compression = metaflow.Parameter(
+        "compression",
+        help="Compress ch10s on upload with this codec ('gzip' or 'zstd'). "
+             "Default is no compression.",
+        required=False,
+        default=None,
+        type=str
+    )
+
     metadata_selection = {
         'pilot': ['Luke', 'Wedge', 'Stephen', 'Danny', 'Rob', 'Carl', 'Ken', 'Trevor', 'Tanner'],
         'call_sign': ['Red-5', 'Gold-1', 'Silver-9', 'Diamond', 'Poppy', 'Saphire', 'T-Rex', 'Slick'],
@@ -56,7 +64,7 @@ class NASAc10UploadFlow(opal.flow.OpalFlowSpec):
         get all the NASA ch10 files from a govcloud datastore,
         and upload them one at a time to the OPAL datastore
         '''
-        opal_data = s3fs.S3FileSystem(anon = True, client_kwargs = {'region_name':'us-gov-west-1'})
+        opal_data = opal.flow.get_s3fs(anon = True, region_name = 'us-gov-west-1')
 
         self.ch10_source_path = f's3://opal-data/{self.ch10_directory}'
 
@@ -87,7 +95,8 @@ class NASAc10UploadFlow(opal.flow.OpalFlowSpec):
                                                              'ch10',
                                                              self.bucket_name,
                                                              label = ch10_name,
-                                                             metadata = metadata_in)
+                                                             metadata = metadata_in,
+                                                             compression = self.compression)
 
             print(f'basket successfully uploaded: {basket_upload_path}')
 
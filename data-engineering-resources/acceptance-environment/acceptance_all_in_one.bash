@@ -7,9 +7,8 @@ python chapter_10_catalog.py run \
 # parse it all
 python tip_parse_flow_wrapper.py
 
-# clean out the parse and translate data
-python tip_utils.py delete-parsed-duplicates
-python tip_utils.py delete-translated-orphans
+# clean out duplicate parse runs and orphaned translate runs
+python run_gc.py
 
 # translate it all
 python tip_translate_flow_wrapper.py MILSTD1553 ~/DTS/DTS1553_Synth_Nasa.yaml
@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+import functools
+import concurrent.futures
+from pathlib import Path
+
+import fsspec
+from fsspec.json import FilesystemJSONDecoder
+from opal.query.sqlite import connect
+
+# Chapter 10 fingerprints: the SHA-256 of the first 150MB of the file,
+# the same digest as tip_utils.tip_hash_ch10, computed faster.
+#
+#   fingerprint("/data/flight.ch10")
+#   fingerprint("s3://bucket/flight.ch10", fs)
+#   fingerprint_many([(path, fsspec_dict), ...])
+#
+# Local files are read with readinto into one large reusable buffer, so
+# there's no Python-level copy per block. Files on other filesystems are
+# fetched as concurrent ranged reads (cat_file with start/end), a few
+# blocks ahead of the hasher. fingerprint_many hashes many files at once
+# in a process pool.
+#
+# FingerprintStore keeps fingerprints in a local SQLite file, keyed by
+# source, url (the absolute path of a local file, the full URL of any other),
+# size and version (mtime or ETag), so re-scans only hash files that are
+# new or changed:
+#
+#   FingerprintStore().fingerprint_many([(path, fsspec_dict, source), ...])
+#
+# The store is per host: it's a file on the local disk (SQLite isn't safe
+# on shared network filesystems). Tasks that run elsewhere, like
+# Chapter10Catalog's foreach hashing on remote compute, each start from
+# their host's own store and only save work on hosts that hashed before.
+
+HASH_SIZE = 150_000_000  # 150MB, as tip_hash_ch10
+LOCAL_BLOCK_SIZE = 8 * 1024 * 1024
+REMOTE_BLOCK_SIZE = 16 * 1024 * 1024
+# ranged reads in flight per remote file
+READAHEAD = 4
+
+
+def _hash_local(path, block_size=LOCAL_BLOCK_SIZE):
+    sha = hashlib.sha256()
+    buf = memoryview(bytearray(block_size))
+    remaining = HASH_SIZE
+    with open(path, "rb", buffering=0) as f:
+        while remaining > 0:
+            n = f.readinto(buf[: min(block_size, remaining)])
+            if not n:
+                break
+            sha.update(buf[:n])
+            remaining -= n
+    return sha.hexdigest()
+
+
+# size is the file's size if the caller already has it (from a detailed
+# listing), saving a request for it
+def _hash_remote(
+    fs, path, block_size=REMOTE_BLOCK_SIZE, readahead=READAHEAD, size=None
+):
+    end = min(fs.size(path) if size is None else size, HASH_SIZE)
+    ranges = [(s, min(s + block_size, end)) for s in range(0, end, block_size)]
+
+    sha = hashlib.sha256()
+    with concurrent.futures.ThreadPoolExecutor(readahead) as pool:
+        pending = []
+        for start, stop in ranges:
+            pending.append(pool.submit(fs.cat_file, path, start, stop))
+            # hash in order, keeping at most `readahead` blocks in memory
+            if len(pending) == readahead:
+                sha.update(pending.pop(0).result())
+        for block in pending:
+            sha.update(block.result())
+    return sha.hexdigest()
+
+
+def _is_local(fs):
+    if fs is None:
+        return True
+    protocols = (fs.protocol,) if isinstance(fs.protocol, str) else fs.protocol
+    return "file" in protocols
+
+
+def _local_path(path):
+    path = str(path)
+    return path[len("file://") :] if path.startswith("file://") else path
+
+
+# fingerprint of the chapter 10 at path, on fs (an fsspec filesystem) or
+# the local disk. size is optional, as for _hash_remote.
+def fingerprint(path, fs=None, size=None):
+    if _is_local(fs):
+        return _hash_local(_local_path(path))
+    return _hash_remote(fs, path, size=size)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_filesystem(fsspec_json):
+    return fsspec.AbstractFileSystem.from_json(fsspec_json)
+
+
+# Async filesystems (s3fs) refuse to run in a forked child, so children of
+# the fingerprint_many pool make their own instead of using the parent's
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_cached_filesystem.cache_clear)
+
+
+# the filesystem for a JSON-able fsspec description, made once per process
+def get_filesystem(fsspec_dict):
+    return _cached_filesystem(json.dumps(fsspec_dict, sort_keys=True))
+
+
+def _filesystem(fsspec_dict):
+    return None if fsspec_dict is None else get_filesystem(fsspec_dict)
+
+
+# the class of the filesystem for a JSON-able fsspec description, without
+# making one
+def _filesystem_class(fsspec_dict):
+    if fsspec_dict is None:
+        return None
+    fs_class = FilesystemJSONDecoder.try_resolve_fs_cls(fsspec_dict)
+    return fs_class or fsspec.get_filesystem_class(fsspec_dict["protocol"])
+
+
+def _fingerprint_job(job):
+    path, fsspec_dict, size = job
+    return fingerprint(path, _filesystem(fsspec_dict), size)
+
+
+# Fingerprints of many chapter 10s, in order. jobs are paths, or (path,
+# fsspec_dict) pairs where fsspec_dict is a filesystem's JSON description
+# (as in Chapter10Catalog sources) or None for local files, optionally
+# with the file's size third. Files are hashed `processes` at a time
+# (default: one per CPU).
+def fingerprint_many(jobs, processes=None):
+    jobs = [(job,) if isinstance(job, (str, Path)) else tuple(job) for job in jobs]
+    jobs = [job + (None,) * (3 - len(job)) for job in jobs]
+    if not jobs:
+        return []
+    processes = min(processes or os.cpu_count() or 1, len(jobs))
+    if processes == 1:
+        return [_fingerprint_job(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(_fingerprint_job, jobs))
+
+
+DEFAULT_STORE_PATH = os.path.join("~", ".cache", "opal", "ch10_fingerprints.sqlite")
+STORE_PATH_ENV = "CH10_FINGERPRINT_STORE"
+
+
+def default_store_path():
+    return os.path.abspath(
+        os.path.expanduser(os.environ.get(STORE_PATH_ENV, DEFAULT_STORE_PATH))
+    )
+
+
+# What identifies this version of a file, from fsspec's info: its ETag
+# where the filesystem has one (S3), otherwise its modification time
+def file_version(info):
+    for key in ("ETag", "etag", "mtime", "LastModified", "last_modified"):
+        if info.get(key) is not None:
+            return str(info[key])
+    return ""
+
+
+# what a file is stored under: its absolute path if it's local, otherwise
+# its URL with the filesystem's protocol. fs is a filesystem or its class.
+def store_url(path, fs=None):
+    if _is_local(fs):
+        return os.path.abspath(_local_path(path))
+    path = str(path)
+    protocols = (fs.protocol,) if isinstance(fs.protocol, str) else fs.protocol
+    if any(path.startswith(f"{protocol}://") for protocol in protocols):
+        return path
+    return f"{protocols[0]}://{path}"
+
+
+# (size, version) of path on fs, or on the local disk
+def file_key(path, fs=None):
+    if _is_local(fs):
+        st = os.stat(_local_path(path))
+        return st.st_size, repr(st.st_mtime)
+    info = fs.info(path)
+    return info["size"], file_version(info)
+
+
+class FingerprintStore:
+    def __init__(self, path=None):
+        self.path = os.path.abspath(os.path.expanduser(path or default_store_path()))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "source TEXT, url TEXT, size INTEGER, version TEXT, hash TEXT, "
+                "PRIMARY KEY (source, url))"
+            )
+
+    def _db(self):
+        return connect(self.path)
+
+    # the stored fingerprint, if the file hasn't changed since
+    def get(self, source, url, size, version):
+        return self.get_many([(source, url, size, version)])[0]
+
+    # stored fingerprints (or None) for (source, url, size, version) rows,
+    # looked up in one transaction
+    def get_many(self, rows):
+        with self._db() as db:
+            db.execute("BEGIN")
+            found = [
+                db.execute(
+                    "SELECT hash FROM fingerprints "
+                    "WHERE source = ? AND url = ? AND size = ? AND version = ?",
+                    row,
+                ).fetchone()
+                for row in rows
+            ]
+        return [None if row is None else row[0] for row in found]
+
+    # store (source, url, size, version, hash) rows in one transaction
+    def put_many(self, rows):
+        with self._db() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    # fingerprint_many that only hashes files the store doesn't have.
+    # jobs are as for fingerprint_many, optionally with a source name
+    # third: (path, fsspec_dict, source). keys are the (size, version) of
+    # each file if the caller already has them (from a detailed listing),
+    # otherwise each file is stat'ed.
+    def fingerprint_many(self, jobs, processes=None, keys=None):
+        jobs = [(job,) if isinstance(job, (str, Path)) else tuple(job) for job in jobs]
+        jobs = [tuple(job) + (None,) * (3 - len(job)) for job in jobs]
+        if keys is None:
+            keys = [file_key(path, _filesystem(spec)) for path, spec, _ in jobs]
+
+        rows = []
+        for (path, spec, source), (size, version) in zip(jobs, keys):
+            source = source if source is not None else ""
+            # from the filesystem's class: an instance made here would be
+            # inherited by the pool's forked children
+            url = store_url(path, _filesystem_class(spec))
+            rows.append((source, url, size, version))
+
+        hashes = self.get_many(rows)
+        missing = [i for i, h in enumerate(hashes) if h is None]
+        # with the sizes, remote files are hashed without another request
+        new = fingerprint_many(
+            [jobs[i][:2] + (rows[i][2],) for i in missing], processes
+        )
+
+        for i, h in zip(missing, new):
+            hashes[i] = h
+        if missing:
+            self.put_many([rows[i] + (hashes[i],) for i in missing])
+        return hashes
@@ -6,10 +6,48 @@ import metaflow
 from metaflow import Parameter, step, card, IncludeFile
 import opal.flow
 import pandas as pd
-from tip_utils import tip_hash_ch10
+from ch10_fingerprint import FingerprintStore, file_version, get_filesystem, HASH_SIZE
 import json
-import fsspec
-import itertools
+import concurrent.futures
+import heapq
+
+# sources listed at once in get_ch10_data
+MAX_LISTING_THREADS = 8
+
+
+# {path: info} of every chapter 10 matching a source's url patterns, from
+# detailed globs (so the infos come from the listing, not a request each)
+def list_ch10s(source_spec):
+    fs = get_filesystem(source_spec["fsspec"])
+    listing = {}
+    for glob_url in source_spec["urls"]:
+        for path, info in fs.glob(glob_url, detail=True).items():
+            if info.get("type") != "directory":
+                listing[path] = info
+    return listing
+
+
+# Split items into n lists with about the same total size(item) each
+# (largest first, each to the lightest shard so far). Empty shards are
+# dropped, but there's always at least one.
+def size_balanced_shards(items, n, size):
+    heap = [(0, i, []) for i in range(max(1, n))]
+    for item in sorted(items, key=size, reverse=True):
+        total, i, shard = heapq.heappop(heap)
+        shard.append(item)
+        heapq.heappush(heap, (total + size(item), i, shard))
+    shards = [shard for _, _, shard in sorted(heap, key=lambda h: h[1]) if shard]
+    return shards or [[]]
+
+
+# {url: hash} for a shard of (url, fsspec_dict, source, size, version)
+# jobs, hashed `processes` at a time (default: one per CPU). Hashes of
+# chapter 10s that haven't changed come from store, a FingerprintStore.
+def hash_shard(shard, store, processes=None):
+    jobs = [(url, fsspec_dict, source) for url, fsspec_dict, source, _, _ in shard]
+    keys = [(size, version) for _, _, _, size, version in shard]
+    hashes = store.fingerprint_many(jobs, processes=processes, keys=keys)
+    return {url: ch10_hash for (url, _, _), ch10_hash in zip(jobs, hashes)}
 
 
 class Chapter10Catalog(opal.flow.OpalFlowSpec):
@@ -28,6 +66,20 @@ class Chapter10Catalog(opal.flow.OpalFlowSpec):
         "cache", help="Use latest successful run as cache", default=True
     )
 
+    shards = metaflow.Parameter(
+        "shards",
+        help="Number of hash_ch10s tasks to split the new chapter 10s between",
+        type=int,
+        default=4,
+    )
+
+    shard_processes = metaflow.Parameter(
+        "shard-processes",
+        help="Chapter 10s hashed at once in each hash_ch10s task (default: one per CPU)",
+        type=int,
+        default=None,
+    )
+
     @step
     def start(self):
         # load sources description
@@ -73,23 +125,32 @@ class Chapter10Catalog(opal.flow.OpalFlowSpec):
 
         cached_dict = self.cached_run.data.data_dict if self.use_cache else {}
 
+        # list every source at once, one detailed listing per url pattern
+        # so sizes and versions come with the paths instead of a request
+        # per file
+        with concurrent.futures.ThreadPoolExecutor(
+            max(1, min(len(self.sources), MAX_LISTING_THREADS))
+        ) as pool:
+            listings = dict(
+                zip(
+                    self.sources,
+                    pool.map(list_ch10s, self.sources.values()),
+                )
+            )
+
         for source_name, source_spec in self.sources.items():
             log_prefix = f"({source_name})"
-            # get the file system object for this source
-            fs = fsspec.AbstractFileSystem.from_json(json.dumps(source_spec["fsspec"]))
 
-            # get all chapter 10 paths by glob
-            ch10_paths = itertools.chain.from_iterable(
-                (fs.glob(glob_url) for glob_url in source_spec["urls"])
-            )
-
-            for ch10_p in ch10_paths:
+            for ch10_p, ch10_info in listings[source_name].items():
                 # some basic information about the file
                 ch10_name = os.path.basename(ch10_p)
                 ch10_url = f"{source_spec['fsspec']['protocol']}://{ch10_p}"
-                ch10_size = fs.size(ch10_p)
+                ch10_size = ch10_info["size"]
+                # mtime or ETag
+                ch10_version = file_version(ch10_info)
 
-                # filter out ch10s in the same spot with the same size.
+                # filter out ch10s in the same spot with the same size
+                # (and version, for records that have one).
                 # We assume they will have the same hash, and therefore
                 # are the same file.
                 # note - if you have multiple chapter 10s with the same urls
@@ -100,6 +161,7 @@ class Chapter10Catalog(opal.flow.OpalFlowSpec):
                     if (
                         ch10_size == cached_record["size"]
                         and source_name == cached_record["source"]
+                        and cached_record.get("version", ch10_version) == ch10_version
                     ):
                         print(
                             f"{log_prefix} Found {ch10_name} in cache ({ch10_size} b)"
@@ -109,8 +171,8 @@ class Chapter10Catalog(opal.flow.OpalFlowSpec):
                     else:
                         print(
                             f"{log_prefix} Found {ch10_name} in cache, "
-                            f"but it's a different size "
-                            f"({ch10_size} != {cached_record['ch10_size']}). "
+                            f"but it's a different size or version "
+                            f"({ch10_size} != {cached_record['size']}). "
                             "Assuming this is a new chapter 10 file."
                         )
                 else:
@@ -118,30 +180,55 @@ class Chapter10Catalog(opal.flow.OpalFlowSpec):
 
                 self.data_dict[ch10_url] = {
                     "size": ch10_size,
+                    "version": ch10_version,
                     "source": source_name,
                     "hash": "",
                 }
 
-        self.next(self.hash_ch10s)
+        # split the chapter 10s that need hashing into shards of about
+        # the same number of bytes to hash, hashed by parallel tasks
+        to_hash = []
+        for k, info in self.data_dict.items():
+            if info["hash"] == "":
+                to_hash.append(
+                    (
+                        k,
+                        self.sources[info["source"]]["fsspec"],
+                        info["source"],
+                        info["size"],
+                        info["version"],
+                    )
+                )
+            else:
+                print(f"Using cache for {os.path.basename(k)} ({info['hash']})")
+        self.hash_shards = size_balanced_shards(
+            to_hash, self.shards, lambda job: min(job[3], HASH_SIZE)
+        )
+        print(f"Hashing {len(to_hash)} chapter 10s in {len(self.hash_shards)} shards")
+
+        self.next(self.hash_ch10s, foreach="hash_shards")
 
     @step
     def hash_ch10s(self):
-        n = len(self.data_dict)
-        for i, k in enumerate(self.data_dict.keys()):
-            # for printing progress
-            prefix = f"{i+1}/{n}"
-            ch10_info = self.data_dict[k]
-            name = os.path.basename(k)
-
-            # hash the chapter 10 if no hash exists
-            if ch10_info["hash"] == "":
-                print(f"{prefix} Hashing {name}")
-                fsspec_dict = self.sources[ch10_info["source"]]["fsspec"]
-                fs = fsspec.AbstractFileSystem.from_json(json.dumps(fsspec_dict))
-                with fs.open(k) as f:
-                    ch10_info["hash"] = tip_hash_ch10(f)
-            else:
-                print(f"{prefix} Using cache for {name} ({ch10_info['hash']})")
+        # hash this shard's chapter 10s at once, in a process pool.
+        # The fingerprint store has hashes of files that haven't changed
+        # since an earlier run or wrapper on this host saw them. It's per
+        # host, so a task on another host starts from that host's store.
+        self.shard_hashes = hash_shard(
+            self.input, FingerprintStore(), self.shard_processes
+        )
+        for url, ch10_hash in self.shard_hashes.items():
+            print(f"Hashed {os.path.basename(url)} ({ch10_hash})")
+
+        self.next(self.join_hashes)
+
+    @step
+    def join_hashes(self, inputs):
+        # everything but the shard results is the same in every branch
+        self.merge_artifacts(inputs, exclude=["shard_hashes"])
+        for shard in inputs:
+            for url, ch10_hash in shard.shard_hashes.items():
+                self.data_dict[url]["hash"] = ch10_hash
 
         self.next(self.end)
 
@@ -4,30 +4,76 @@ import metaflow
 import opal.flow
 
 
-def regenerate_catalog(publish_all, publish_latest):
-    # get everything in the catalog
-    search = opal.query.search.Instance()
-    res = search.search()
-    catalog = [d["kind_id"] for d in res.all()]
-
-    # delete it all
-    print("Deleting old catalog...")
-    n = len(catalog)
-    for i, c_id in enumerate(catalog):
-        opal.publish.delete(c_id)
-        print(f"\r{i+1}/{n} : {c_id}", end="")
-
-    # publish all valid runs for every flow name in publish_all
-    print("\nPublishing new catalog...")
+# publish all valid runs for every flow in publish_all,
+# and the latest successful run for every flow in publish_latest
+def catalog_runs(publish_all, publish_latest):
     for flow in publish_all:
         print(f"\tall: {flow.id}")
-        for run in flow:
-            opal.flow.publish_run(run)
-
-    # publish the latest successful run for every flow in publish_latest
+        yield from flow
     for flow in publish_latest:
         print(f"\tlatest: {flow.id}")
-        opal.flow.publish_run(flow.latest_successful_run)
+        yield flow.latest_successful_run
+
+
+# diff the runs against the catalog and apply only the changes. The
+# catalog stays available, and the time taken scales with the changes.
+def reconcile_catalog(
+    publish_all, publish_latest, dry_run=False, concurrency=8, rate=None
+):
+    print("Reconciling catalog..." if not dry_run else "Planning catalog changes...")
+    report = opal.flow.reconcile_runs(
+        catalog_runs(publish_all, publish_latest),
+        dry_run=dry_run,
+        concurrency=concurrency,
+        rate=rate,
+    )
+    print(report.summary())
+    if dry_run:
+        for label, ids in (
+            ("insert", report.inserted),
+            ("update", report.updated),
+            ("delete", report.deleted),
+        ):
+            for kind_id in ids:
+                print(f"\t{label}: {kind_id}")
+    return report
+
+
+def regenerate_catalog(publish_all, publish_latest, delta=False):
+    if delta:
+        # keep the catalog, and only send runs that changed since they
+        # were last published from here (or that the catalog has lost)
+        print("Checking published digests against the catalog...")
+        stale = opal.publish.delta.verify()
+        print(f"{len(stale)} entries will be republished")
+    else:
+        # get everything in the catalog
+        search = opal.query.search.Instance()
+        res = search.search()
+        catalog = [d["kind_id"] for d in res.all()]
+
+        # delete it all
+        print("Deleting old catalog...")
+        n = len(catalog)
+        for i, c_id in enumerate(catalog):
+            opal.publish.delete(c_id)
+            print(f"\r{i+1}/{n} : {c_id}", end="")
+
+    print("\nPublishing new catalog...")
+    results = opal.flow.publish_runs(
+        catalog_runs(publish_all, publish_latest), delta=delta
+    )
+
+    failed = {run_id: status for run_id, (ok, status) in results.items() if not ok}
+    unchanged = sum(
+        status == opal.publish.delta.NOT_MODIFIED for _, status in results.values()
+    )
+    print(
+        f"Published {len(results) - len(failed)}/{len(results)} runs"
+        f" ({unchanged} unchanged)"
+    )
+    for run_id, status in failed.items():
+        print(f"\tfailed: {run_id} (status {status})")
 
 
 if __name__ == "__main__":
@@ -49,6 +95,36 @@ if __name__ == "__main__":
         default=[],
     )
 
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="don't delete the catalog, only publish runs that changed",
+    )
+
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="don't delete the catalog, diff it against the runs and apply only "
+        "the inserts, updates and deletes",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="with --reconcile, only report what would change",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="with --reconcile, requests in flight at once",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="with --reconcile, at most this many requests per second",
+    )
+
     args = parser.parse_args()
 
     # get the flows now so we don't encounter an exception
@@ -56,4 +132,13 @@ if __name__ == "__main__":
     publish_all_flows = [metaflow.Flow(fl_id) for fl_id in args.all]
     publish_latest_flows = [metaflow.Flow(fl_id) for fl_id in args.latest]
 
-    regenerate_catalog(publish_all_flows, publish_latest_flows)
+    if args.reconcile:
+        reconcile_catalog(
+            publish_all_flows,
+            publish_latest_flows,
+            dry_run=args.dry_run,
+            concurrency=args.concurrency,
+            rate=args.rate,
+        )
+    else:
+        regenerate_catalog(publish_all_flows, publish_latest_flows, delta=args.delta)
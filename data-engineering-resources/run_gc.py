@@ -0,0 +1,149 @@
+import concurrent.futures
+
+import metaflow
+import pandas as pd
+import opal.flow
+
+from tip_utils import get_run_hash
+
+# Garbage collection of tip runs: parse runs of a chapter 10 that has a
+# newer parse run (duplicates), and translate runs whose parse run isn't
+# valid anymore (orphans), including ones whose parse run is a duplicate.
+#
+#   python run_gc.py --dry-run        # print the plan
+#   python run_gc.py --workers 8      # delete everything in the plan
+#
+# Runs are summarized once, and duplicates and orphans are found with
+# groupby/isin over those summaries. Deletions (opal.flow.delete_run_data)
+# run in a thread pool.
+
+DEFAULT_WORKERS = 8
+
+
+def _valid(run):
+    return run.successful and not "no_data" in run.tags
+
+
+def _flow_runs(flow_name):
+    try:
+        return [r for r in metaflow.Flow(flow_name) if _valid(r)]
+    except metaflow.exception.MetaflowNotFound:
+        return []
+
+
+# id, hash and created_at of every valid TipParseFlow run
+def parse_run_summaries(runs=None):
+    runs = _flow_runs("TipParseFlow") if runs is None else runs
+    return pd.DataFrame(
+        [
+            {"id": r.id, "hash": get_run_hash(r), "created_at": r.created_at}
+            for r in runs
+        ],
+        columns=["id", "hash", "created_at"],
+    )
+
+
+# id, parse run id and created_at of every valid TipTranslateFlow run.
+# The parse run id is the parse_pointer parameter, so the parse run
+# itself isn't loaded.
+def translate_run_summaries(runs=None):
+    runs = _flow_runs("TipTranslateFlow") if runs is None else runs
+    return pd.DataFrame(
+        [
+            {"id": r.id, "parse_id": r.data.parse_pointer, "created_at": r.created_at}
+            for r in runs
+        ],
+        columns=["id", "parse_id", "created_at"],
+    )
+
+
+# ids of parse runs with the same hash as a newer parse run
+def find_duplicates(parse_runs):
+    latest = parse_runs.groupby("hash")["created_at"].transform("max")
+    is_latest = parse_runs["created_at"] == latest
+
+    # two "latest" runs for a hash means we can't tell which to keep
+    tied = parse_runs[is_latest].duplicated("hash", keep=False)
+    if tied.any():
+        hashes = sorted(parse_runs[is_latest][tied]["hash"].unique())
+        raise ValueError(f"Parse runs created at the same time for hashes {hashes}")
+
+    return list(parse_runs.loc[~is_latest, "id"])
+
+
+# ids of translate runs whose parse run isn't one of valid_parse_ids
+def find_orphans(translate_runs, valid_parse_ids):
+    orphaned = ~translate_runs["parse_id"].isin(set(valid_parse_ids))
+    return list(translate_runs.loc[orphaned, "id"])
+
+
+# The runs to delete, as a DataFrame of flow, id and reason
+def plan(parse_runs=None, translate_runs=None, duplicates=True, orphans=True):
+    parse_runs = parse_run_summaries() if parse_runs is None else parse_runs
+
+    rows = []
+    duplicate_ids = find_duplicates(parse_runs) if duplicates else []
+    rows += [("TipParseFlow", i, "duplicate") for i in duplicate_ids]
+
+    if orphans:
+        if translate_runs is None:
+            translate_runs = translate_run_summaries()
+        valid = parse_runs.loc[~parse_runs["id"].isin(duplicate_ids), "id"]
+        rows += [
+            ("TipTranslateFlow", i, "orphan")
+            for i in find_orphans(translate_runs, valid)
+        ]
+
+    return pd.DataFrame(rows, columns=["flow", "id", "reason"])
+
+
+# Delete the runs in a plan, `workers` at a time. Returns a dict of
+# "flow/id" -> the exception for runs that couldn't be deleted.
+def execute(gc_plan, workers=DEFAULT_WORKERS):
+    def delete(pathspec):
+        report = opal.flow.delete_run_data(metaflow.Run(pathspec))
+        if not report.ok:
+            raise Exception(f"{len(report.failed)} objects not deleted: {report}")
+        print(f"Deleted {pathspec} ({report.objects} objects, {report.bytes} b)")
+
+    pathspecs = [f"{flow}/{i}" for flow, i in zip(gc_plan["flow"], gc_plan["id"])]
+    failed = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(delete, p): p for p in pathspecs}
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                failed[futures[future]] = future.exception()
+    return failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Delete duplicate and orphaned tip runs")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only print what would be deleted"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help="deletions at once"
+    )
+    parser.add_argument(
+        "--no-duplicates",
+        action="store_true",
+        help="don't delete duplicate parse runs",
+    )
+    parser.add_argument(
+        "--no-orphans",
+        action="store_true",
+        help="don't delete orphaned translate runs",
+    )
+    args = parser.parse_args()
+
+    gc_plan = plan(duplicates=not args.no_duplicates, orphans=not args.no_orphans)
+    print(f"{len(gc_plan)} runs to delete")
+    for flow, run_id, reason in gc_plan.itertuples(index=False):
+        print(f"\t{flow}/{run_id} ({reason})")
+
+    if not args.dry_run:
+        failed = execute(gc_plan, args.workers)
+        for pathspec, error in failed.items():
+            print(f"\tfailed: {pathspec} ({error})")
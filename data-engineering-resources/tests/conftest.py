@@ -0,0 +1,23 @@
+import os
+import sys
+
+# the scripts in data-engineering-resources aren't a package, import them
+# the way the flows do, from their directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fsspec.asyn import AsyncFileSystem
+
+
+# an async filesystem over the local disk. Like s3fs, an instance can't be
+# used in a process forked after it was made.
+class AsyncLocalFileSystem(AsyncFileSystem):
+    protocol = "asynclocal"
+
+    async def _cat_file(self, path, start=None, end=None, **kwargs):
+        with open(self._strip_protocol(path), "rb") as f:
+            f.seek(start or 0)
+            return f.read(-1 if end is None else end - (start or 0))
+
+    async def _info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        return {"name": path, "size": os.path.getsize(path), "type": "file"}
@@ -0,0 +1,149 @@
+import os
+import json
+from unittest.mock import patch
+
+import fsspec
+import pytest
+
+from conftest import AsyncLocalFileSystem
+
+from tip_utils import tip_hash_ch10
+import ch10_fingerprint
+from ch10_fingerprint import (
+    HASH_SIZE,
+    FingerprintStore,
+    fingerprint,
+    fingerprint_many,
+    _hash_remote,
+)
+
+
+def write_ch10(path, size):
+    # random bytes around the start and the end of what's hashed, the
+    # rest is left sparse so large files are quick to make
+    with open(path, "wb") as f:
+        f.write(os.urandom(min(size, 1024 * 1024)))
+        if size > HASH_SIZE:
+            f.seek(HASH_SIZE - 1024)
+            f.write(os.urandom(2048))
+        f.truncate(size)
+    return str(path)
+
+
+@pytest.fixture(
+    params=[10, 3 * 1024 * 1024 + 7, HASH_SIZE, HASH_SIZE + 1000],
+    ids=["tiny", "smaller", "exactly", "larger"],
+)
+def ch10(request, tmp_path):
+    return write_ch10(tmp_path / "flight.ch10", request.param)
+
+
+def test_local_matches_tip_hash_ch10(ch10):
+    assert fingerprint(ch10) == tip_hash_ch10(ch10)
+    assert fingerprint("file://" + ch10) == tip_hash_ch10(ch10)
+
+
+def test_ranged_reads_match_tip_hash_ch10(ch10):
+    fs = fsspec.filesystem("file")
+    expected = tip_hash_ch10(ch10)
+
+    # small blocks, so there are many reads in flight
+    assert _hash_remote(fs, ch10, block_size=1024 * 1024) == expected
+    assert _hash_remote(fs, ch10, size=os.path.getsize(ch10)) == expected
+
+
+def test_fingerprint_many_keeps_order(tmp_path):
+    paths = [write_ch10(tmp_path / f"{i}.ch10", 1000 + i) for i in range(3)]
+
+    assert fingerprint_many(paths, processes=2) == [tip_hash_ch10(p) for p in paths]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FingerprintStore(str(tmp_path / "store.sqlite"))
+
+
+# the store's fingerprint_many, and the files it had to hash
+def stored_fingerprints(store, jobs, **kwargs):
+    with patch(
+        "ch10_fingerprint.fingerprint_many", wraps=ch10_fingerprint.fingerprint_many
+    ) as mock_many:
+        hashes = store.fingerprint_many(jobs, processes=1, **kwargs)
+    hashed = [job[0] for job in mock_many.call_args.args[0]]
+    return hashes, hashed
+
+
+def test_store_hits_and_misses(store, tmp_path, monkeypatch):
+    a = write_ch10(tmp_path / "a.ch10", 1000)
+    b = write_ch10(tmp_path / "b.ch10", 2000)
+
+    hashes, hashed = stored_fingerprints(store, [a])
+    assert hashes == [tip_hash_ch10(a)] and hashed == [a]
+
+    # a relative path is the same file
+    monkeypatch.chdir(tmp_path)
+    hashes, hashed = stored_fingerprints(store, ["a.ch10", b])
+    assert hashes == [tip_hash_ch10(a), tip_hash_ch10(b)]
+    assert hashed == [b]
+
+    # the same url from another source is another entry
+    _, hashed = stored_fingerprints(store, [(a, None, "other")])
+    assert hashed == [a]
+
+
+def test_store_rehashes_changed_files(store, tmp_path):
+    a = write_ch10(tmp_path / "a.ch10", 1000)
+    stored_fingerprints(store, [a])
+
+    # a new size or version is a new file
+    _, hashed = stored_fingerprints(store, [a], keys=[(1001, "v")])
+    assert hashed == [a]
+    _, hashed = stored_fingerprints(store, [a], keys=[(1001, "v2")])
+    assert hashed == [a]
+    _, hashed = stored_fingerprints(store, [a], keys=[(1001, "v2")])
+    assert hashed == []
+
+    # rewritten in place
+    write_ch10(a, 1000)
+    os.utime(a, ns=(0, 0))
+    hashes, hashed = stored_fingerprints(store, [a])
+    assert hashes == [tip_hash_ch10(a)] and hashed == [a]
+
+
+def test_store_remote_files(store):
+    fs = fsspec.filesystem("memory")
+    fs.pipe_file("/bucket/flight.ch10", b"x" * 1000)
+    spec = json.loads(fs.to_json())
+
+    with patch.object(type(fs), "size", side_effect=AssertionError("size known")):
+        hashes, _ = stored_fingerprints(
+            store, [("bucket/flight.ch10", spec)], keys=[(1000, "etag")]
+        )
+    assert hashes == [fingerprint("/bucket/flight.ch10", fs)]
+
+    # stored under the full URL, however the path was written
+    _, hashed = stored_fingerprints(
+        store, [("memory://bucket/flight.ch10", spec)], keys=[(1000, "etag")]
+    )
+    assert hashed == []
+
+
+def test_store_async_filesystem_in_processes(store, tmp_path):
+    paths = [write_ch10(tmp_path / f"{i}.ch10", 1000 + i) for i in range(3)]
+    spec = json.loads(AsyncLocalFileSystem().to_json())
+
+    # without keys, the files are stat'ed here, before the pool forks
+    hashes = store.fingerprint_many([(p, spec) for p in paths], processes=2)
+    assert hashes == [tip_hash_ch10(p) for p in paths]
+    assert store.get("", "asynclocal://" + paths[0], 1000, "") == hashes[0]
+
+
+def test_store_looks_up_in_one_connection(store, tmp_path):
+    paths = [write_ch10(tmp_path / f"{i}.ch10", 1000 + i) for i in range(5)]
+    store.fingerprint_many(paths, processes=1)
+
+    with patch("ch10_fingerprint.connect", wraps=ch10_fingerprint.connect) as mock:
+        _, hashed = stored_fingerprints(store, paths)
+    assert hashed == []
+    # all looked up at once, and nothing to write
+    assert mock.call_count == 1
@@ -0,0 +1,41 @@
+import json
+
+from conftest import AsyncLocalFileSystem
+from ch10_fingerprint import FingerprintStore, HASH_SIZE, get_filesystem
+from chapter_10_catalog import hash_shard, size_balanced_shards
+from tip_utils import tip_hash_ch10
+
+
+def test_size_balanced_shards():
+    sizes = [50, 40, 30, 20, 10, 10]
+    shards = size_balanced_shards(sizes, 3, lambda size: size)
+
+    assert sorted(map(sum, shards)) == [50, 50, 60]
+    assert sorted(s for shard in shards for s in shard) == sorted(sizes)
+    # more shards than items, the empty ones are dropped
+    assert size_balanced_shards([1], 4, lambda size: size) == [[1]]
+    assert size_balanced_shards([], 4, lambda size: size) == [[]]
+
+
+def test_hash_shards_on_async_filesystem(tmp_path):
+    spec = json.loads(AsyncLocalFileSystem().to_json())
+    jobs = []
+    for i in range(6):
+        path = tmp_path / f"{i}.ch10"
+        path.write_bytes(bytes([i]) * (1000 * (i + 1)))
+        url = f"asynclocal://{path}"
+        jobs.append((url, spec, "test", path.stat().st_size, "v1"))
+
+    store = FingerprintStore(str(tmp_path / "store.sqlite"))
+    # as start and hash_ch10s do, with the filesystem already made in this
+    # process and a pool of more than one
+    get_filesystem(spec).info(str(tmp_path / "0.ch10"))
+    shards = size_balanced_shards(jobs, 2, lambda job: min(job[3], HASH_SIZE))
+    hashes = {}
+    for shard in shards:
+        hashes.update(hash_shard(shard, store, processes=2))
+
+    assert len(shards) == 2
+    assert hashes == {
+        url: tip_hash_ch10(url[len("asynclocal://") :]) for url, *_ in jobs
+    }
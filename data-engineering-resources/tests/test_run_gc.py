@@ -0,0 +1,96 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+import run_gc
+
+
+def parse_runs(*rows):
+    return pd.DataFrame(
+        [(i, h, datetime(2024, 1, day)) for i, h, day in rows],
+        columns=["id", "hash", "created_at"],
+    )
+
+
+def translate_runs(*rows):
+    return pd.DataFrame(
+        [(i, p, datetime(2024, 1, 1)) for i, p in rows],
+        columns=["id", "parse_id", "created_at"],
+    )
+
+
+def test_find_duplicates():
+    runs = parse_runs(("1", "a", 1), ("2", "a", 3), ("3", "b", 2), ("4", "a", 2))
+    assert sorted(run_gc.find_duplicates(runs)) == ["1", "4"]
+
+
+def test_find_duplicates_ties():
+    # older runs created at the same time are both duplicates
+    runs = parse_runs(("1", "a", 1), ("2", "a", 1), ("3", "a", 2))
+    assert sorted(run_gc.find_duplicates(runs)) == ["1", "2"]
+
+    # but with two latest runs, there's nothing to keep
+    runs = parse_runs(("1", "a", 1), ("2", "a", 2), ("3", "a", 2), ("4", "b", 1))
+    with pytest.raises(ValueError, match="'a'"):
+        run_gc.find_duplicates(runs)
+
+
+def test_find_orphans():
+    runs = translate_runs(("t1", "1"), ("t2", "2"), ("t3", "3"))
+    assert run_gc.find_orphans(runs, ["1", "3"]) == ["t2"]
+    assert run_gc.find_orphans(runs, []) == ["t1", "t2", "t3"]
+
+
+def test_plan_collects_translate_runs_of_duplicates():
+    parse = parse_runs(("1", "a", 1), ("2", "a", 2), ("3", "b", 1))
+    # t1 is of a duplicate, t9 of a parse run that's gone
+    translate = translate_runs(("t1", "1"), ("t2", "2"), ("t3", "3"), ("t9", "9"))
+
+    gc_plan = run_gc.plan(parse, translate)
+    assert list(gc_plan.itertuples(index=False, name=None)) == [
+        ("TipParseFlow", "1", "duplicate"),
+        ("TipTranslateFlow", "t1", "orphan"),
+        ("TipTranslateFlow", "t9", "orphan"),
+    ]
+
+    # without duplicates, t1's parse run stays and so does t1
+    gc_plan = run_gc.plan(parse, translate, duplicates=False)
+    assert list(gc_plan["id"]) == ["t9"]
+    gc_plan = run_gc.plan(parse, translate, orphans=False)
+    assert list(gc_plan["id"]) == ["1"]
+
+
+def fake_run(run_id, day, successful=True, tags=(), **data):
+    run = MagicMock(id=run_id, successful=successful, tags=set(tags))
+    run.created_at = datetime(2024, 1, day)
+    run.data = MagicMock(**data)
+    return run
+
+
+def test_invalid_runs_are_skipped():
+    flows = {
+        "TipParseFlow": [
+            fake_run("1", 1),
+            # newer, but failed or already deleted, so "1" isn't a duplicate
+            fake_run("2", 2, successful=False),
+            fake_run("3", 3, tags=["no_data"]),
+        ],
+        "TipTranslateFlow": [
+            fake_run("t1", 1, parse_pointer="1"),
+            fake_run("t2", 2, parse_pointer="2"),
+            fake_run("t3", 3, parse_pointer="3", successful=False),
+        ],
+    }
+
+    with patch("metaflow.Flow", side_effect=flows.get), patch(
+        "run_gc.get_run_hash", return_value="a"
+    ):
+        assert list(run_gc.parse_run_summaries()["id"]) == ["1"]
+        gc_plan = run_gc.plan()
+
+    # t2's parse run isn't valid, and t3 isn't valid itself
+    assert list(gc_plan.itertuples(index=False, name=None)) == [
+        ("TipTranslateFlow", "t2", "orphan")
+    ]
@@ -20,11 +20,46 @@ class TipParseFlow(opal.flow.OpalFlowSpec):
         default=os.path.expanduser("~/parsed_data"),
     )
 
+    upload_part_size = metaflow.Parameter(
+        "upload-part-size",
+        help="multipart part size in bytes for the upload "
+        "(default: $OPAL_UPLOAD_PART_SIZE or 64MB)",
+        type=int,
+        default=None,
+    )
+
+    upload_concurrency = metaflow.Parameter(
+        "upload-concurrency",
+        help="max simultaneous upload requests "
+        "(default: $OPAL_UPLOAD_CONCURRENCY or 10)",
+        type=int,
+        default=None,
+    )
+
+    dedup = metaflow.Parameter(
+        "dedup",
+        help="only upload files whose contents aren't already stored in S3 "
+        "(not with --stream-upload)",
+        type=bool,
+        default=False,
+    )
+
+    stream_upload = metaflow.Parameter(
+        "stream-upload",
+        help="upload parsed files while tip_parse is still running",
+        type=bool,
+        default=False,
+    )
+
     @step
     def start(self):
         """
         Create empty temporary output location, get basic information about the input CH10
         """
+        if self.dedup and self.stream_upload:
+            # streamed files go up as they're written, there's no
+            # content addressed upload to hand them to
+            raise Exception("--dedup can't be used with --stream-upload")
 
         self.ch10_name = ".".join(
             os.path.basename(self.chapter_10_file).split(".")[:-1]
@@ -44,18 +79,31 @@ class TipParseFlow(opal.flow.OpalFlowSpec):
         """
         Use tip_parse to parse the chapter 10 file
         """
-        subprocess.run(
-            [
-                "tip_parse",
-                self.chapter_10_file,
-                "-L",
-                "off",
-                "-o",
+        tip_command = [
+            "tip_parse",
+            self.chapter_10_file,
+            "-L",
+            "off",
+            "-o",
+            self.temp_dir,
+            "-t",
+            "4",
+        ]
+
+        if self.stream_upload:
+            # upload parquet parts as tip finishes them,
+            # _metadata.yaml files go up last
+            with self.upload_while_writing(
                 self.temp_dir,
-                "-t",
-                "4",
-            ]
-        )
+                key="parsed_data",
+                part_size=self.upload_part_size,
+                concurrency=self.upload_concurrency,
+            ):
+                # a failed parse leaves the block with an exception, so
+                # the _metadata.yaml files aren't uploaded
+                subprocess.run(tip_command, check=True)
+        else:
+            subprocess.run(tip_command)
 
         self.next(self.extract_metadata)
 
@@ -93,7 +141,15 @@ class TipParseFlow(opal.flow.OpalFlowSpec):
         """
         Move the parsed files up to S3
         """
-        self.upload(self.temp_dir, key="parsed_data")
+        # with stream-upload, everything went up while parsing
+        if not self.stream_upload:
+            self.upload(
+                self.temp_dir,
+                key="parsed_data",
+                part_size=self.upload_part_size,
+                concurrency=self.upload_concurrency,
+                dedup=self.dedup,
+            )
         self.next(self.end)
 
     @card
@@ -6,7 +6,8 @@ import json
 import tempfile
 import fsspec
 
-from tip_utils import already_parsed_hashes, tip_hash_ch10
+from tip_utils import already_parsed_hashes
+from ch10_fingerprint import FingerprintStore
 
 # runs the tip parse flow on this chapter 10 file
 def parse_one(ch10_name):
@@ -21,8 +22,12 @@ def from_files(ch10_inputs):
 
     parsed_hashes = already_parsed_hashes()
 
-    for ch10_file in ch10_inputs:
-        ch10_hash = tip_hash_ch10(ch10_file)
+    # hash them all at once, in a process pool, except files the
+    # fingerprint store has seen unchanged before
+    ch10_inputs = list(ch10_inputs)
+    ch10_hashes = FingerprintStore().fingerprint_many(ch10_inputs)
+
+    for ch10_file, ch10_hash in zip(ch10_inputs, ch10_hashes):
         if ch10_hash in parsed_hashes:
             print(
                 f"This chapter 10 has already been parsed "
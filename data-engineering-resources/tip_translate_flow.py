@@ -33,6 +33,29 @@ class TipTranslateFlow(opal.flow.OpalFlowSpec):
         default="MILSTD1553",
     )
 
+    upload_part_size = metaflow.Parameter(
+        "upload-part-size",
+        help="multipart part size in bytes for the upload "
+        "(default: $OPAL_UPLOAD_PART_SIZE or 64MB)",
+        type=int,
+        default=None,
+    )
+
+    upload_concurrency = metaflow.Parameter(
+        "upload-concurrency",
+        help="max simultaneous upload requests "
+        "(default: $OPAL_UPLOAD_CONCURRENCY or 10)",
+        type=int,
+        default=None,
+    )
+
+    dedup = metaflow.Parameter(
+        "dedup",
+        help="only upload files whose contents aren't already stored in S3",
+        type=bool,
+        default=False,
+    )
+
     @step
     def start(self):
         """
@@ -113,7 +136,13 @@ class TipTranslateFlow(opal.flow.OpalFlowSpec):
         """
         Move the translated files up to S3
         """
-        self.upload(self.temp_dir, key="translated_data")
+        self.upload(
+            self.temp_dir,
+            key="translated_data",
+            part_size=self.upload_part_size,
+            concurrency=self.upload_concurrency,
+            dedup=self.dedup,
+        )
         self.next(self.end)
 
     @card
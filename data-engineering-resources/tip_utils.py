@@ -1,7 +1,5 @@
 import metaflow
 import hashlib
-import opal.flow
-import pandas as pd
 from pathlib import Path
 
 # SHA-256 hash of the first 150MB of a chapter 10
@@ -63,62 +61,35 @@ def already_parsed_hashes():
     }
 
 
+# ids of parse runs with the same chapter 10 hash as a newer parse run
+# (see run_gc.py)
 def get_duplicate_parse_runs():
-    # get a dataframe of metadata about the parse runs
-    data = [
-        {"id": r.id, "hash": get_run_hash(r), "create": r.created_at}
-        for r in metaflow.Flow("TipParseFlow")
-        if r.successful and not "no_data" in r.tags
-    ]
-    data_df = pd.DataFrame(data)
-
-    # find the latest run for each unique hash
-    latest_of_each_hashes = data_df.groupby("hash")["create"].max()
-    latest_of_each = latest_of_each_hashes.to_frame().merge(data_df)
-
-    # put together a list of runs to delete
-    to_delete = []
-    for row in latest_of_each.iloc:
-        # delete a run if it has the same hash as a latest run,
-        # and is not the latest run itself
-        same_hash = data_df["hash"] == row["hash"]
-        not_same_run = data_df["id"] != row["id"]
-        others = data_df[same_hash & not_same_run]
-
-        # make sure we aren't deleting anything newer than the latest run
-        assert all(row["create"] > others["create"])
-        to_delete.append(others)
-
-    # return the ids
-    return list(pd.concat(to_delete)["id"])
+    import run_gc
 
+    return run_gc.find_duplicates(run_gc.parse_run_summaries())
 
+
+# translate runs whose parse run doesn't exist anymore (see run_gc.py)
 def get_orphan_translated_runs():
-    valid_parse_runs = {
-        r.id
-        for r in metaflow.Flow("TipParseFlow")
-        if r.successful and not "no_data" in r.tags
-    }
+    import run_gc
 
-    # return all translate flow whose parse run ids are not in valid_parse_runs
-    for run in metaflow.Flow("TipTranslateFlow"):
-        if not run.successful or "no_data" in run.tags:
-            continue
-        if not run.data.parse_run.id in valid_parse_runs:
-            yield run
+    valid_parse_ids = run_gc.parse_run_summaries()["id"]
+    translate_runs = run_gc.translate_run_summaries()
+    flow = metaflow.Flow("TipTranslateFlow")
+    for run_id in run_gc.find_orphans(translate_runs, valid_parse_ids):
+        yield flow[run_id]
 
 
 if __name__ == "__main__":
     import sys
+    import run_gc
 
+    # run_gc.py does both at once
     if sys.argv[1] == "delete-parsed-duplicates":
-        flow = metaflow.Flow("TipParseFlow")
-        delete_ids = get_duplicate_parse_runs()
-        for delete_id in delete_ids:
-            run = flow[delete_id]
-            print(f"Deleting {delete_id}")
-            opal.flow.delete_run_data(run)
+        gc_plan = run_gc.plan(orphans=False)
     elif sys.argv[1] == "delete-translated-orphans":
-        for run in get_orphan_translated_runs():
-            opal.flow.delete_run_data(run)
-            print(f"Deleting {run.id}")
+        gc_plan = run_gc.plan(duplicates=False)
+    else:
+        sys.exit(f"Unknown command {sys.argv[1]}")
+    for pathspec, error in run_gc.execute(gc_plan).items():
+        print(f"Failed to delete {pathspec} ({error})")
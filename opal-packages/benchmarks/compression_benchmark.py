@@ -0,0 +1,118 @@
+# Compares uploading a file as-is against uploading it compressed
+# with each opal.flow codec.
+#
+#   python compression_benchmark.py [FILE] [--mbps 100] [--s3root s3://bucket/prefix]
+#
+# For each codec it reports the stored size, compression and decompression
+# time, and the transfer time: estimated from --mbps, or measured with the
+# upload engine when --s3root is given (needs S3_ENDPOINT and credentials).
+import argparse
+import os
+import tempfile
+import time
+
+from opal.flow.compression import (
+    CODEC_EXTENSIONS,
+    compress_file,
+    decompress_stream,
+)
+
+DEFAULT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "..",
+    "resources",
+    "652200104150842.ch10",
+)
+
+
+def available_codecs():
+    codecs = [None, "gzip"]
+    try:
+        import zstandard
+
+        codecs.append("zstd")
+    except ImportError:
+        print("zstandard isn't installed, skipping zstd")
+    return codecs
+
+
+def time_upload(path, s3root):
+    from opal.flow.transfer import UploadEngine
+
+    engine = UploadEngine(s3root, progress=False)
+    start = time.perf_counter()
+    engine.upload([(f"compression_benchmark/{os.path.basename(path)}", path)])
+    return time.perf_counter() - start
+
+
+def bench(path, codec, mbps, s3root, tmp_dir):
+    size = os.path.getsize(path)
+    compress_s = decompress_s = 0.0
+    stored = path
+
+    if codec is not None:
+        stored = os.path.join(tmp_dir, os.path.basename(path) + CODEC_EXTENSIONS[codec])
+        start = time.perf_counter()
+        compress_file(path, stored, codec)
+        compress_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(stored, "rb") as f, decompress_stream(f, codec) as d:
+            while d.read(1024 * 1024):
+                pass
+        decompress_s = time.perf_counter() - start
+
+    stored_size = os.path.getsize(stored)
+    if s3root:
+        transfer_s = time_upload(stored, s3root)
+    else:
+        transfer_s = stored_size * 8 / (mbps * 1e6)
+
+    return {
+        "codec": codec or "none",
+        "stored_mb": stored_size / 1e6,
+        "ratio": size / stored_size,
+        "compress_s": compress_s,
+        "transfer_s": transfer_s,
+        "total_s": compress_s + transfer_s,
+        "decompress_s": decompress_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("opal.flow compression benchmark")
+    parser.add_argument("file", nargs="?", default=DEFAULT_FILE)
+    parser.add_argument(
+        "--mbps", type=float, default=100.0, help="bandwidth for estimated transfers"
+    )
+    parser.add_argument("--s3root", help="measure real uploads under this S3 root")
+    args = parser.parse_args()
+
+    print(f"{args.file}: {os.path.getsize(args.file) / 1e6:.2f} MB")
+    if not args.s3root:
+        print(f"transfer times estimated at {args.mbps} Mb/s")
+
+    header = [
+        "codec",
+        "stored_mb",
+        "ratio",
+        "compress_s",
+        "transfer_s",
+        "total_s",
+        "decompress_s",
+    ]
+    print("".join(f"{h:>14}" for h in header))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in available_codecs():
+            row = bench(args.file, codec, args.mbps, args.s3root, tmp_dir)
+            print(
+                "".join(
+                    f"{row[h]:>14}" if isinstance(row[h], str) else f"{row[h]:>14.3f}"
+                    for h in header
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Compares the original publish serializer
+# (json.dumps(default=publish_serializer)) against opal.publish's
+# encode_payload, with and without a size cap, and gzipped sizes.
+#
+#   python serializer_benchmark.py [--rows 1000000] [--repeat 3]
+#
+# The payload looks like a tip parse run: tip_metadata dicts, a
+# DataFrame of per-channel stats, and numeric arrays.
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from opal.publish import publish_serializer
+from opal.publish.serializer import GZIP_LEVEL, encode_payload
+
+MAX_ARTIFACT_BYTES = 1024 * 1024
+
+
+def tip_metadata(n_channels):
+    return {
+        "MILSTD1553_F1": {
+            "type": "MILSTD1553_F1",
+            "provenance": {"time": "2024-01-01 00:00:00", "version": "1.0.0"},
+            "runtime": {"tmats_present": True, "chunk_bytes": 200000000},
+            "channels": {
+                str(c): {"rt_count": 12, "msg_count": 1000 + c}
+                for c in range(n_channels)
+            },
+        }
+    }
+
+
+def make_payload(rows):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame(
+        {
+            "channel_id": rng.integers(0, 64, rows),
+            "time": rng.integers(0, 2**62, rows),
+            "value": rng.normal(size=rows),
+            "valid": rng.random(rows) > 0.01,
+        }
+    )
+    return {
+        "tip_metadata": tip_metadata(64),
+        "message_stats": frame,
+        "timestamps": rng.integers(0, 2**62, rows),
+        "words": rng.random((rows // 32, 32)),
+        "id": "1234",
+    }
+
+
+def original(payload):
+    return json.dumps(payload, default=publish_serializer)
+
+
+def encoders():
+    return {
+        "original": original,
+        "fast": encode_payload,
+        "fast+cap": lambda p: encode_payload(p, max_artifact_bytes=MAX_ARTIFACT_BYTES),
+    }
+
+
+def bench(encode, payload, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(payload)
+        times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    gz = gzip.compress(body.encode("utf-8"), compresslevel=GZIP_LEVEL, mtime=0)
+    gzip_s = time.perf_counter() - start
+    return {
+        "encode_s": min(times),
+        "payload_mb": len(body) / 1e6,
+        "gzip_mb": len(gz) / 1e6,
+        "gzip_s": gzip_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("opal.publish serializer benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = make_payload(args.rows)
+    print(f"{args.rows} rows, best of {args.repeat}")
+
+    header = ["encoder", "encode_s", "payload_mb", "gzip_mb", "gzip_s"]
+    print("".join(f"{h:>14}" for h in header))
+    for name, encode in encoders().items():
+        row = dict(encoder=name, **bench(encode, payload, args.repeat))
+        print(
+            "".join(
+                f"{row[h]:>14}" if isinstance(row[h], str) else f"{row[h]:>14.3f}"
+                for h in header
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
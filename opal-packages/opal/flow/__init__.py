@@ -1,3 +1,15 @@
-from .flow_script_utils import publish_run, upload, delete_run_data
+from .flow_script_utils import (
+    publish_run,
+    publish_runs,
+    reconcile_runs,
+    upload,
+    delete_run_data,
+)
 from .opal_flowspec import OpalFlowSpec
-from .other_utils import minio_s3fs
+from .other_utils import minio_s3fs, minio_s3_client, get_s3fs, get_s3_client
+from .transfer import UploadEngine, DedupUploadEngine
+from .streaming import UploadWatcher
+from .compression import open_artifact
+from .cache import LocalCacheFileSystem, cached_minio_s3fs
+from .bulk import bulk_exists, bulk_ls, bulk_cat_json
+from .deletion import delete_s3_urls
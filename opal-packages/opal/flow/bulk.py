@@ -0,0 +1,102 @@
+import json
+import asyncio
+import concurrent.futures
+from fsspec.asyn import sync
+from .other_utils import minio_s3fs
+
+# Bulk versions of small, latency bound S3 calls (exists, ls, reading
+# little JSON files) for loops over many baskets. Requests are sent
+# concurrently, at most `concurrency` at a time, and results come back
+# as a dict keyed by path.
+#
+#   metadata = bulk_cat_json([f"{b}/basket_metadata.json" for b in baskets])
+#
+# With return_exceptions=True a failed path maps to its exception instead
+# of raising it (like asyncio.gather), see `unwrap`.
+
+DEFAULT_CONCURRENCY = 32
+
+
+# the value of a bulk result, raising it if it's an exception
+def unwrap(result):
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+async def _gather(paths, func, concurrency, return_exceptions):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(path):
+        async with semaphore:
+            return await func(path)
+
+    results = await asyncio.gather(
+        *(one(p) for p in paths), return_exceptions=return_exceptions
+    )
+    return dict(zip(paths, results))
+
+
+# await async_method(fs, path) for every path, or call method(fs, path)
+# in a thread pool for filesystems that aren't async
+def _bulk(fs, paths, async_method, method, concurrency, return_exceptions):
+    fs = minio_s3fs() if fs is None else fs
+    paths = list(dict.fromkeys(paths))
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+
+    if getattr(fs, "async_impl", False):
+        return sync(
+            fs.loop,
+            _gather,
+            paths,
+            lambda p: async_method(fs, p),
+            concurrency,
+            return_exceptions,
+        )
+
+    def call(path):
+        try:
+            return method(fs, path)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        return dict(zip(paths, pool.map(call, paths)))
+
+
+def bulk_exists(paths, fs=None, concurrency=None, return_exceptions=False):
+    return _bulk(
+        fs,
+        paths,
+        lambda fs, p: fs._exists(p),
+        lambda fs, p: fs.exists(p),
+        concurrency,
+        return_exceptions,
+    )
+
+
+def bulk_ls(paths, fs=None, detail=False, concurrency=None, return_exceptions=False):
+    return _bulk(
+        fs,
+        paths,
+        lambda fs, p: fs._ls(p, detail=detail),
+        lambda fs, p: fs.ls(p, detail=detail),
+        concurrency,
+        return_exceptions,
+    )
+
+
+def bulk_cat_json(paths, fs=None, concurrency=None, return_exceptions=False):
+    async def cat_json(fs, path):
+        return json.loads(await fs._cat_file(path))
+
+    return _bulk(
+        fs,
+        paths,
+        cat_json,
+        lambda fs, p: json.loads(fs.cat_file(p)),
+        concurrency,
+        return_exceptions,
+    )
@@ -0,0 +1,254 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+import fsspec
+from .other_utils import minio_s3fs
+from opal.query.sqlite import connect
+
+# Read-through cache of S3 files on node-local disk.
+#
+#   fs = opal.flow.cached_minio_s3fs()
+#   df = pd.read_parquet("bucket/path/NAV.parquet", filesystem=fs)
+#
+# The first read of a file downloads the whole file into the cache
+# directory. Later reads come from local disk as long as the object's
+# ETag hasn't changed. The least recently used files are evicted to keep
+# the cache under its byte budget. Listings, info and writes go straight
+# to the wrapped filesystem.
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "opal", "s3")
+DEFAULT_MAX_BYTES = 10 * 1024**3  # 10GB
+
+CACHE_DIR_ENV = "OPAL_CACHE_DIR"
+MAX_BYTES_ENV = "OPAL_CACHE_MAX_BYTES"
+
+
+class LocalCacheFileSystem(fsspec.AbstractFileSystem):
+    protocol = "opalcache"
+    # caching is handled by cached_minio_s3fs, and instances hold
+    # connections to the wrapped filesystem
+    cachable = False
+
+    def __init__(self, fs, cache_dir=None, max_bytes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fs = fs
+        self.cache_dir = os.path.abspath(
+            os.path.expanduser(
+                cache_dir or os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+            )
+        )
+        self.max_bytes = int(
+            max_bytes or os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES)
+        )
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.index_path = os.path.join(self.cache_dir, "index.sqlite")
+        with self._index() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, etag TEXT, size INTEGER, "
+                "local TEXT, last_access REAL)"
+            )
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_from_cache = 0
+        self.bytes_downloaded = 0
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        if isinstance(path, list):
+            return [cls._strip_protocol(p) for p in path]
+        for prefix in ("opalcache://", "s3://", "s3a://"):
+            if path.startswith(prefix):
+                path = path[len(prefix) :]
+        return path.rstrip("/")
+
+    def _index(self):
+        return connect(self.index_path)
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            bytes_from_cache=self.bytes_from_cache,
+            bytes_downloaded=self.bytes_downloaded,
+            cached_bytes=self.cached_bytes(),
+        )
+
+    def cached_bytes(self):
+        with self._index() as db:
+            return db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    # drop everything (or just `path`) from the cache
+    def clear_cache(self, path=None):
+        with self._index() as db:
+            if path is None:
+                rows = db.execute("SELECT local FROM files").fetchall()
+                db.execute("DELETE FROM files")
+            else:
+                path = self._strip_protocol(path)
+                rows = db.execute(
+                    "SELECT local FROM files WHERE path = ?", (path,)
+                ).fetchall()
+                db.execute("DELETE FROM files WHERE path = ?", (path,))
+        for (local,) in rows:
+            self._remove_local(local)
+
+    def _remove_local(self, local):
+        try:
+            os.remove(os.path.join(self.cache_dir, local))
+        except FileNotFoundError:
+            pass
+
+    # the cached copy of `path` if it's still current, otherwise None
+    def _lookup(self, path, etag):
+        with self._index() as db:
+            row = db.execute(
+                "SELECT local, etag FROM files WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            local, cached_etag = row
+            local_path = os.path.join(self.cache_dir, local)
+            if cached_etag != etag or not os.path.exists(local_path):
+                # changed in S3 since it was cached
+                db.execute("DELETE FROM files WHERE path = ?", (path,))
+                self._remove_local(local)
+                return None
+
+            db.execute(
+                "UPDATE files SET last_access = ? WHERE path = ?", (time.time(), path)
+            )
+            return local_path
+
+    def _download(self, path, etag, size):
+        local = hashlib.sha256(f"{path}\0{etag}".encode("utf-8")).hexdigest()
+        local_path = os.path.join(self.cache_dir, local)
+
+        # download next to the final name so a reader never sees half a file
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self.fs.get_file(path, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self._index() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (path, etag, size, local, time.time()),
+            )
+        self._evict()
+        return local_path
+
+    # remove least recently used files until we're within budget
+    def _evict(self):
+        with self._index() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            rows = db.execute(
+                "SELECT path, local, size FROM files ORDER BY last_access"
+            ).fetchall()
+            for path, local, size in rows:
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM files WHERE path = ?", (path,))
+                self._remove_local(local)
+                total -= size
+
+    def _open(self, path, mode="rb", **kwargs):
+        path = self._strip_protocol(path)
+        if mode != "rb":
+            # writes go straight through, and make any cached copy stale
+            self.clear_cache(path)
+            return self.fs.open(path, mode, **kwargs)
+
+        info = self.fs.info(path)
+        etag = info.get("ETag") or info.get("etag")
+        size = info.get("size", 0)
+
+        if etag is None or size > self.max_bytes:
+            # can't tell when it changes, or too big to ever keep
+            return self.fs.open(path, mode, **kwargs)
+
+        f = self._open_local(self._lookup(path, etag))
+        with self._lock:
+            if f is not None:
+                self.hits += 1
+                self.bytes_from_cache += size
+            else:
+                self.misses += 1
+                self.bytes_downloaded += size
+
+        if f is None:
+            f = self._open_local(self._download(path, etag, size))
+        if f is None:
+            # evicted again straight away, read it from S3 this time
+            f = self.fs.open(path, mode, **kwargs)
+        return f
+
+    # the cached file at local_path, or None if there isn't one. Another
+    # thread or process can evict it between the lookup and the open.
+    def _open_local(self, local_path):
+        if local_path is None:
+            return None
+        try:
+            return open(local_path, "rb")
+        except FileNotFoundError:
+            return None
+
+    # everything but reading file contents goes to the wrapped filesystem
+    def ls(self, path, detail=True, **kwargs):
+        return self.fs.ls(self._strip_protocol(path), detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        return self.fs.info(self._strip_protocol(path), **kwargs)
+
+    def mkdir(self, path, create_parents=True, **kwargs):
+        return self.fs.mkdir(self._strip_protocol(path), create_parents, **kwargs)
+
+    def makedirs(self, path, exist_ok=False):
+        return self.fs.makedirs(self._strip_protocol(path), exist_ok=exist_ok)
+
+    def rm(self, path, recursive=False, maxdepth=None):
+        for p in self.expand_path(path, recursive=recursive, maxdepth=maxdepth):
+            self.clear_cache(p)
+        return self.fs.rm(self._strip_protocol(path), recursive, maxdepth)
+
+    def put_file(self, lpath, rpath, **kwargs):
+        self.clear_cache(rpath)
+        return self.fs.put_file(lpath, self._strip_protocol(rpath), **kwargs)
+
+    def invalidate_cache(self, path=None):
+        # fsspec's listings cache, not the file cache
+        return self.fs.invalidate_cache(path)
+
+
+_cached_fs = {}
+_cached_fs_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    # the wrapped filesystems aren't usable in a forked child
+    os.register_at_fork(after_in_child=_cached_fs.clear)
+
+
+# get a LocalCacheFileSystem over OPAL minio. Use it anywhere minio_s3fs()
+# is used for reading. One is shared per process for each cache directory.
+def cached_minio_s3fs(cache_dir=None, max_bytes=None):
+    fs = minio_s3fs()
+    # the cached wrapper keeps fs alive, so its id can't be reused
+    key = (id(fs), cache_dir, max_bytes)
+    with _cached_fs_lock:
+        if key not in _cached_fs:
+            _cached_fs[key] = LocalCacheFileSystem(
+                fs, cache_dir=cache_dir, max_bytes=max_bytes
+            )
+        return _cached_fs[key]
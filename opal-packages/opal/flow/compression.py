@@ -0,0 +1,189 @@
+import io
+import os
+import gzip
+import shutil
+from .other_utils import minio_s3fs
+
+# Opt-in compression for artifacts that aren't already compressed
+# (raw chapter 10s, TMATS text, DTS and tip metadata yaml, ...).
+# Compressed files are stored with the codec's extension added to their
+# name, and open_artifact undoes it transparently.
+
+# codec name -> extension added to compressed files
+CODEC_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# files worth compressing. Parquet (and anything else already
+# compressed) gains almost nothing and is left alone.
+COMPRESSIBLE_EXTENSIONS = (".ch10", ".c10", ".txt", ".yaml", ".yml", ".json", ".csv")
+
+COPY_BUF_SIZE = 1024 * 1024
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd compression needs the zstandard package: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+def check_codec(codec):
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"Unknown codec {codec}, use one of {list(CODEC_EXTENSIONS)}")
+    if codec == "zstd":
+        _zstandard()
+
+
+def is_compressible(path):
+    return path.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+# the codec a file was compressed with, from its name
+def codec_of(path):
+    for codec, ext in CODEC_EXTENSIONS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+
+# the name a file was uploaded under, before compression
+def strip_codec_extension(path):
+    codec = codec_of(path)
+    return path[: -len(CODEC_EXTENSIONS[codec])] if codec else path
+
+
+# compress `src` into `dst`. The output only depends on the input
+# (no timestamps in headers), and dst gets src's mtime, so upload
+# checkpoints still recognise unchanged files.
+def compress_file(src, dst, codec, level=None):
+    check_codec(codec)
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        if codec == "gzip":
+            level = 6 if level is None else level
+            with gzip.GzipFile(
+                filename="", mode="wb", fileobj=fout, compresslevel=level, mtime=0
+            ) as gz:
+                shutil.copyfileobj(fin, gz, COPY_BUF_SIZE)
+        else:
+            level = 3 if level is None else level
+            cctx = _zstandard().ZstdCompressor(level=level)
+            cctx.copy_stream(fin, fout, read_size=COPY_BUF_SIZE)
+
+    st = os.stat(src)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return dst
+
+
+# GzipFile that closes the file it reads from when it's closed, as
+# zstandard's stream_reader does with closefd=True
+class _ClosingGzipFile(gzip.GzipFile):
+    def close(self):
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+
+# wrap a binary file object so reads come out decompressed. Closing the
+# wrapper closes fileobj.
+def decompress_stream(fileobj, codec):
+    check_codec(codec)
+    if codec == "gzip":
+        return _ClosingGzipFile(fileobj=fileobj, mode="rb")
+    return _zstandard().ZstdDecompressor().stream_reader(fileobj, closefd=True)
+
+
+# Takes (key, path, size) items and yields them back, with compressible
+# files replaced by a compressed copy in `staging_dir` and the codec
+# extension added to their key.
+def compress_upload_files(files, staging_dir, codec, level=None):
+    check_codec(codec)
+    ext = CODEC_EXTENSIONS[codec]
+    for i, (key, path, *_) in enumerate(files):
+        if not is_compressible(path):
+            yield key, path, os.path.getsize(path)
+            continue
+
+        # keep the file name for readability, the index keeps it unique
+        dst = os.path.join(staging_dir, f"{i}_{os.path.basename(path)}{ext}")
+        compress_file(path, dst, codec, level)
+        yield key + ext, dst, os.path.getsize(dst)
+
+
+# Stages weave upload items ([{"path": ..., "stub": ...}]) for a
+# compressed basket upload. Compressible files are compressed into
+# `staging_dir`. Directories are mirrored there, with compressible files
+# inside compressed and everything else hard linked (or copied when
+# linking isn't possible). Returns the new upload items and the list of
+# compressed files, relative to the basket.
+def compress_basket_items(upload_items, staging_dir, codec, level=None):
+    check_codec(codec)
+    ext = CODEC_EXTENSIONS[codec]
+    items = []
+    compressed = []
+
+    for item in upload_items:
+        src = os.path.abspath(item["path"])
+        name = os.path.basename(src)
+
+        if item.get("stub", False):
+            # stubs only record the path, there's nothing to compress
+            items.append(item)
+        elif os.path.isdir(src):
+            for root, _, files in os.walk(src):
+                rdir = os.path.relpath(root, os.path.dirname(src))
+                os.makedirs(os.path.join(staging_dir, rdir), exist_ok=True)
+                for f in files:
+                    fsrc = os.path.join(root, f)
+                    if is_compressible(f):
+                        compress_file(
+                            fsrc, os.path.join(staging_dir, rdir, f + ext), codec, level
+                        )
+                        compressed.append(f"{rdir}/{f}{ext}".replace(os.sep, "/"))
+                    else:
+                        _link_or_copy(fsrc, os.path.join(staging_dir, rdir, f))
+            items.append(dict(item, path=os.path.join(staging_dir, name)))
+        elif is_compressible(src):
+            dst = compress_file(
+                src, os.path.join(staging_dir, name + ext), codec, level
+            )
+            compressed.append(name + ext)
+            items.append(dict(item, path=dst))
+        else:
+            items.append(item)
+
+    return items, compressed
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+# Opens an artifact uploaded by OPAL for reading, decompressing it if it
+# was uploaded with compression. `path` can be the original name
+# (".../_metadata.yaml") or the stored name (".../_metadata.yaml.zst").
+# mode is "rb" or "r" (text). fs defaults to OPAL minio.
+def open_artifact(path, mode="rb", fs=None, encoding="utf-8"):
+    if mode not in ("r", "rb"):
+        raise ValueError(f"open_artifact is read only: mode={mode}")
+    fs = minio_s3fs() if fs is None else fs
+
+    codec = codec_of(path)
+    if codec is None and not fs.exists(path):
+        # look for a compressed version of it
+        for c, ext in CODEC_EXTENSIONS.items():
+            if fs.exists(path + ext):
+                path, codec = path + ext, c
+                break
+
+    f = fs.open(path, "rb")
+    if codec is not None:
+        f = decompress_stream(f, codec)
+    return io.TextIOWrapper(f, encoding=encoding) if mode == "r" else f
@@ -0,0 +1,98 @@
+import concurrent.futures
+from botocore.exceptions import BotoCoreError, ClientError
+from .other_utils import minio_s3_client
+from .transfer import split_s3_url, batched
+
+# Bulk S3 deletion. Each url is deleted like s3fs.rm(url, recursive=True):
+# the object at url and everything under url/. Every url is listed once,
+# and the keys are deleted with DeleteObjects, up to 1000 per request
+# (the S3 limit), `concurrency` requests at a time.
+#
+#   report = delete_s3_urls(run.data.data_files.values())
+#   if report.ok: ...
+
+MAX_KEYS_PER_DELETE = 1000
+DEFAULT_CONCURRENCY = 8
+
+
+class DeleteReport:
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        # s3 url (of an object, or of a url that couldn't be listed)
+        # -> error message
+        self.failed = {}
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return (
+            f"DeleteReport(objects={self.objects}, bytes={self.bytes}, "
+            f"failed={len(self.failed)})"
+        )
+
+
+# (key, size) of the object at prefix and every object under prefix/
+def list_keys(client, bucket, prefix):
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            # the prefix also matches siblings like prefix_old
+            if not prefix or key == prefix or key.startswith(prefix + "/"):
+                yield key, obj.get("Size", 0)
+
+
+def _delete_batch(client, bucket, objects):
+    res = client.delete_objects(
+        Bucket=bucket,
+        Delete={"Objects": [{"Key": key} for key, _ in objects], "Quiet": True},
+    )
+    return {
+        e["Key"]: f"{e.get('Code')}: {e.get('Message')}" for e in res.get("Errors", [])
+    }
+
+
+# Delete keys from bucket, MAX_KEYS_PER_DELETE per request. Returns
+# {key: error message} for the keys that couldn't be deleted.
+def delete_keys(client, bucket, keys):
+    errors = {}
+    for batch in batched([(key, 0) for key in keys], MAX_KEYS_PER_DELETE):
+        errors.update(_delete_batch(client, bucket, batch))
+    return errors
+
+
+def delete_s3_urls(urls, client=None, concurrency=None):
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    client = client or minio_s3_client(max_pool_connections=concurrency)
+    report = DeleteReport()
+
+    batches = []
+    for url in dict.fromkeys(urls):
+        bucket, prefix = split_s3_url(url)
+        try:
+            objects = list(list_keys(client, bucket, prefix))
+        except (ClientError, BotoCoreError) as e:
+            report.failed[url] = str(e)
+            continue
+        batches += [(bucket, b) for b in batched(objects, MAX_KEYS_PER_DELETE)]
+
+    def delete(batch):
+        bucket, objects = batch
+        try:
+            return _delete_batch(client, bucket, objects)
+        except (ClientError, BotoCoreError) as e:
+            # e.g. EndpointConnectionError, the whole batch failed
+            return {key: str(e) for key, _ in objects}
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        for (bucket, objects), errors in zip(batches, pool.map(delete, batches)):
+            for key, size in objects:
+                if key in errors:
+                    report.failed[f"s3://{bucket}/{key}"] = errors[key]
+                else:
+                    report.objects += 1
+                    report.bytes += size
+    return report
@@ -1,9 +1,63 @@
 import metaflow
 import os
-import pathlib as pl
+import fnmatch
 import json
 import opal.publish
-from .other_utils import minio_s3fs
+import opal.publish.spool
+import opal.publish.reconcile
+from .transfer import UploadEngine
+from .deletion import delete_s3_urls
+
+# symlink policies for walk_upload_tree:
+#   "files"  - follow links to files, but don't descend into linked
+#              directories (same as os.walk)
+#   "follow" - follow every link, visiting each real directory once
+#   "skip"   - ignore links entirely
+SYMLINK_POLICIES = ("files", "follow", "skip")
+
+
+# Lazily walks a directory, yielding (key, path, size) for every file
+# under it, where key is `key` + the file's path relative to `folder`.
+# include / exclude are lists of glob patterns matched against that
+# relative path (e.g. "*.parquet", "tmp/*"). A directory matching an
+# exclude pattern isn't walked at all.
+def walk_upload_tree(folder, key, include=None, exclude=None, symlinks="files"):
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"symlinks must be one of {SYMLINK_POLICIES}: {symlinks}")
+
+    folder = os.path.abspath(os.path.expanduser(folder))
+    follow = symlinks == "follow"
+    visited = {os.path.realpath(folder)}
+
+    def matches(rpath, patterns):
+        return any(fnmatch.fnmatchcase(rpath, p) for p in patterns)
+
+    # (directory, its path relative to folder)
+    stack = [(folder, "")]
+    while stack:
+        directory, rdir = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                rpath = f"{rdir}/{entry.name}" if rdir else entry.name
+
+                if symlinks == "skip" and entry.is_symlink():
+                    continue
+                if exclude and matches(rpath, exclude):
+                    continue
+
+                if entry.is_dir(follow_symlinks=follow):
+                    if follow:
+                        # don't go around symlink loops
+                        real = os.path.realpath(entry.path)
+                        if real in visited:
+                            continue
+                        visited.add(real)
+                    stack.append((entry.path, rpath))
+                elif entry.is_file():
+                    if include and not matches(rpath, include):
+                        continue
+                    yield f"{key}/{rpath}", entry.path, entry.stat().st_size
+
 
 # metaflow put_files needs a list of (key, path)
 # where key is some string (may be path-like)
@@ -11,52 +65,43 @@ from .other_utils import minio_s3fs
 # constructs that list for a directory.
 # Details here:
 # https://docs.metaflow.org/metaflow/data#store-multiple-objects-or-files
-def get_metaflow_s3_folder_upload_structure(folder, key):
-    folder = os.path.abspath(os.path.expanduser(folder))
-    root = os.path.basename(folder)
-    out = []
-
-    # recursively over the entire directory:
-    for r, _, fs in os.walk(folder):
-        for f in fs:
-            p = pl.Path(r, f)
-            # get the path to `f` just after `root`
-            idx = p.parts.index(root)
-            rpath = pl.Path(key, *p.parts[idx + 1 :])
-            # key to this file `f` is `key` + (`f` path up to `root`)
-            out.append((str(rpath), str(p)))
+# Use walk_upload_tree directly for large directories.
+def get_metaflow_s3_folder_upload_structure(folder, key, **walk_kwargs):
+    return [
+        (rkey, path) for rkey, path, _ in walk_upload_tree(folder, key, **walk_kwargs)
+    ]
 
-    return out
 
-
-# generic upload interace for files or directories
-def upload(run, path, key=None):
+# generic upload interace for files or directories.
+# part_size and concurrency are passed to the UploadEngine
+def upload(run, path, key=None, part_size=None, concurrency=None):
     if not key:
         # use folder name as key if not set
         key = os.path.basename(path)
 
     if os.path.isdir(path):
-        upload = get_metaflow_s3_folder_upload_structure(path, key)
-        with metaflow.S3(run=run) as s3:
-            return s3.put_files(upload)
+        upload = walk_upload_tree(path, key)
     elif os.path.isfile(path):
-        with metaflow.S3(run=run) as s3:
-            return s3.put_files([(key, path)])
+        upload = [(key, path)]
     else:
         raise Exception(f"Argument is not a file or a directory: {path}")
 
+    # metaflow only gives us the S3 root for this run,
+    # the transfer itself is done by the upload engine
+    with metaflow.S3(run=run) as s3:
+        s3root = s3._s3root
+
+    engine = UploadEngine(s3root, part_size=part_size, concurrency=concurrency)
+    return engine.upload(upload)
+
 
 # simple enough - should this run be published?
 def should_publish_run(run):
     return run.successful and not "no_data" in run.tags
 
 
-# publish a metaflow run to the catalog.
-# force=True will ignore results of should_publish_run
-def publish_run(run, force=False):
-    if not should_publish_run(run) and not force:
-        return False
-
+# the catalog metadata for a metaflow run
+def get_run_data(run):
     # get the data in run
     run_data = {k: v.data for k, v in run.data._artifacts.items()}
 
@@ -66,23 +111,97 @@ def publish_run(run, force=False):
     run_data["id"] = run.id
     run_data["successful"] = run.successful
     run_data["flow_id"] = run.parent.id
+    return run_data
 
-    # publish to catalog
-    return opal.publish.publish(run_data["id"], run_data["flow_id"], run_data)
 
+# publish a metaflow run to the catalog.
+# force=True will ignore results of should_publish_run.
+# repost=True publishes even if delta=True finds the run unchanged.
+# spool=True writes the publish to the local publish spool and returns
+# (True, None) as soon as it's on disk, a background thread posts it
+# (see opal.publish.spool).
+# Other keyword arguments (compress, max_artifact_bytes, delta) go to
+# opal.publish.publish
+def publish_run(run, force=False, repost=False, spool=False, **publish_kwargs):
+    if not should_publish_run(run) and not force:
+        return False
 
-def delete_run_data(run):
-    # tag as "no data"
-    run.add_tag("no_data")
+    run_data = get_run_data(run)
 
+    if spool:
+        spooled = opal.publish.spool.enqueue(
+            run_data["id"],
+            run_data["flow_id"],
+            run_data,
+            force=repost,
+            **publish_kwargs,
+        )
+        return (True, None) if spooled else (True, opal.publish.delta.NOT_MODIFIED)
+
+    # publish to catalog
+    return opal.publish.publish(
+        run_data["id"], run_data["flow_id"], run_data, force=repost, **publish_kwargs
+    )
+
+
+# the catalog instances (kind_id, kind_type, kind_metadata dicts) for
+# runs, skipping ones should_publish_run rejects unless force=True.
+# Runs are read lazily.
+def run_instances(runs, force=False):
+    for run in runs:
+        if not should_publish_run(run) and not force:
+            continue
+        run_data = get_run_data(run)
+        yield dict(
+            kind_id=run_data["id"],
+            kind_type=run_data["flow_id"],
+            kind_metadata=run_data,
+        )
+
+
+# publish many metaflow runs to the catalog with opal.publish.publish_many.
+# Runs are read lazily, a chunk at a time. Returns a dict of
+# run id -> (success, status_code) for the runs that were published;
+# runs skipped by should_publish_run (unless force=True) aren't included.
+# Keyword arguments are as for publish_run, except spool.
+def publish_runs(runs, force=False, repost=False, **publish_kwargs):
+    # ids are collected as publish_many consumes the generator, in order
+    ids = []
+
+    def instances():
+        for instance in run_instances(runs, force):
+            ids.append(instance["kind_id"])
+            yield instance
+
+    results = opal.publish.publish_many(instances(), force=repost, **publish_kwargs)
+    return dict(zip(ids, results))
+
+
+# Make the catalog match runs with opal.publish.reconcile.reconcile:
+# only new and changed runs are published, and catalog entries that
+# aren't one of runs are deleted. Returns a ReconcileReport. Keyword
+# arguments (dry_run, concurrency, rate, delete, ...) go to reconcile.
+def reconcile_runs(runs, force=False, **reconcile_kwargs):
+    return opal.publish.reconcile.reconcile(
+        run_instances(runs, force), **reconcile_kwargs
+    )
+
+
+# Delete a run's data: delete its data_files from S3 in bulk (see
+# deletion.py) and, once every object is gone, tag it "no_data" and delete
+# it from the catalog. Returns the DeleteReport of objects and bytes
+# removed and anything that couldn't be deleted. A run with failures isn't
+# tagged and stays in the catalog, so run_gc and the like pick it up again
+# and the deletion is retried.
+def delete_run_data(run, client=None, concurrency=None):
     # delete files if there are any
     try:
         files = run.data.data_files
-        s3fs = minio_s3fs()
-        for _, file in files.items():
-            s3fs.rm(file, recursive=True)
-    except BaseException:
-        pass
-
-    # delete from catalog
-    opal.publish.delete(run.id)
+    except (AttributeError, KeyError):
+        files = {}
+    report = delete_s3_urls(files.values(), client=client, concurrency=concurrency)
+
+    if report.ok:
+        run.add_tag("no_data")
+        opal.publish.delete(run.id)
+    return report
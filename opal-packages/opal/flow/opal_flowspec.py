@@ -1,9 +1,19 @@
 import os
+import tempfile
 
 import metaflow
 import weave
 from metaflow import FlowSpec, current
-from .flow_script_utils import publish_run, get_metaflow_s3_folder_upload_structure
+from .flow_script_utils import publish_run, walk_upload_tree
+from .transfer import UploadEngine, DedupUploadEngine, checkpoint_path
+from .streaming import UploadWatcher
+from .compression import (
+    check_codec,
+    is_compressible,
+    compress_upload_files,
+    compress_basket_items,
+    CODEC_EXTENSIONS,
+)
 
 
 # OPAL-specific subclass of metaflow's FlowSpec base class
@@ -12,34 +22,129 @@ from .flow_script_utils import publish_run, get_metaflow_s3_folder_upload_struct
 class OpalFlowSpec(FlowSpec):
 
     # uploads a file or folder, and puts the s3 path of the
-    # uploaded object into `self.data_files`
-    def upload(self, path, key=None):
+    # uploaded object into `self.data_files`.
+    # part_size (bytes) and concurrency tune the upload engine, and
+    # fall back to OPAL_UPLOAD_PART_SIZE and OPAL_UPLOAD_CONCURRENCY.
+    # dedup=True indexes file contents by hash, and copies files that were
+    # already uploaded by any run server side instead of sending them again
+    # (see DedupUploadEngine). The key -> hash manifest goes in
+    # `self.data_manifests`.
+    # resumable=True checkpoints finished files (under
+    # OPAL_UPLOAD_CHECKPOINT_DIR, see transfer.checkpoint_path), so if the
+    # upload fails partway through, a retry or `resume` of the step only
+    # sends the files that are missing or have changed. dedup uploads don't
+    # need it (indexed files are copied on a retry), so both can't be set.
+    # include, exclude and symlinks control which files in a folder are
+    # uploaded, see flow_script_utils.walk_upload_tree.
+    # compression="gzip" or "zstd" compresses files that aren't already
+    # compressed (ch10, yaml, text, ...) on the way up and records the codec
+    # in `self.data_codecs`. Read them back with opal.flow.open_artifact
+    def upload(
+        self,
+        path,
+        key=None,
+        part_size=None,
+        concurrency=None,
+        dedup=False,
+        resumable=False,
+        include=None,
+        exclude=None,
+        symlinks="files",
+        compression=None,
+    ):
         if not hasattr(self, "data_files"):
             self.data_files = {}
 
+        if compression is not None:
+            check_codec(compression)
+        if dedup and resumable:
+            raise ValueError("dedup and resumable uploads can't be combined")
+
         # use file or folder name if key is not provided
         base = os.path.basename(path)
         if not key:
             key = base
 
+        self._set_s3root()
+
+        # get file or directory upload structure
+        if os.path.isdir(path):
+            upload = walk_upload_tree(
+                path, key, include=include, exclude=exclude, symlinks=symlinks
+            )
+            self.data_files[key] = os.path.join(self.s3root, key)
+        elif os.path.isfile(path):
+            upload = [(base, path)]
+            s3_base = base
+            if compression is not None and is_compressible(path):
+                s3_base += CODEC_EXTENSIONS[compression]
+            self.data_files[key] = os.path.join(self.s3root, s3_base)
+
+        engine_kwargs = dict(part_size=part_size, concurrency=concurrency)
+        if dedup:
+            if not hasattr(self, "data_manifests"):
+                self.data_manifests = {}
+
+            manifest_key = f"_opal_manifests/{key}.json"
+            engine = DedupUploadEngine(self.s3root, manifest_key, **engine_kwargs)
+            self.data_manifests[key] = os.path.join(self.s3root, manifest_key)
+        else:
+            if resumable:
+                # a resumed run picks up the checkpoint of the run it resumes
+                run_id = current.origin_run_id or current.run_id
+                run = f"{current.flow_name}/{run_id}"
+                engine_kwargs["checkpoint"] = checkpoint_path(run, path)
+            engine = UploadEngine(self.s3root, **engine_kwargs)
+
+        if compression is None:
+            engine.upload(upload)
+            return
+
+        if not hasattr(self, "data_codecs"):
+            self.data_codecs = {}
+        self.data_codecs[key] = compression
+
+        with tempfile.TemporaryDirectory() as staging_dir:
+            engine.upload(compress_upload_files(upload, staging_dir, compression))
+
+    # uploads a folder while another program is still writing to it.
+    # Use as a context manager around the program, e.g.
+    #   with self.upload_while_writing(self.temp_dir, key="parsed_data"):
+    #       subprocess.run(["tip_parse", ..., "-o", self.temp_dir])
+    # Files are uploaded once they stop changing for `quiet_period`
+    # seconds, `_metadata.yaml` files go last when the block exits.
+    # The s3 path goes into `self.data_files` like `upload`.
+    def upload_while_writing(
+        self, path, key=None, quiet_period=5.0, part_size=None, concurrency=None
+    ):
+        if not hasattr(self, "data_files"):
+            self.data_files = {}
+
+        if not key:
+            key = os.path.basename(path)
+
+        self._set_s3root()
+        self.data_files[key] = os.path.join(self.s3root, key)
+
+        return UploadWatcher(
+            path,
+            key,
+            self.s3root,
+            quiet_period=quiet_period,
+            part_size=part_size,
+            concurrency=concurrency,
+        )
+
+    def _set_s3root(self):
         with metaflow.S3(run=self) as s3:
             # make sure we save the S3 root path
             self.s3root = s3._s3root
 
-            # remove s3:// - causes problems with pd.read_parquet
-            # on a partitioned parquet directory
-            if self.s3root.startswith("s3://"):
-                cut_out = len("s3://")
-                self.s3root = self.s3root[cut_out:]
-
-            # get file or directory upload structure for metaflow's S3 thing
-            if os.path.isdir(path):
-                upload = get_metaflow_s3_folder_upload_structure(path, key)
-                self.data_files[key] = os.path.join(self.s3root, key)
-            elif os.path.isfile(path):
-                upload = [(base, path)]
-                self.data_files[key] = os.path.join(self.s3root, base)
-            s3.put_files(upload)
+        # remove s3:// - causes problems with pd.read_parquet
+        # on a partitioned parquet directory
+        if self.s3root.startswith("s3://"):
+            cut_out = len("s3://")
+            self.s3root = self.s3root[cut_out:]
 
     def metaflow_upload_basket(self,
                                upload_dict,
@@ -47,28 +152,46 @@ class OpalFlowSpec(FlowSpec):
                                bucket_name = 'basket-data',
                                label = '',
                                parent_ids = [],
-                               metadata = {}):
-        '''A wrapper for metaflow to use weave.upload and track ids.'''
+                               metadata = None,
+                               compression = None):
+        '''A wrapper for metaflow to use weave.upload and track ids.
+
+        compression ("gzip" or "zstd") compresses the ch10, text and yaml
+        files in the basket, and lists them under 'opal_compression' in
+        the basket metadata. Read them back with opal.flow.open_artifact.
+        '''
 
         if not hasattr(self, "basket_uploads"):
             self.basket_uploads = []
 
+        # a copy, the caller's dict isn't changed
+        metadata = dict(metadata or {})
         metadata['metaflow_manifest'] = {'run_id': current.run_id,
                                          'flow_name': current.flow_name}
-        
-        basket_upload_path = weave.upload.UploadBasket(
-            upload_items=upload_dict,
-            basket_type=basket_type,
-            pantry_path=bucket_name,
-            label=label,
-            parent_ids=parent_ids,
-            metadata=metadata,
-        ).get_upload_path()
+
+        with tempfile.TemporaryDirectory() as staging_dir:
+            if compression is not None:
+                upload_dict, compressed = compress_basket_items(upload_dict,
+                                                                staging_dir,
+                                                                compression)
+                metadata['opal_compression'] = {'codec': compression,
+                                                'files': compressed}
+
+            basket_upload_path = weave.upload.UploadBasket(
+                upload_items=upload_dict,
+                basket_type=basket_type,
+                pantry_path=bucket_name,
+                label=label,
+                parent_ids=parent_ids,
+                metadata=metadata,
+            ).get_upload_path()
 
         self.basket_uploads.append(basket_upload_path)
 
         return basket_upload_path
 
-    # simple wrapper for flow_script_utils.publish_run
+    # simple wrapper for flow_script_utils.publish_run.
+    # self.publish(spool=True) returns as soon as the publish is spooled
+    # to local disk instead of waiting on the catalog.
     def publish(self, **kwargs):
         publish_run(self, **kwargs)
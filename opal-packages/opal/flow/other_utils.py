@@ -1,8 +1,144 @@
 import os
+import threading
+import boto3
+import botocore.config
 import s3fs
 
-# get an s3fs object configured for OPAL minio
-def minio_s3fs():
-    return s3fs.S3FileSystem(
-        client_kwargs={"endpoint_url": os.environ["S3_ENDPOINT"]}
+# connection settings shared by every OPAL S3 filesystem and client.
+# Override with the environment variables below.
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_MODE = "adaptive"
+
+POOL_SIZE_ENV = "OPAL_S3_POOL_SIZE"
+MAX_ATTEMPTS_ENV = "OPAL_S3_MAX_ATTEMPTS"
+RETRY_MODE_ENV = "OPAL_S3_RETRY_MODE"
+
+# filesystems and clients are expensive to set up (sessions, TLS), so they
+# are built once per process for each set of settings and reused. The
+# caches are dropped in forked children, which can't share connections
+# (or s3fs's event loop) with their parent.
+_s3fs_cache = {}
+_client_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _clear_caches():
+    global _cache_lock
+    _s3fs_cache.clear()
+    _client_cache.clear()
+    # the parent may have held the lock while forking
+    _cache_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_clear_caches)
+
+
+def _botocore_config(max_pool_connections=None, max_attempts=None, retry_mode=None):
+    return dict(
+        max_pool_connections=max_pool_connections
+        or int(os.environ.get(POOL_SIZE_ENV, DEFAULT_POOL_SIZE)),
+        retries={
+            "max_attempts": max_attempts
+            or int(os.environ.get(MAX_ATTEMPTS_ENV, DEFAULT_MAX_ATTEMPTS)),
+            "mode": retry_mode or os.environ.get(RETRY_MODE_ENV, DEFAULT_RETRY_MODE),
+        },
+        tcp_keepalive=True,
+    )
+
+
+# credentials are part of the cache key so that changed credentials
+# get a new connection instead of a stale cached one
+def _credentials(key, secret):
+    return (
+        key or os.environ.get("AWS_ACCESS_KEY_ID"),
+        secret or os.environ.get("AWS_SECRET_ACCESS_KEY"),
     )
+
+
+# Get a pooled s3fs filesystem for `endpoint_url` (None for AWS).
+# Every call with the same endpoint, credentials and settings returns the
+# same object. anon=True is for public buckets, other keyword arguments
+# go to s3fs.S3FileSystem.
+def get_s3fs(
+    endpoint_url=None,
+    key=None,
+    secret=None,
+    anon=False,
+    region_name=None,
+    max_pool_connections=None,
+    max_attempts=None,
+    retry_mode=None,
+    **kwargs,
+):
+    key, secret = (None, None) if anon else _credentials(key, secret)
+    config = _botocore_config(max_pool_connections, max_attempts, retry_mode)
+    cache_key = (
+        endpoint_url,
+        key,
+        secret,
+        anon,
+        region_name,
+        repr(sorted(config.items())),
+        repr(sorted(kwargs.items())),
+    )
+
+    with _cache_lock:
+        if cache_key not in _s3fs_cache:
+            client_kwargs = {}
+            if endpoint_url:
+                client_kwargs["endpoint_url"] = endpoint_url
+            if region_name:
+                client_kwargs["region_name"] = region_name
+
+            _s3fs_cache[cache_key] = s3fs.S3FileSystem(
+                key=key,
+                secret=secret,
+                anon=anon,
+                client_kwargs=client_kwargs,
+                config_kwargs=config,
+                # we do the caching, so we control the settings
+                skip_instance_cache=True,
+                **kwargs,
+            )
+        return _s3fs_cache[cache_key]
+
+
+# Get a pooled boto3 s3 client, cached like get_s3fs. boto3 clients are
+# thread safe, so one client is shared by all threads.
+# max_pool_connections should be at least the number of threads using it.
+def get_s3_client(
+    endpoint_url=None,
+    key=None,
+    secret=None,
+    max_pool_connections=None,
+    max_attempts=None,
+    retry_mode=None,
+):
+    key, secret = _credentials(key, secret)
+    config = _botocore_config(max_pool_connections, max_attempts, retry_mode)
+    cache_key = (endpoint_url, key, secret, repr(sorted(config.items())))
+
+    with _cache_lock:
+        if cache_key not in _client_cache:
+            # a session per client, the default session isn't thread safe
+            session = boto3.session.Session(
+                aws_access_key_id=key, aws_secret_access_key=secret
+            )
+            _client_cache[cache_key] = session.client(
+                "s3",
+                endpoint_url=endpoint_url,
+                config=botocore.config.Config(**config),
+            )
+        return _client_cache[cache_key]
+
+
+# get an s3fs object configured for OPAL minio
+def minio_s3fs(**kwargs):
+    return get_s3fs(os.environ["S3_ENDPOINT"], **kwargs)
+
+
+# get a boto3 s3 client configured for OPAL minio
+def minio_s3_client(**kwargs):
+    return get_s3_client(os.environ["S3_ENDPOINT"], **kwargs)
@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+from .transfer import UploadEngine, _FileDoneSubscriber
+from .deletion import delete_keys
+
+# files that mark a dataset as finished. These are always uploaded last,
+# after everything else is up, so readers never see a partial dataset.
+FINAL_FILE_NAMES = ("_metadata.yaml",)
+
+
+# Uploads the files in a directory while something else is still writing
+# to it. A background thread polls the directory, and any file whose size
+# and mtime haven't changed for `quiet_period` seconds is considered closed
+# and is handed to the upload engine right away. When the writer is done,
+# `finish` uploads whatever is left (and anything that changed after it was
+# uploaded), deletes uploads of files that are gone (temp files renamed or
+# removed by the writer), then uploads the final marker files.
+#
+# Usage:
+#   with UploadWatcher(directory, key, s3root) as watcher:
+#       subprocess.run(["tip_parse", ..., "-o", directory])
+#
+# Leaving the block with an exception stops the watcher without uploading
+# the final marker files.
+class UploadWatcher:
+    def __init__(
+        self,
+        folder,
+        key,
+        s3root,
+        quiet_period=5.0,
+        poll_interval=1.0,
+        final_names=FINAL_FILE_NAMES,
+        **engine_kwargs,
+    ):
+        self.folder = os.path.abspath(os.path.expanduser(folder))
+        self.key = key
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.final_names = set(final_names)
+        self.engine = UploadEngine(s3root, **engine_kwargs)
+
+        # rel path -> (size, mtime) at the last poll, and when that was first seen
+        self._seen = {}
+        # rel path -> (size, mtime) of the version that was uploaded
+        self._uploaded = {}
+        # rel path -> the future of its latest upload
+        self._futures = {}
+        self._done = 0
+        self._lock = threading.Lock()
+        self._error = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._manager = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.stop()
+        return False
+
+    def start(self):
+        self._manager = self.engine.transfer_manager()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._manager is not None:
+            self._manager.shutdown(cancel=True)
+            self._manager = None
+
+    # upload everything that's left, then the final files.
+    # Returns the list of (key, s3 url) that was uploaded.
+    def finish(self):
+        self._stop.set()
+        self._thread.join()
+
+        try:
+            if self._error is not None:
+                raise self._error
+
+            files = self._scan()
+            final = {r: st for r, st in files.items() if self._is_final(r)}
+            rest = {r: st for r, st in files.items() if not self._is_final(r)}
+
+            for rpath, stat in rest.items():
+                if self._uploaded.get(rpath) != stat:
+                    self._submit(rpath, stat)
+            self._wait()
+            self._remove_gone([r for r in self._uploaded if r not in files])
+
+            for rpath, stat in final.items():
+                self._submit(rpath, stat)
+            self._wait()
+        finally:
+            self._manager.shutdown()
+            self._manager = None
+
+        return [(self._key(r), self.engine.s3_url(self._key(r))) for r in files]
+
+    def _is_final(self, rpath):
+        return os.path.basename(rpath) in self.final_names
+
+    def _key(self, rpath):
+        return "/".join([self.key, *rpath.split(os.sep)])
+
+    # relative path -> (size, mtime) for every file under the folder
+    def _scan(self):
+        out = {}
+        for root, _, files in os.walk(self.folder):
+            for f in files:
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    # removed (e.g. a temp file renamed) since we listed it
+                    continue
+                out[os.path.relpath(path, self.folder)] = (st.st_size, st.st_mtime_ns)
+        return out
+
+    def _watch(self):
+        try:
+            self._poll()
+        except BaseException as e:
+            # raised again by finish()
+            self._error = e
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            now = time.monotonic()
+            for rpath, stat in self._scan().items():
+                if self._is_final(rpath) or rpath in self._uploaded:
+                    continue
+
+                last_stat, since = self._seen.get(rpath, (None, now))
+                if stat != last_stat:
+                    # new or still being written
+                    self._seen[rpath] = (stat, now)
+                elif now - since >= self.quiet_period:
+                    self._submit(rpath, stat)
+
+    def _submit(self, rpath, stat):
+        earlier = self._futures.pop(rpath, None)
+        if earlier is not None:
+            # an older version of the file may still be going up, it must
+            # not finish after (and overwrite) this one
+            earlier.result()
+
+        key = self._key(rpath)
+        path = os.path.join(self.folder, rpath)
+        submit = self.engine._upload_job(path, self.engine.s3_key(key))
+        subscriber = _FileDoneSubscriber(lambda: self._file_done(key, stat[0]))
+        self._futures[rpath] = submit(self._manager, [subscriber])
+        self._uploaded[rpath] = stat
+
+    # delete the uploads of files that were uploaded during polling but
+    # aren't there anymore
+    def _remove_gone(self, rpaths):
+        s3_keys = [self.engine.s3_key(self._key(r)) for r in rpaths]
+        errors = delete_keys(self.engine.client, self.engine.bucket, s3_keys)
+        if errors:
+            raise Exception(f"Could not delete {len(errors)} stale uploads: {errors}")
+        for rpath in rpaths:
+            del self._uploaded[rpath]
+
+    # called from the transfer worker threads.
+    # The total isn't known until the writer is done.
+    def _file_done(self, key, size):
+        with self._lock:
+            self._done += 1
+            if self.engine.progress:
+                self.engine.progress(self._done, "?", key, size)
+
+    def _wait(self):
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.result()
@@ -0,0 +1,509 @@
+import os
+import json
+import hashlib
+import threading
+import concurrent.futures
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
+from .other_utils import minio_s3_client
+
+# defaults for the upload engine. Both can be overridden per upload,
+# or for every upload with the environment variables below.
+DEFAULT_PART_SIZE = 64 * 1024 * 1024  # 64MB
+DEFAULT_CONCURRENCY = 10
+
+PART_SIZE_ENV = "OPAL_UPLOAD_PART_SIZE"
+CONCURRENCY_ENV = "OPAL_UPLOAD_CONCURRENCY"
+
+# content addressed uploads keep their blobs under this prefix,
+# in the same bucket as the run
+CAS_PREFIX_ENV = "OPAL_CAS_PREFIX"
+DEFAULT_CAS_PREFIX = "opal-cas"
+
+# resumable uploads keep their checkpoints here, one per run and path
+CHECKPOINT_DIR_ENV = "OPAL_UPLOAD_CHECKPOINT_DIR"
+DEFAULT_CHECKPOINT_DIR = os.path.join("~", ".cache", "opal", "upload_checkpoints")
+
+# number of files handed to the transfer manager at once
+DEFAULT_BATCH_SIZE = 1000
+
+# S3 won't accept multipart parts smaller than 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+# resolve upload settings: explicit argument, then environment, then default
+def get_upload_config(part_size=None, concurrency=None):
+    if part_size is None:
+        part_size = int(os.environ.get(PART_SIZE_ENV, DEFAULT_PART_SIZE))
+    if concurrency is None:
+        concurrency = int(os.environ.get(CONCURRENCY_ENV, DEFAULT_CONCURRENCY))
+
+    if part_size < MIN_PART_SIZE:
+        raise ValueError(f"Part size must be at least {MIN_PART_SIZE} b: {part_size}")
+    if concurrency < 1:
+        raise ValueError(f"Concurrency must be at least 1: {concurrency}")
+
+    return int(part_size), int(concurrency)
+
+
+# split "s3://bucket/some/prefix" (or "bucket/some/prefix") into
+# ("bucket", "some/prefix")
+def split_s3_url(url):
+    if url.startswith("s3://"):
+        url = url[len("s3://") :]
+    bucket, _, prefix = url.partition("/")
+    return bucket, prefix.strip("/")
+
+
+# SHA-256 of a whole file
+def hash_file(path, buf_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(buf_size)
+            if not data:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+
+# split any iterable into lists of at most n items
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# default progress report, one line per finished file
+def print_progress(done, total, key, size):
+    print(f"{done}/{total} uploaded {key} ({size} b)")
+
+
+def _not_found(e):
+    return e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+# calls back into the engine when a single file finishes uploading.
+# s3transfer swallows exceptions raised in done callbacks, so with an
+# errors list, ones raised by on_done are added to it instead.
+class _FileDoneSubscriber(BaseSubscriber):
+    def __init__(self, on_done, errors=None):
+        self._on_done = on_done
+        self._errors = errors
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+        except BaseException:
+            # failures are raised to the caller by the engine
+            return
+        try:
+            self._on_done()
+        except Exception as e:
+            if self._errors is None:
+                raise
+            self._errors.append(e)
+
+
+# Where the checkpoint for uploading a local path in a run goes: a file
+# under OPAL_UPLOAD_CHECKPOINT_DIR named for the run and the path, so
+# checkpoints never end up next to (or inside) the data being uploaded.
+def checkpoint_path(run, path):
+    directory = os.path.abspath(
+        os.path.expanduser(os.environ.get(CHECKPOINT_DIR_ENV, DEFAULT_CHECKPOINT_DIR))
+    )
+    os.makedirs(directory, exist_ok=True)
+    name = hashlib.sha256(f"{run}\0{os.path.abspath(path)}".encode("utf-8"))
+    return os.path.join(directory, name.hexdigest())
+
+
+# On-disk record of the files an upload has finished, so an upload that
+# dies partway through (e.g. a failed step that is `resume`d) only has to
+# send what's missing. One JSON line is appended per finished file:
+#   {"key", "size", "mtime", "etag", "bucket", "prefix"}
+# and the last line for a key wins when loading.
+class UploadCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut off if we died mid-write
+                        continue
+                    self.entries[entry["key"]] = entry
+
+    # the entry for a finished file, if the local file hasn't changed since
+    def completed(self, key, size, mtime):
+        entry = self.entries.get(key)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            return entry
+        return None
+
+    def record(self, key, size, mtime, etag, bucket, prefix):
+        entry = dict(
+            key=key, size=size, mtime=mtime, etag=etag, bucket=bucket, prefix=prefix
+        )
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[key] = entry
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.entries = {}
+
+
+# Uploads many files under one S3 root with a bounded pool of workers.
+# Every request (single put or multipart part) across every file shares
+# the same `concurrency` limit, files are submitted largest first so the
+# long multipart uploads start right away and small files fill in behind
+# them, and files above `part_size` are sent as multipart uploads with
+# parts of that size.
+# If `checkpoint` is a file path (see checkpoint_path), finished files are
+# recorded there and skipped by later uploads of the same unchanged files
+# (see UploadCheckpoint).
+class UploadEngine:
+    def __init__(
+        self,
+        s3root,
+        part_size=None,
+        concurrency=None,
+        client=None,
+        progress=None,
+        checkpoint=None,
+    ):
+        self.bucket, self.prefix = split_s3_url(s3root)
+        self.part_size, self.concurrency = get_upload_config(part_size, concurrency)
+        self.client = client or minio_s3_client(max_pool_connections=self.concurrency)
+        self.progress = print_progress if progress is None else progress
+        self.checkpoint = UploadCheckpoint(checkpoint) if checkpoint else None
+        # (bucket, s3 key) -> ids of incomplete multipart uploads, listed
+        # once per upload
+        self._incomplete = {}
+        # errors recording finished files (checkpoint records, index
+        # entries), raised by _run once its transfers are done
+        self._done_errors = []
+
+    def transfer_config(self):
+        return TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.concurrency,
+        )
+
+    def transfer_manager(self):
+        return create_transfer_manager(self.client, self.transfer_config())
+
+    def s3_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def s3_url(self, key):
+        return f"s3://{self.bucket}/{self.s3_key(key)}"
+
+    def etag(self, bucket, s3_key):
+        try:
+            return self.client.head_object(Bucket=bucket, Key=s3_key)["ETag"]
+        except ClientError as e:
+            if _not_found(e):
+                return None
+            raise
+
+    # same idea as metaflow's S3.put_files: takes (key, path) or
+    # (key, path, size) items and returns a list of (key, s3 url), in the
+    # order given. `files` can be a generator (e.g. walk_upload_tree), it's
+    # consumed `batch_size` files at a time so huge trees don't have to be
+    # listed up front.
+    def upload(self, files, batch_size=DEFAULT_BATCH_SIZE):
+        out = []
+        if self.checkpoint is not None:
+            self._incomplete = self.incomplete_uploads()
+        for batch in batched(files, batch_size):
+            batch = [
+                (f[0], f[1], f[2] if len(f) > 2 else os.path.getsize(f[1]))
+                for f in batch
+            ]
+            self._upload_batch(batch)
+            out.extend((key, self.s3_url(key)) for key, _, _ in batch)
+
+        self._upload_done()
+        return out
+
+    # upload a list of (key, path, size)
+    def _upload_batch(self, files):
+        if self.checkpoint is None:
+            self._run(
+                [
+                    (key, size, self._upload_job(path, self.s3_key(key)))
+                    for key, path, size in files
+                ]
+            )
+            return
+
+        stats = [(key, path, os.stat(path)) for key, path, _ in files]
+        self.abort_incomplete_uploads([key for key, _, _ in stats])
+
+        # check what the checkpoint says is finished, concurrently since
+        # every finished file needs a HEAD to make sure it's still there
+        def plan(file):
+            key, path, st = file
+            entry = self.checkpoint.completed(key, st.st_size, st.st_mtime_ns)
+            if entry is None:
+                return self._upload_job(path, self.s3_key(key))
+
+            old_key = f"{entry['prefix']}/{key}" if entry["prefix"] else key
+            if self.etag(entry["bucket"], old_key) != entry["etag"]:
+                # gone or overwritten since, send it again
+                return self._upload_job(path, self.s3_key(key))
+            if (entry["bucket"], entry["prefix"]) == (self.bucket, self.prefix):
+                # already where it needs to be
+                return None
+            # finished by an earlier attempt under a different root (e.g. the
+            # run before a `resume`), copy it over instead of re-sending it
+            return self._copy_job(entry["bucket"], old_key, self.s3_key(key))
+
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            submits = list(pool.map(plan, stats))
+
+        jobs = [
+            (key, st.st_size, self._checkpointed(submit, key, st))
+            for (key, _, st), submit in zip(stats, submits)
+            if submit is not None
+        ]
+        print(f"{len(stats) - len(jobs)}/{len(stats)} files already uploaded")
+        self._run(jobs)
+
+    # called once every batch is uploaded
+    def _upload_done(self):
+        if self.checkpoint is not None:
+            # everything is up, nothing left to resume
+            self.checkpoint.remove()
+
+    def _checkpoint_roots(self):
+        roots = {(self.bucket, self.prefix)}
+        roots |= {(e["bucket"], e["prefix"]) for e in self.checkpoint.entries.values()}
+        return roots
+
+    # multipart uploads that were never completed or aborted (the process
+    # was killed mid-upload) are invisible but still take up space.
+    # Lists the ones here or at any root an earlier attempt recorded in the
+    # checkpoint, as (bucket, s3 key) -> upload ids.
+    def incomplete_uploads(self):
+        out = {}
+        for bucket, prefix in self._checkpoint_roots():
+            paginator = self.client.get_paginator("list_multipart_uploads")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                for mpu in page.get("Uploads", []):
+                    out.setdefault((bucket, mpu["Key"]), []).append(mpu["UploadId"])
+        return out
+
+    # abort the incomplete uploads (found by upload) of keys we're about
+    # to upload
+    def abort_incomplete_uploads(self, keys):
+        for bucket, prefix in self._checkpoint_roots():
+            for key in keys:
+                s3_key = f"{prefix}/{key}" if prefix else key
+                for upload_id in self._incomplete.pop((bucket, s3_key), []):
+                    print(f"Aborting incomplete upload of {s3_key}")
+                    self.client.abort_multipart_upload(
+                        Bucket=bucket, Key=s3_key, UploadId=upload_id
+                    )
+
+    def _upload_job(self, path, s3_key):
+        def submit(manager, subscribers):
+            return manager.upload(path, self.bucket, s3_key, subscribers=subscribers)
+
+        return submit
+
+    def _copy_job(self, src_bucket, src_key, s3_key):
+        def submit(manager, subscribers):
+            return manager.copy(
+                {"Bucket": src_bucket, "Key": src_key},
+                self.bucket,
+                s3_key,
+                subscribers=subscribers,
+            )
+
+        return submit
+
+    # wraps a job's submit so the file is recorded in the checkpoint
+    # as soon as it finishes
+    def _checkpointed(self, submit, key, st):
+        def record():
+            etag = self.etag(self.bucket, self.s3_key(key))
+            self.checkpoint.record(
+                key, st.st_size, st.st_mtime_ns, etag, self.bucket, self.prefix
+            )
+
+        def checkpointed_submit(manager, subscribers):
+            done = _FileDoneSubscriber(record, self._done_errors)
+            return submit(manager, [done] + subscribers)
+
+        return checkpointed_submit
+
+    # runs a list of (key, size, submit) transfer jobs through one
+    # transfer manager, largest first. `submit` takes the manager and a
+    # list of subscribers, and returns the transfer future.
+    def _run(self, jobs):
+        ordered = sorted(jobs, key=lambda j: j[1], reverse=True)
+        self._done_errors.clear()
+
+        total = len(ordered)
+        done = 0
+        lock = threading.Lock()
+
+        # called from the transfer worker threads
+        def file_done(key, size):
+            nonlocal done
+            with lock:
+                done += 1
+                if self.progress:
+                    self.progress(done, total, key, size)
+
+        manager = self.transfer_manager()
+        with manager:
+            futures = [
+                submit(
+                    manager,
+                    [
+                        _FileDoneSubscriber(
+                            lambda key=key, size=size: file_done(key, size)
+                        )
+                    ],
+                )
+                for key, size, submit in ordered
+            ]
+            # raises the first failure, leaving the manager to cancel the rest
+            for future in futures:
+                future.result()
+
+        # the manager has shut down, so every done callback has run
+        if self._done_errors:
+            errors = list(self._done_errors)
+            self._done_errors.clear()
+            raise Exception(
+                f"{len(errors)} uploaded files couldn't be recorded: {errors}"
+            ) from errors[0]
+
+
+# Content addressed version of the UploadEngine. Every file is hashed, and
+# the CAS prefix of the bucket keeps an index entry per hash that points at
+# an object already holding those bytes (wherever they were first uploaded,
+# by any run). Files whose contents are in the index are filled in with a
+# server side copy of that object, so no bytes are re-sent from this
+# machine. New contents are uploaded once, straight to their key, and added
+# to the index. The index entries are small JSON pointers, so a file is
+# only stored at its own key, never again as a separate blob. A manifest
+# mapping each key to its hash is written to `manifest_key`.
+# There's no need for a checkpoint here: files are indexed as soon as they
+# finish, so a retried upload copies them instead of sending them again.
+class DedupUploadEngine(UploadEngine):
+    def __init__(self, s3root, manifest_key, cas_prefix=None, **kwargs):
+        super().__init__(s3root, **kwargs)
+        self.manifest_key = manifest_key
+        self.cas_prefix = (
+            cas_prefix or os.environ.get(CAS_PREFIX_ENV, DEFAULT_CAS_PREFIX)
+        ).strip("/")
+        self._manifest = {}
+
+    def index_key(self, digest):
+        return f"{self.cas_prefix}/sha256/{digest[:2]}/{digest}"
+
+    # (bucket, s3 key) of an object with the contents that hash to digest,
+    # or None if there isn't one
+    def stored_copy(self, digest):
+        try:
+            res = self.client.get_object(Bucket=self.bucket, Key=self.index_key(digest))
+        except ClientError as e:
+            if _not_found(e):
+                return None
+            raise
+        entry = json.loads(res["Body"].read())
+        if self.etag(entry["bucket"], entry["key"]) != entry["etag"]:
+            # deleted or overwritten since it was indexed
+            return None
+        return entry["bucket"], entry["key"]
+
+    # point the index entry for digest at the uploaded key
+    def _index(self, key, digest):
+        s3_key = self.s3_key(key)
+        entry = dict(
+            bucket=self.bucket, key=s3_key, etag=self.etag(self.bucket, s3_key)
+        )
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.index_key(digest),
+            Body=json.dumps(entry).encode("utf-8"),
+        )
+
+    # wraps a job's submit so the file is indexed as soon as it finishes
+    def _indexed(self, submit, key, digest):
+        def indexed_submit(manager, subscribers):
+            done = _FileDoneSubscriber(
+                lambda: self._index(key, digest), self._done_errors
+            )
+            return submit(manager, [done] + subscribers)
+
+        return indexed_submit
+
+    def _upload_batch(self, files):
+        # hash and look up contents concurrently, reading files is the slow part
+        def lookup(path):
+            digest = hash_file(path)
+            return digest, self.stored_copy(digest)
+
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as pool:
+            found = list(pool.map(lookup, [path for _, path, _ in files]))
+
+        jobs, duplicates, first = [], [], {}
+        for (key, path, size), (digest, stored) in zip(files, found):
+            if stored is not None:
+                jobs.append((key, size, self._copy_job(*stored, self.s3_key(key))))
+            elif digest in first:
+                # identical files within this upload are only sent once too
+                duplicates.append((key, size, first[digest]))
+            else:
+                first[digest] = key
+                submit = self._upload_job(path, self.s3_key(key))
+                jobs.append((key, size, self._indexed(submit, key, digest)))
+
+        print(
+            f"{len(files) - len(first)}/{len(files)} files already stored, "
+            f"uploading {len(first)}"
+        )
+        self._run(jobs)
+        self._run(
+            [
+                (
+                    key,
+                    size,
+                    self._copy_job(self.bucket, self.s3_key(src), self.s3_key(key)),
+                )
+                for key, size, src in duplicates
+            ]
+        )
+
+        for (key, _, size), (digest, _) in zip(files, found):
+            self._manifest[key] = {"sha256": digest, "size": size}
+
+    def _upload_done(self):
+        manifest = {"algorithm": "sha256", "files": self._manifest}
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.s3_key(self.manifest_key),
+            Body=json.dumps(manifest).encode("utf-8"),
+        )
@@ -1 +1,2 @@
-from .publish import publish, delete, publish_serializer
+from .publish import publish, publish_many, delete, publish_serializer
+from .serializer import encode_payload
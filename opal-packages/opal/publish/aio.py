@@ -0,0 +1,67 @@
+import os
+import json
+
+from .hooks import catalog_changed
+from .serializer import encode_payload, make_body
+from .delta import DigestStore, payload_digest, forget, NOT_MODIFIED
+
+# asyncio versions of publish and delete, through an
+# opal.query.aio.AsyncClient (its connection pool and concurrency limit):
+#
+#   async with AsyncClient() as client:
+#       await asyncio.gather(*(publish(client, *i) for i in instances))
+#
+# The client's token is for queries. Publishes and deletes send their own
+# token, which defaults to the same as opal.publish.publish's.
+
+
+# publish an instance, returns (success, status_code) like
+# opal.publish.publish. compress, max_artifact_bytes, delta and force are
+# as there too.
+async def publish(
+    client,
+    kind_id,
+    kind_type,
+    kind_metadata,
+    compress=False,
+    max_artifact_bytes=None,
+    delta=False,
+    force=False,
+    token=os.environ.get("JUPYTERHUB_API_URL"),
+):
+    json_text = encode_payload(
+        {"kind_metadata": kind_metadata, "kind_type": kind_type, "kind_id": kind_id},
+        max_artifact_bytes=max_artifact_bytes,
+    )
+    if delta:
+        digests = DigestStore()
+        digest = payload_digest(json_text)
+        if not force and digests.unchanged(kind_id, digest):
+            return (True, NOT_MODIFIED)
+
+    body, headers = make_body(json_text, compress)
+    status, _ = await client.request(
+        "POST",
+        f"{client.url}/instance",
+        data=body,
+        headers={**headers, "Authorization": "token %s" % token},
+    )
+    if status == 201:
+        catalog_changed()
+        if delta:
+            digests.put(kind_id, kind_type, digest)
+    return (status == 201, status)
+
+
+# delete an instance by kind_id, returns (success, status_code)
+async def delete(client, kind_id, token=os.environ.get("JUPYTERHUB_API_URL")):
+    status, _ = await client.request(
+        "DELETE",
+        f"{client.url}/instance",
+        data=json.dumps({"kind_id": kind_id}),
+        headers={"Authorization": "token %s" % token},
+    )
+    if status == 204:
+        catalog_changed()
+        forget(kind_id)
+    return (status == 204, status)
@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+
+from opal.query.sqlite import connect
+
+# Delta publishing: remember a digest of the last payload published for
+# each kind_id, and skip publishing a payload that hasn't changed.
+#
+#   opal.publish.publish(kind_id, kind_type, kind_metadata, delta=True)
+#
+# returns (True, 304) without calling the catalog when kind_metadata is the
+# same as last time. force=True publishes anyway (and records the digest).
+# The digests live in a local SQLite file (OPAL_PUBLISH_DIGESTS). They only
+# know what this machine published, so verify() checks them against the
+# catalog and forgets any entry that isn't there anymore.
+
+DEFAULT_DIGESTS_PATH = os.path.join("~", ".cache", "opal", "publish_digests.sqlite")
+DIGESTS_PATH_ENV = "OPAL_PUBLISH_DIGESTS"
+
+# status returned by publish for a skipped, unchanged payload
+NOT_MODIFIED = 304
+
+
+def default_digests_path():
+    return os.path.abspath(
+        os.path.expanduser(os.environ.get(DIGESTS_PATH_ENV, DEFAULT_DIGESTS_PATH))
+    )
+
+
+# digest of a payload's encoded JSON (before any compression)
+def payload_digest(json_text):
+    return hashlib.sha256(json_text.encode("utf-8")).hexdigest()
+
+
+class DigestStore:
+    def __init__(self, path=None):
+        self.path = os.path.abspath(os.path.expanduser(path or default_digests_path()))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "kind_id TEXT PRIMARY KEY, kind_type TEXT, digest TEXT, "
+                "published_at REAL)"
+            )
+
+    def _db(self):
+        return connect(self.path)
+
+    def get(self, kind_id):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT digest FROM digests WHERE kind_id = ?", (kind_id,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    # does the catalog already have exactly this payload for kind_id?
+    def unchanged(self, kind_id, digest):
+        return self.get(kind_id) == digest
+
+    def put(self, kind_id, kind_type, digest):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)",
+                (kind_id, kind_type, digest, time.time()),
+            )
+
+    def remove(self, kind_ids):
+        with self._db() as db:
+            db.executemany(
+                "DELETE FROM digests WHERE kind_id = ?", [(k,) for k in kind_ids]
+            )
+
+    def clear(self):
+        with self._db() as db:
+            db.execute("DELETE FROM digests")
+
+    # kind_id -> kind_type of every remembered publish
+    def entries(self):
+        with self._db() as db:
+            return dict(db.execute("SELECT kind_id, kind_type FROM digests"))
+
+
+# Forget the digest of a kind_id (after deleting it from the catalog),
+# without creating a digest file if delta publishing was never used.
+def forget(kind_id, path=None):
+    path = path or default_digests_path()
+    if os.path.exists(path):
+        DigestStore(path).remove([kind_id])
+
+
+# Check the digests against the catalog. Entries whose kind_id is missing
+# from the catalog, or is there with another kind_type, are forgotten so
+# the next delta publish sends them again. Returns the forgotten kind_ids.
+def verify(store=None, api_url=None, token=None):
+    from opal.query import Instance
+
+    store = DigestStore() if store is None else store
+    search_kwargs = {}
+    if api_url is not None:
+        search_kwargs["api_url"] = api_url
+    if token is not None:
+        search_kwargs["token"] = token
+
+    catalog = {
+        i.get("kind_id"): i.get("kind_type")
+        for i in Instance(**search_kwargs).search().all()
+    }
+    stale = [
+        kind_id
+        for kind_id, kind_type in store.entries().items()
+        if catalog.get(kind_id) != kind_type
+    ]
+    store.remove(stale)
+    return stale
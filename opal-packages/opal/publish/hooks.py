@@ -0,0 +1,35 @@
+import sys
+
+# Hooks called when this process changes the catalog.
+#
+#   @opal.publish.hooks.on_catalog_change
+#   def forget_cached_runs():
+#       ...
+#
+# Every hook is called with no arguments after the catalog accepts a
+# publish or delete (publish, delete, publish_many, reconcile, the spool
+# and opal.publish.aio). opal.query registers one that clears its query
+# caches. A hook that raises is reported, and doesn't stop the others or
+# fail the publish.
+
+_hooks = []
+
+
+# register hook, returns it so this works as a decorator
+def on_catalog_change(hook):
+    if hook not in _hooks:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def catalog_changed():
+    for hook in list(_hooks):
+        try:
+            hook()
+        except Exception as e:
+            print(f"opal catalog change hook {hook!r} failed: {e}", file=sys.stderr)
@@ -1,11 +1,21 @@
 import requests
+import requests.adapters
 import json
 import os
+import time
+import random
+import itertools
+import threading
+import concurrent.futures
 
 # for serializing
 import pandas as pd
 import numpy as np
 
+from .hooks import catalog_changed
+from .serializer import encode_payload, make_body
+from .delta import DigestStore, payload_digest, forget, NOT_MODIFIED
+
 
 def publish_serializer(obj):
     if isinstance(obj, pd.DataFrame):
@@ -13,7 +23,8 @@ def publish_serializer(obj):
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
     elif isinstance(obj, frozenset):
-        return list(obj)
+        # sorted so the same set always encodes the same (see delta.py)
+        return sorted(obj, key=str)
     else:
         return str(obj)
 
@@ -24,23 +35,40 @@ def publish(
     kind_metadata: dict,
     api_url=os.environ.get("CATALOG_BACKEND_URL"),
     token=os.environ.get("JUPYTERHUB_API_URL"),
+    compress=False,
+    max_artifact_bytes=None,
+    delta=False,
+    force=False,
 ):
-
-    json_data = json.dumps(
+    # compress=True gzips the request body. Tables (DataFrames, arrays)
+    # encoding to more than max_artifact_bytes are published as stubs,
+    # see serializer.py.
+    # delta=True skips payloads that haven't changed since they were last
+    # published from here, returning (True, 304), unless force=True.
+    # See delta.py
+    json_text = encode_payload(
         {"kind_metadata": kind_metadata, "kind_type": kind_type, "kind_id": kind_id},
-        default=publish_serializer,
+        max_artifact_bytes=max_artifact_bytes,
     )
+    if delta:
+        digests = DigestStore()
+        digest = payload_digest(json_text)
+        if not force and digests.unchanged(kind_id, digest):
+            return (True, NOT_MODIFIED)
 
+    json_data, headers = make_body(json_text, compress)
     res = requests.post(
         f"{api_url}/instance",
         # json=dict(kind_id=kind_id, kind_type=kind_type, kind_metadata=kind_metadata),
         data=json_data,
-        headers={
-            "content-type": "application/json",
-            "Authorization": "token %s" % token,
-        },
+        headers={**headers, "Authorization": "token %s" % token},
     )
 
+    if res.status_code == 201:
+        catalog_changed()
+        if delta:
+            digests.put(kind_id, kind_type, digest)
+
     return (
         (True, res.status_code) if res.status_code == 201 else (False, res.status_code)
     )
@@ -58,4 +86,209 @@ def delete(
         data=json.dumps({"kind_id": kind_id}),
     )
 
+    if res.status_code == 204:
+        catalog_changed()
+        # a delta publish has to send it again
+        forget(kind_id)
+
     return (res.status_code == 204, res.status_code)
+
+
+# settings for publish_many
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds, doubled on each retry
+MAX_BACKOFF = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# seconds to connect, and between bytes of the response, per request
+REQUEST_TIMEOUT = 60.0
+
+
+# a requests session that keeps up to `pool_size` connections alive
+def make_session(token, pool_size=DEFAULT_CONCURRENCY):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(
+        {
+            "content-type": "application/json",
+            "Authorization": "token %s" % token,
+        }
+    )
+    return session
+
+
+# Keep-alive sessions for a pool of worker threads. requests sessions
+# aren't guaranteed thread safe, so each thread gets its own from get().
+# All of them are closed on exit.
+class ThreadSessions:
+    def __init__(self, token):
+        self.token = token
+        self._local = threading.local()
+        self._sessions = []
+
+    def get(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = make_session(self.token, pool_size=1)
+            self._sessions.append(self._local.session)
+        return self._local.session
+
+    def close(self):
+        for session in self._sessions:
+            session.close()
+        self._sessions = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# seconds to wait before retry number `attempt` (0 based). Uses the
+# server's Retry-After when it sends one, otherwise exponential backoff
+# with full jitter so that parallel workers don't retry in lockstep.
+def _retry_delay(attempt, backoff, res=None):
+    retry_after = res.headers.get("Retry-After") if res is not None else None
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2**attempt))
+
+
+# session.<method>(url), retrying on 429, 5xx and request errors (connection
+# errors, timeouts, ...). Returns the final status code, or None if no
+# response was received.
+def _send(session, method, url, max_retries=0, backoff=0, **kwargs):
+    status = None
+    for attempt in range(max_retries + 1):
+        res = None
+        try:
+            res = getattr(session, method)(url, timeout=REQUEST_TIMEOUT, **kwargs)
+            status = res.status_code
+            if status not in RETRY_STATUSES:
+                break
+        except requests.exceptions.RequestException:
+            status = None
+        if attempt < max_retries:
+            time.sleep(_retry_delay(attempt, backoff, res))
+    return status
+
+
+# POST an encoded instance body, retrying on 429, 5xx and connection
+# errors. Returns (success, status_code), with status_code None if the
+# server was never reached.
+def post_body(session, api_url, body, headers=None, max_retries=0, backoff=0):
+    status = _send(
+        session,
+        "post",
+        f"{api_url}/instance",
+        max_retries,
+        backoff,
+        data=body,
+        headers=headers,
+    )
+    return (status == 201, status)
+
+
+# DELETE an instance by kind_id with post_body's retries.
+# Returns (success, status_code)
+def delete_body(session, api_url, kind_id, max_retries=0, backoff=0):
+    status = _send(
+        session,
+        "delete",
+        f"{api_url}/instance",
+        max_retries,
+        backoff,
+        data=json.dumps({"kind_id": kind_id}),
+    )
+    return (status == 204, status)
+
+
+def _post_instance(
+    session,
+    api_url,
+    instance,
+    max_retries,
+    backoff,
+    compress=False,
+    max_artifact_bytes=None,
+    digests=None,
+    force=False,
+):
+    kind_id, kind_type = instance["kind_id"], instance["kind_type"]
+    json_text = encode_payload(
+        {
+            "kind_metadata": instance["kind_metadata"],
+            "kind_type": kind_type,
+            "kind_id": kind_id,
+        },
+        max_artifact_bytes=max_artifact_bytes,
+    )
+    if digests is not None:
+        digest = payload_digest(json_text)
+        if not force and digests.unchanged(kind_id, digest):
+            return (True, NOT_MODIFIED)
+
+    json_data, headers = make_body(json_text, compress)
+    result = post_body(session, api_url, json_data, headers, max_retries, backoff)
+
+    if result[0]:
+        catalog_changed()
+        if digests is not None:
+            digests.put(kind_id, kind_type, digest)
+    return result
+
+
+# Publish many instances to the catalog over a shared keep-alive session.
+#
+# instances is an iterable (a generator is fine) of dicts with kind_id,
+# kind_type and kind_metadata, as passed to publish. They're consumed
+# chunk_size at a time, so only one chunk of payloads is in memory, and
+# each chunk is posted with up to `concurrency` requests in flight.
+# compress, max_artifact_bytes, delta and force are as for publish.
+# Returns a list of (success, status_code) like publish, one per
+# instance and in the same order.
+def publish_many(
+    instances,
+    api_url=os.environ.get("CATALOG_BACKEND_URL"),
+    token=os.environ.get("JUPYTERHUB_API_URL"),
+    concurrency=DEFAULT_CONCURRENCY,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    compress=False,
+    max_artifact_bytes=None,
+    delta=False,
+    force=False,
+):
+    digests = DigestStore() if delta else None
+
+    def post(instance):
+        return _post_instance(
+            sessions.get(),
+            api_url,
+            instance,
+            max_retries,
+            backoff,
+            compress=compress,
+            max_artifact_bytes=max_artifact_bytes,
+            digests=digests,
+            force=force,
+        )
+
+    results = []
+    instances = iter(instances)
+    with ThreadSessions(token) as sessions:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            while True:
+                chunk = list(itertools.islice(instances, chunk_size))
+                if not chunk:
+                    break
+                results.extend(pool.map(post, chunk))
+
+    return results
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import concurrent.futures
+
+from .hooks import catalog_changed
+from .serializer import encode_payload, make_body
+from .delta import forget
+from .publish import (
+    ThreadSessions,
+    post_body,
+    delete_body,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_BACKOFF,
+)
+
+# Bring the catalog in line with a set of instances without emptying it.
+#
+#   report = reconcile(instances, dry_run=True)
+#   print(report.summary())
+#
+# instances is an iterable (a generator is fine) of dicts with kind_id,
+# kind_type and kind_metadata, as for publish_many. Each one is encoded
+# and its digest compared with the digest of the entry the catalog has
+# for that kind_id. Only new and changed instances are posted, and then
+# entries the catalog has but that aren't in instances are deleted (with
+# delete=False they're only reported). Nothing is deleted unless the whole
+# catalog was listed: if the listing may have been cut short, stale
+# entries are only reported. Requests go through a pool of
+# `concurrency` workers, no more than `rate` per second if it's set.
+# With dry_run=True nothing is sent and the report says what would be.
+#
+# token is used for the posts and deletes, like opal.publish.publish's.
+# The catalog is listed with query_token, like opal.query's.
+
+
+# digest of an instance as the catalog would return it: its JSON decoded
+# and re-encoded canonically, so key order and whitespace don't matter
+def instance_digest(instance):
+    canonical = json.dumps(
+        {
+            "kind_id": instance.get("kind_id"),
+            "kind_type": instance.get("kind_type"),
+            "kind_metadata": instance.get("kind_metadata"),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# kind_id -> digest of everything in the catalog, and whether the listing
+# is known to be complete
+def catalog_digests(api_url, token):
+    from opal.query import Instance
+
+    results = Instance(api_url, token).iter_search()
+    digests = {record.get("kind_id"): instance_digest(record) for record in results}
+    return digests, results.complete is True
+
+
+# At most `rate` calls to wait() return per second, across threads.
+# rate=None doesn't limit.
+class RateLimiter:
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ReconcileReport:
+    def __init__(self, dry_run=False, delete=True):
+        self.dry_run = dry_run
+        self.delete = delete
+        self.inserted = []
+        self.updated = []
+        # catalog entries not in the instances
+        self.deleted = []
+        self.unchanged = 0
+        # kind_id -> status code of the request that failed
+        self.failed = {}
+        # False if the catalog listing may have been cut short, in which
+        # case nothing was deleted
+        self.listing_complete = True
+
+    def summary(self):
+        verb = "would be" if self.dry_run else "were"
+        if not self.delete:
+            stale = "stale (kept)"
+        elif not self.listing_complete:
+            stale = "stale (kept, the catalog listing was incomplete)"
+        else:
+            stale = "deleted"
+        lines = [
+            f"{len(self.inserted)} {verb} inserted, {len(self.updated)} updated, "
+            f"{len(self.deleted)} {stale}, {self.unchanged} unchanged"
+        ]
+        for kind_id, status in self.failed.items():
+            lines.append(f"\tfailed: {kind_id} (status {status})")
+        return "\n".join(lines)
+
+
+# wait for submitted requests, recording failures in report
+def _collect(futures, report):
+    for kind_id, future in futures.items():
+        ok, status = future.result()
+        if not ok:
+            report.failed[kind_id] = status
+    futures.clear()
+
+
+def reconcile(
+    instances,
+    api_url=os.environ.get("CATALOG_BACKEND_URL"),
+    token=os.environ.get("JUPYTERHUB_API_URL"),
+    query_token=os.environ.get("JUPYTERHUB_API_TOKEN"),
+    concurrency=DEFAULT_CONCURRENCY,
+    rate=None,
+    dry_run=False,
+    delete=True,
+    max_retries=DEFAULT_MAX_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    compress=False,
+    max_artifact_bytes=None,
+):
+    current, complete = catalog_digests(api_url, query_token)
+    report = ReconcileReport(dry_run, delete)
+    report.listing_complete = complete
+    limiter = RateLimiter(rate)
+    wanted = set()
+
+    def post(json_text):
+        limiter.wait()
+        body, headers = make_body(json_text, compress)
+        return post_body(sessions.get(), api_url, body, headers, max_retries, backoff)
+
+    def remove(kind_id):
+        limiter.wait()
+        return delete_body(sessions.get(), api_url, kind_id, max_retries, backoff)
+
+    with ThreadSessions(token) as sessions:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            posts = {}
+            for instance in instances:
+                kind_id = instance["kind_id"]
+                wanted.add(kind_id)
+                json_text = encode_payload(
+                    {
+                        "kind_metadata": instance["kind_metadata"],
+                        "kind_type": instance["kind_type"],
+                        "kind_id": kind_id,
+                    },
+                    max_artifact_bytes=max_artifact_bytes,
+                )
+                digest = instance_digest(json.loads(json_text))
+                if current.get(kind_id) == digest:
+                    report.unchanged += 1
+                    continue
+
+                changes = report.inserted if kind_id not in current else report.updated
+                changes.append(kind_id)
+                if not dry_run:
+                    posts[kind_id] = pool.submit(post, json_text)
+                # only keep a bounded number of payloads waiting
+                if len(posts) >= concurrency * 4:
+                    _collect(posts, report)
+
+            _collect(posts, report)
+
+            # deletes last, so nothing is missing while it's replaced
+            report.deleted = sorted(set(current) - wanted)
+            if delete and complete and not dry_run:
+                deletes = {k: pool.submit(remove, k) for k in report.deleted}
+                _collect(deletes, report)
+                for kind_id in report.deleted:
+                    if kind_id not in report.failed:
+                        forget(kind_id)
+
+    if not dry_run:
+        catalog_changed()
+    return report
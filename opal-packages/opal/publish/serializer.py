@@ -0,0 +1,137 @@
+import gzip
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    from pandas.io.json import ujson_dumps
+except ImportError:  # pandas < 2
+    from pandas._libs.json import dumps as ujson_dumps
+
+# JSON encoding of catalog payloads.
+#
+# DataFrames and numeric ndarrays are encoded once, straight to JSON text
+# by pandas' C encoder, and spliced into the payload. (publish_serializer
+# goes DataFrame -> JSON -> python objects -> JSON, and builds a python
+# list of every array element.) Tables whose JSON is bigger than
+# max_artifact_bytes are replaced by a small stub describing them.
+
+# cap on the encoded size of one table, None for no cap
+MAX_ARTIFACT_BYTES_ENV = "OPAL_PUBLISH_MAX_ARTIFACT_BYTES"
+
+# ndarray kinds with a fast path: bool, int, uint, float
+NUMERIC_KINDS = "biuf"
+
+# decimal places kept for floats in arrays, the most pandas' encoder
+# allows. (DataFrames keep to_json's default of 10, as before)
+ARRAY_DOUBLE_PRECISION = 15
+
+# gzip's default of 9 is several times slower for a few percent smaller bodies
+GZIP_LEVEL = 6
+
+
+def default_max_artifact_bytes():
+    value = os.environ.get(MAX_ARTIFACT_BYTES_ENV)
+    return int(value) if value else None
+
+
+def _summary(values):
+    values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    if values.size == 0:
+        return None
+    return dict(
+        min=values.min().item(), max=values.max().item(), mean=float(values.mean())
+    )
+
+
+# what's published in place of a table that's too big
+def table_stub(obj, encoded_bytes):
+    stub = dict(
+        opal_stub=True,
+        type=type(obj).__name__,
+        shape=list(obj.shape),
+        encoded_bytes=encoded_bytes,
+    )
+    if isinstance(obj, pd.DataFrame):
+        stub["columns"] = {str(c): str(t) for c, t in obj.dtypes.items()}
+        stub["summary"] = {
+            str(c): _summary(obj[c].to_numpy())
+            for c, t in obj.dtypes.items()
+            if t.kind in NUMERIC_KINDS
+        }
+    else:
+        stub["dtype"] = str(obj.dtype)
+        if obj.dtype.kind in NUMERIC_KINDS:
+            stub["summary"] = _summary(obj.ravel())
+    return stub
+
+
+# JSON text for a DataFrame or ndarray, or None if it doesn't have a
+# fast path (object arrays and the like)
+def _encode_table(obj):
+    if isinstance(obj, pd.DataFrame):
+        # the same JSON as publish_serializer, without decoding it again
+        return obj.to_json()
+    if obj.dtype.kind in NUMERIC_KINDS:
+        return ujson_dumps(obj, double_precision=ARRAY_DOUBLE_PRECISION)
+    return None
+
+
+# Encode `payload` to a JSON string, like
+# json.dumps(payload, default=publish_serializer) but with the fast path
+# for tables and the max_artifact_bytes cap (default from
+# OPAL_PUBLISH_MAX_ARTIFACT_BYTES).
+#
+# Float ndarrays don't come out the same as publish_serializer's: they're
+# rounded to ARRAY_DOUBLE_PRECISION decimal places instead of written with
+# python's repr (0.1 + 0.2 is 0.3, not 0.30000000000000004), and NaN and
+# infinities are null instead of NaN and Infinity (which aren't JSON).
+# Delta digests are of this encoding, so they differ from digests of
+# publish_serializer's.
+def encode_payload(payload, max_artifact_bytes=None):
+    from .publish import publish_serializer
+
+    if max_artifact_bytes is None:
+        max_artifact_bytes = default_max_artifact_bytes()
+
+    # tables are swapped for placeholder strings while json encodes the
+    # rest, then their JSON text is spliced in where the placeholders are
+    token = uuid.uuid4().hex
+    fragments = []
+
+    def default(obj):
+        if isinstance(obj, (pd.DataFrame, np.ndarray)):
+            encoded = _encode_table(obj)
+            if encoded is None:
+                return publish_serializer(obj)
+            if max_artifact_bytes is not None and len(encoded) > max_artifact_bytes:
+                return table_stub(obj, len(encoded))
+            fragments.append(encoded)
+            return f"{token}:{len(fragments) - 1}"
+        return publish_serializer(obj)
+
+    encoded = json.dumps(payload, default=default)
+    if not fragments:
+        return encoded
+    return re.sub(f'"{token}:(\\d+)"', lambda m: fragments[int(m[1])], encoded)
+
+
+# request body and headers for a payload, gzipped if compress=True
+def encode_body(payload, compress=False, max_artifact_bytes=None):
+    return make_body(encode_payload(payload, max_artifact_bytes), compress)
+
+
+# request body and headers for already encoded JSON text
+def make_body(json_text, compress=False):
+    headers = {"content-type": "application/json"}
+    if compress:
+        body = gzip.compress(
+            json_text.encode("utf-8"), compresslevel=GZIP_LEVEL, mtime=0
+        )
+        headers["content-encoding"] = "gzip"
+        return body, headers
+    return json_text, headers
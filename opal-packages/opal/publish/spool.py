@@ -0,0 +1,393 @@
+import os
+import sys
+import atexit
+import time
+import uuid
+import json
+import argparse
+import threading
+import concurrent.futures
+
+from .hooks import catalog_changed
+from .serializer import encode_payload, make_body
+from .delta import DigestStore, payload_digest
+from opal.query.sqlite import connect
+from .publish import (
+    ThreadSessions,
+    post_body,
+    _retry_delay,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_BACKOFF,
+    RETRY_STATUSES,
+)
+
+# Durable local spool for catalog publishes.
+#
+#   spool = PublishSpool()
+#   spool.enqueue(kind_id, kind_type, kind_metadata)  # returns once on disk
+#   spool.flush()                                     # posts what's due
+#
+# Payloads are encoded when they're enqueued and kept in SQLite until the
+# catalog accepts them. Enqueueing a kind_id that's already waiting
+# replaces it, so only the latest payload for each kind_id is sent.
+# Failed posts are retried with backoff; entries the catalog rejects
+# (4xx), or that run out of attempts, are kept as "failed" until flushed
+# with retry_failed=True.
+#
+# A SpoolWorker thread flushes in the background, and
+#   python -m opal.publish.spool flush
+# flushes on demand.
+#
+# The worker is a daemon thread, so it can't keep a finished step alive.
+# At interpreter exit it gets EXIT_TIMEOUT seconds to drain the spool;
+# after that it stops posting and releases the entries it had claimed, so
+# the next flush picks them up straight away. Whatever is still spooled
+# then (or when the process is killed) is only posted by the next flush,
+# so something must run one: a later step, a scheduled
+# "python -m opal.publish.spool flush", or spool.flush() at the end of a
+# flow.
+
+DEFAULT_SPOOL_PATH = os.path.join("~", ".cache", "opal", "publish_spool.sqlite")
+SPOOL_PATH_ENV = "OPAL_PUBLISH_SPOOL"
+
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_FLUSH_INTERVAL = 30.0  # seconds between background flushes
+
+# how long a flush owns the entries it's posting. Other flushes (another
+# process, the CLI) skip them until then.
+CLAIM_SECONDS = 300.0
+
+# how long the background worker gets to drain the spool at exit
+EXIT_TIMEOUT = 30.0
+
+PENDING = "pending"
+FAILED = "failed"
+
+
+class PublishSpool:
+    def __init__(self, path=None):
+        self.path = os.path.abspath(
+            os.path.expanduser(
+                path or os.environ.get(SPOOL_PATH_ENV, DEFAULT_SPOOL_PATH)
+            )
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # (kind_id, version) of entries this process has claimed and not
+        # posted yet
+        self._claimed = set()
+        self._claimed_lock = threading.Lock()
+
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "kind_id TEXT PRIMARY KEY, kind_type TEXT, body BLOB, "
+                "headers TEXT, version TEXT, state TEXT, attempts INTEGER, "
+                "next_attempt REAL, last_status INTEGER, enqueued_at REAL, "
+                "digest TEXT)"
+            )
+
+    def _db(self):
+        # autocommit, transactions are explicit
+        return connect(self.path, isolation_level=None)
+
+    # Encode and store a publish. Returns once it's durable on disk.
+    # compress, max_artifact_bytes, delta and force are as for
+    # opal.publish.publish. Returns False if delta=True and the payload is
+    # unchanged, so there was nothing to spool.
+    def enqueue(
+        self,
+        kind_id,
+        kind_type,
+        kind_metadata,
+        compress=False,
+        max_artifact_bytes=None,
+        delta=False,
+        force=False,
+    ):
+        json_text = encode_payload(
+            {
+                "kind_metadata": kind_metadata,
+                "kind_type": kind_type,
+                "kind_id": kind_id,
+            },
+            max_artifact_bytes=max_artifact_bytes,
+        )
+        digest = None
+        if delta:
+            digest = payload_digest(json_text)
+            if not force and DigestStore().unchanged(kind_id, digest):
+                return False
+
+        body, headers = make_body(json_text, compress)
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO spool "
+                "VALUES (?, ?, ?, ?, ?, ?, 0, 0, NULL, ?, ?)",
+                (
+                    kind_id,
+                    kind_type,
+                    body,
+                    json.dumps(headers),
+                    uuid.uuid4().hex,
+                    PENDING,
+                    time.time(),
+                    digest,
+                ),
+            )
+        return True
+
+    # number of entries in each state
+    def status(self):
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT state, COUNT(*) FROM spool GROUP BY state"
+            ).fetchall()
+        return {PENDING: 0, FAILED: 0, **dict(rows)}
+
+    def failed(self):
+        with self._db() as db:
+            return db.execute(
+                "SELECT kind_id, kind_type, attempts, last_status FROM spool "
+                "WHERE state = ? ORDER BY enqueued_at",
+                (FAILED,),
+            ).fetchall()
+
+    # take ownership of the entries that are due for a post
+    def _claim(self, retry_failed):
+        now = time.time()
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if retry_failed:
+                    db.execute(
+                        "UPDATE spool SET state = ?, attempts = 0, next_attempt = 0 "
+                        "WHERE state = ?",
+                        (PENDING, FAILED),
+                    )
+                rows = db.execute(
+                    "SELECT kind_id, kind_type, version, body, headers, attempts, "
+                    "digest FROM spool "
+                    "WHERE state = ? AND next_attempt <= ? ORDER BY enqueued_at",
+                    (PENDING, now),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE spool SET next_attempt = ? "
+                    "WHERE kind_id = ? AND version = ?",
+                    [(now + CLAIM_SECONDS, r[0], r[2]) for r in rows],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        with self._claimed_lock:
+            self._claimed.update((r[0], r[2]) for r in rows)
+        return rows
+
+    # Make claimed entries that haven't been posted due again, so another
+    # flush doesn't have to wait CLAIM_SECONDS for them. rows are as
+    # returned by _claim, default: everything this process has claimed.
+    def release(self, rows=None):
+        with self._claimed_lock:
+            if rows is None:
+                claimed = list(self._claimed)
+            else:
+                claimed = [(r[0], r[2]) for r in rows if (r[0], r[2]) in self._claimed]
+            self._claimed.difference_update(claimed)
+        if not claimed:
+            return
+        with self._db() as db:
+            db.executemany(
+                "UPDATE spool SET next_attempt = 0 "
+                "WHERE kind_id = ? AND version = ? AND state = ?",
+                [(kind_id, version, PENDING) for kind_id, version in claimed],
+            )
+
+    # record the result of posting an entry. Nothing changes if the
+    # kind_id was enqueued again while it was being posted, the newer
+    # payload still needs to go.
+    def _done(self, row, status, max_attempts, backoff):
+        kind_id, kind_type, version, _, _, attempts, digest = row
+        with self._claimed_lock:
+            self._claimed.discard((kind_id, version))
+        with self._db() as db:
+            if status == 201:
+                catalog_changed()
+                if digest is not None:
+                    DigestStore().put(kind_id, kind_type, digest)
+                db.execute(
+                    "DELETE FROM spool WHERE kind_id = ? AND version = ?",
+                    (kind_id, version),
+                )
+                return
+
+            attempts += 1
+            retry = status is None or status in RETRY_STATUSES
+            state = PENDING if retry and attempts < max_attempts else FAILED
+            db.execute(
+                "UPDATE spool SET state = ?, attempts = ?, next_attempt = ?, "
+                "last_status = ? WHERE kind_id = ? AND version = ?",
+                (
+                    state,
+                    attempts,
+                    time.time() + _retry_delay(attempts - 1, backoff),
+                    status,
+                    kind_id,
+                    version,
+                ),
+            )
+
+    # Post every entry that's due. Returns counts of the entries that
+    # were published, are still pending and have failed. Once `stop` (a
+    # threading.Event) is set, no more entries are posted, and the ones
+    # left are released for the next flush.
+    def flush(
+        self,
+        api_url=None,
+        token=None,
+        retry_failed=False,
+        concurrency=DEFAULT_CONCURRENCY,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        backoff=DEFAULT_BACKOFF,
+        stop=None,
+    ):
+        api_url = api_url or os.environ.get("CATALOG_BACKEND_URL")
+        token = token or os.environ.get("JUPYTERHUB_API_URL")
+
+        rows = self._claim(retry_failed)
+        if not rows:
+            return dict(published=0, **self.status())
+
+        def post(row):
+            if stop is not None and stop.is_set():
+                return False
+            body, headers = row[3], json.loads(row[4])
+            _, status = post_body(sessions.get(), api_url, body, headers)
+            self._done(row, status, max_attempts, backoff)
+            return status == 201
+
+        try:
+            with ThreadSessions(token) as sessions:
+                with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                    published = sum(pool.map(post, rows))
+        finally:
+            self.release(rows)
+
+        return dict(published=published, **self.status())
+
+
+# Flushes a spool every `interval` seconds in a daemon thread, so it never
+# keeps the process alive. Whatever isn't posted by the time the process
+# exits stays in the spool for the next worker or the CLI.
+class SpoolWorker(threading.Thread):
+    def __init__(self, spool, interval=DEFAULT_FLUSH_INTERVAL, **flush_kwargs):
+        super().__init__(name="opal-publish-spool", daemon=True)
+        self.spool = spool
+        self.interval = interval
+        self.flush_kwargs = flush_kwargs
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._abort = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                self.spool.flush(stop=self._abort, **self.flush_kwargs)
+            except Exception as e:
+                # the spool keeps everything, try again next time
+                print(f"opal publish spool flush failed: {e}", file=sys.stderr)
+            if self._stopping.is_set():
+                break
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # flush now instead of waiting for the interval
+    def wake(self):
+        self._wake.set()
+
+    # Flush once more and stop. If that takes longer than timeout, stop
+    # posting and release what's left.
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
+        if self.is_alive():
+            self._abort.set()
+            self.spool.release()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    # threads don't survive a fork
+    def _forget_worker():
+        global _worker, _worker_lock
+        _worker = None
+        _worker_lock = threading.Lock()
+
+    os.register_at_fork(after_in_child=_forget_worker)
+
+
+def _drain_at_exit():
+    worker = _worker
+    if worker is not None and worker.is_alive():
+        worker.stop(EXIT_TIMEOUT)
+
+
+# threading's exit hooks run before concurrent.futures stops taking new
+# work, which the last flush still needs. atexit's run after.
+getattr(threading, "_register_atexit", atexit.register)(_drain_at_exit)
+
+
+# Spool a publish to the default spool (OPAL_PUBLISH_SPOOL) and make sure
+# this process has a worker draining it. Returns once the publish is on
+# disk, with the result of PublishSpool.enqueue.
+def enqueue(kind_id, kind_type, kind_metadata, **enqueue_kwargs):
+    global _worker
+    spool = PublishSpool()
+    if not spool.enqueue(kind_id, kind_type, kind_metadata, **enqueue_kwargs):
+        return False
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = SpoolWorker(spool)
+            _worker.start()
+        else:
+            _worker.wake()
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        "python -m opal.publish.spool", description="OPAL catalog publish spool"
+    )
+    parser.add_argument("--path", help=f"spool file (default ${SPOOL_PATH_ENV})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    flush = commands.add_parser("flush", help="post everything that's due now")
+    flush.add_argument(
+        "--retry-failed", action="store_true", help="also retry failed entries"
+    )
+    flush.add_argument("--api-url", help="default $CATALOG_BACKEND_URL")
+    commands.add_parser("status", help="count pending and failed entries")
+
+    args = parser.parse_args(argv)
+    spool = PublishSpool(args.path)
+
+    if args.command == "flush":
+        result = spool.flush(api_url=args.api_url, retry_failed=args.retry_failed)
+    else:
+        result = spool.status()
+    print(" ".join(f"{k}={v}" for k, v in result.items()))
+
+    for kind_id, kind_type, attempts, last_status in spool.failed():
+        print(
+            f"\tfailed: {kind_type} {kind_id} ({attempts} attempts, status {last_status})"
+        )
+
+    return 1 if result[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,5 @@
 from .search import Instance, Results
+from .cache import QueryCache, invalidate_all
+from .frame import field
+from .aio import AsyncClient, AsyncInstance
+from .mirror import CatalogMirror, MirrorInstance
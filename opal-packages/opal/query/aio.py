@@ -0,0 +1,116 @@
+import os
+import json
+import asyncio
+
+import aiohttp
+
+from .search import Results, query_url
+
+# asyncio catalog client.
+#
+#   async with AsyncClient() as client:
+#       inst = AsyncInstance(client)
+#       runs = await inst._type("TipParseFlow")._with("foo", "bar").search()
+#       by_id = await inst.gather_ids(run_ids)
+#
+# All requests through a client share one connection pool, and at most
+# `concurrency` of them are in flight at once. AsyncInstance is immutable:
+# every builder method returns a new query, so one instance can be shared
+# by any number of concurrent tasks. (opal.publish.aio has async publish
+# and delete using the same client.)
+
+DEFAULT_CONCURRENCY = 32
+
+
+class AsyncClient:
+    def __init__(
+        self,
+        api_url=os.environ.get("CATALOG_BACKEND_URL"),
+        token=os.environ.get("JUPYTERHUB_API_TOKEN"),
+        concurrency=DEFAULT_CONCURRENCY,
+    ):
+        self.url = api_url
+        self.token = token
+        self.concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # the session is made on first use, inside the running event loop
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                headers={"Authorization": "token %s" % self.token},
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    # make a request to the catalog, returns (status_code, body bytes)
+    async def request(self, method, url, **kwargs):
+        session = self.session()
+        async with self._semaphore:
+            async with session.request(method, url, **kwargs) as res:
+                return res.status, await res.read()
+
+
+class AsyncInstance:
+    def __init__(self, client, query=(), type=None, id=None):
+        self.client = client
+        self.query = tuple(query)
+        self.type = type
+        self.id = id
+
+    def _replace(self, **changes):
+        state = dict(query=self.query, type=self.type, id=self.id)
+        state.update(changes)
+        return AsyncInstance(self.client, **state)
+
+    # starts a new query, like Instance._with
+    def _with(self, key, value):
+        return AsyncInstance(self.client, query=[dict(key=key, value=value)])
+
+    def _type(self, type):
+        return self._replace(type=type)
+
+    def _and(self, key, value):
+        return self._replace(
+            query=self.query + (dict(key=key, value=value, operator="AND"),)
+        )
+
+    def _or(self, key, value):
+        return self._replace(
+            query=self.query + (dict(key=key, value=value, operator="OR"),)
+        )
+
+    def _not(self, key, value):
+        return self._replace(
+            query=self.query + (dict(key=key, value=value, operator="NOT"),)
+        )
+
+    # the same URL Instance would request for this query
+    def query_url(self):
+        return query_url(self.client.url, self.query, self.type, self.id)
+
+    async def search(self):
+        _, body = await self.client.request("GET", self.query_url())
+        return Results(json.loads(body))
+
+    async def one(self, id):
+        return await self._replace(id=id).search()
+
+    # look up many kind_ids concurrently, returns {kind_id: Results}
+    async def gather_ids(self, ids):
+        ids = list(dict.fromkeys(ids))
+        results = await asyncio.gather(*(self.one(i) for i in ids))
+        return dict(zip(ids, results))
@@ -0,0 +1,117 @@
+import json
+import time
+import weakref
+import threading
+import collections
+
+import requests
+
+from opal.publish.hooks import on_catalog_change
+
+# Opt-in client side cache of search responses.
+#
+#   inst = Instance(cache=True)    # the shared default cache
+#   inst = Instance(cache=QueryCache(ttl=300, max_entries=1000))
+#
+# Responses are cached by query URL (which holds the hexified query,
+# kind_type and kind_id) and token. A cached response younger than `ttl`
+# seconds is reused without a request. An older one is revalidated with
+# If-None-Match if the server sent an ETag, and refetched otherwise.
+# The least recently used responses are dropped beyond max_entries.
+# Every cache in the process is cleared when it publishes to or deletes from
+# the catalog (see opal.publish.hooks).
+
+DEFAULT_TTL = 60.0
+DEFAULT_MAX_ENTRIES = 256
+
+# every QueryCache, for invalidate_all
+_caches = weakref.WeakSet()
+
+
+class QueryCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (url, token) -> (body, etag, fetched_at). Bodies are kept as
+        # bytes and parsed for every search, so callers can't change
+        # cached results.
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            revalidated=self.revalidated,
+            misses=self.misses,
+            entries=len(self),
+        )
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, body, etag):
+        with self._lock:
+            self._entries[key] = (body, etag, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # the parsed JSON response for a search URL
+    def get_json(self, url, token):
+        key = (url, token)
+        headers = {"Authorization": "token %s" % token}
+        entry = self._lookup(key)
+
+        if entry is not None:
+            body, etag, fetched_at = entry
+            if time.monotonic() - fetched_at < self.ttl:
+                self.hits += 1
+                return json.loads(body)
+            if etag is not None:
+                headers["If-None-Match"] = etag
+
+        r = requests.get(url, headers=headers)
+        if entry is not None and r.status_code == 304:
+            self.revalidated += 1
+            self._store(key, entry[0], entry[1])
+            return json.loads(entry[0])
+
+        self.misses += 1
+        if r.status_code == 200:
+            self._store(key, r.content, r.headers.get("ETag"))
+        return r.json()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+# the cache shared by Instance(cache=True)
+def default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = QueryCache()
+        return _default_cache
+
+
+# clear every cache, after the catalog has changed
+@on_catalog_change
+def invalidate_all():
+    for cache in list(_caches):
+        cache.invalidate()
@@ -0,0 +1,188 @@
+import operator
+
+import pandas as pd
+
+# Columnar views of search results and vectorized predicates over them.
+#
+#   res = Instance()._type("TipParseFlow").iter_search()
+#   df = res.where(
+#       (field("kind_metadata.successful") == True)
+#       & field("kind_metadata.tip_metadata.MILSTD1553_F1.type").notnull(),
+#       fields=["kind_id", "kind_metadata.created_at"],
+#   )
+#
+# Fields are dotted paths into each record. Only the fields asked for
+# (and the ones a predicate uses) are pulled out of the records, so the
+# rest of kind_metadata is never turned into columns.
+
+
+def _get_path(record, path):
+    for part in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+# A DataFrame with one column per dotted path in `fields`, taken from
+# `records` in one pass. Missing values are None/NA. Columns get pandas'
+# nullable dtypes (Int64, boolean, string, ...) where the values allow.
+def records_to_frame(records, fields):
+    fields = list(dict.fromkeys(fields))
+    paths = [f.split(".") for f in fields]
+    columns = [[] for _ in fields]
+    for record in records:
+        for column, path in zip(columns, paths):
+            column.append(_get_path(record, path))
+
+    frame = pd.DataFrame(
+        {f: pd.Series(c, dtype=object) for f, c in zip(fields, columns)},
+        columns=fields,
+    )
+    return frame.infer_objects().convert_dtypes()
+
+
+class Expr:
+    # fields the expression reads
+    def fields(self):
+        raise NotImplementedError
+
+    # boolean Series for the rows of `frame` the expression is true for
+    def evaluate(self, frame):
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return _BoolOp(operator.and_, self, other)
+
+    def __or__(self, other):
+        return _BoolOp(operator.or_, self, other)
+
+    def __invert__(self):
+        return _Not(self)
+
+
+# a field of the results, by dotted path
+def field(path):
+    return Field(path)
+
+
+class Field(Expr):
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f"field({self.path!r})"
+
+    def fields(self):
+        return {self.path}
+
+    def evaluate(self, frame):
+        return frame[self.path]
+
+    def _compare(self, op, value):
+        return _Compare(op, self, value)
+
+    def __eq__(self, value):
+        return self._compare(operator.eq, value)
+
+    def __ne__(self, value):
+        return self._compare(operator.ne, value)
+
+    def __lt__(self, value):
+        return self._compare(operator.lt, value)
+
+    def __le__(self, value):
+        return self._compare(operator.le, value)
+
+    def __gt__(self, value):
+        return self._compare(operator.gt, value)
+
+    def __ge__(self, value):
+        return self._compare(operator.ge, value)
+
+    __hash__ = Expr.__hash__
+
+    def isin(self, values):
+        return _Method(self, lambda c: c.isin(list(values)))
+
+    def contains(self, text):
+        return _Method(
+            self, lambda c: c.astype("string").str.contains(text, regex=False)
+        )
+
+    def startswith(self, text):
+        return _Method(self, lambda c: c.astype("string").str.startswith(text))
+
+    def isnull(self):
+        return _Method(self, lambda c: c.isna())
+
+    def notnull(self):
+        return _Method(self, lambda c: c.notna())
+
+
+# comparisons with a missing value are false
+def _mask(values):
+    return values.fillna(False).astype(bool)
+
+
+class _Compare(Expr):
+    def __init__(self, op, field, value):
+        self.op = op
+        self.field = field
+        self.value = value
+
+    def fields(self):
+        return self.field.fields()
+
+    def evaluate(self, frame):
+        return _mask(self.op(self.field.evaluate(frame), self.value))
+
+
+class _Method(Expr):
+    def __init__(self, field, func):
+        self.field = field
+        self.func = func
+
+    def fields(self):
+        return self.field.fields()
+
+    def evaluate(self, frame):
+        return _mask(self.func(self.field.evaluate(frame)))
+
+
+class _BoolOp(Expr):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def fields(self):
+        return self.left.fields() | self.right.fields()
+
+    def evaluate(self, frame):
+        return self.op(self.left.evaluate(frame), self.right.evaluate(frame))
+
+
+class _Not(Expr):
+    def __init__(self, expr):
+        self.expr = expr
+
+    def fields(self):
+        return self.expr.fields()
+
+    def evaluate(self, frame):
+        return ~self.expr.evaluate(frame)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "Results.to_arrow needs the pyarrow package: pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def frame_to_arrow(frame):
+    return _pyarrow().Table.from_pandas(frame, preserve_index=False)
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .search import Instance, Results, DEFAULT_PAGE_SIZE
+from .sqlite import connect
+
+# A local SQLite mirror of the catalog's /instance entries.
+#
+#   mirror = CatalogMirror()
+#   mirror.resync()                   # stream the catalog into the mirror
+#   runs = mirror.instance()._type("TipParseFlow")._with(
+#       "ch10_metadata.uid", uid
+#   ).search()
+#
+# Queries use the same _with/_and/_or/_not/_type/one surface as Instance
+# and return Results, but run against the local file, so they work offline.
+# Query keys are dotted paths into kind_metadata. Clauses are combined
+# left to right: AND and OR with everything before them, NOT as "and not".
+#
+# kind_type, kind_metadata.created_at and kind_metadata.ch10_metadata.uid
+# are kept in indexed columns; any other key is looked up with JSON1's
+# json_extract on the stored record.
+#
+# The catalog only matches exact values, so it can't be asked for
+# "everything created since" and there's no cursor to sync from. resync()
+# is a full resync: it pages through the whole catalog
+# (Instance.iter_search), so it costs a read of every entry each time, but
+# only writes entries that are new or changed. Entries no longer in the
+# catalog are removed only if the listing is known to be complete.
+# refresh(ids) re-reads just the given kind_ids, for keeping up with
+# known changes between resyncs.
+
+DEFAULT_MIRROR_PATH = os.path.join("~", ".cache", "opal", "catalog_mirror.sqlite")
+MIRROR_PATH_ENV = "OPAL_CATALOG_MIRROR"
+
+# query keys kept in their own indexed column
+INDEXED_KEYS = {"created_at": "created_at", "ch10_metadata.uid": "uid"}
+
+# rows per write transaction during sync
+SYNC_BATCH_SIZE = 1000
+# concurrent requests for sync(ids=)
+SYNC_CONCURRENCY = 8
+
+
+def default_mirror_path():
+    return os.path.abspath(
+        os.path.expanduser(os.environ.get(MIRROR_PATH_ENV, DEFAULT_MIRROR_PATH))
+    )
+
+
+def _get(record, path):
+    for part in path.split("."):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+# (kind_id, kind_type, created_at, uid, record json) for a catalog record
+def _row(record):
+    metadata = record.get("kind_metadata") or {}
+    created_at = _get(metadata, "created_at")
+    uid = _get(metadata, "ch10_metadata.uid")
+    return (
+        record.get("kind_id"),
+        record.get("kind_type"),
+        None if created_at is None else str(created_at),
+        None if uid is None else str(uid),
+        json.dumps(record, sort_keys=True),
+    )
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CatalogMirror:
+    def __init__(
+        self,
+        path=None,
+        api_url=os.environ.get("CATALOG_BACKEND_URL"),
+        token=os.environ.get("JUPYTERHUB_API_TOKEN"),
+    ):
+        self.path = os.path.abspath(os.path.expanduser(path or default_mirror_path()))
+        self.api_url = api_url
+        self.token = token
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS instances ("
+                "kind_id TEXT PRIMARY KEY, kind_type TEXT, created_at TEXT, "
+                "uid TEXT, record TEXT)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS instances_kind_type "
+                "ON instances (kind_type)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS instances_created_at "
+                "ON instances (created_at)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS instances_uid ON instances (uid)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value)"
+            )
+
+    def _db(self):
+        return connect(self.path)
+
+    def __len__(self):
+        with self._db() as db:
+            return db.execute("SELECT COUNT(*) FROM instances").fetchone()[0]
+
+    # a query against the mirror, like opal.query.Instance()
+    def instance(self):
+        return MirrorInstance(self)
+
+    # time.time() of the last complete resync, or None
+    def last_synced(self):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT value FROM sync_state WHERE key = 'last_synced'"
+            ).fetchone()
+        return None if row is None else row[0]
+
+    # Bring the whole mirror up to date with the catalog. Returns counts
+    # of added, updated, unchanged and removed entries, and whether the
+    # catalog listing was complete. If it wasn't, nothing is removed and
+    # last_synced isn't updated.
+    def resync(self, page_size=DEFAULT_PAGE_SIZE):
+        records = Instance(self.api_url, self.token).iter_search(page_size)
+        with self._db() as db:
+            known = {r[0] for r in db.execute("SELECT kind_id FROM instances")}
+
+        counts, seen = self._write(records, known)
+        counts["complete"] = records.complete is True
+        if not counts["complete"]:
+            return counts
+
+        with self._db() as db:
+            counts["removed"] = self._remove(db, known - seen)
+            db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES ('last_synced', ?)",
+                (time.time(),),
+            )
+        return counts
+
+    # Fetch just the given kind_ids. Ones the catalog doesn't have are
+    # removed from the mirror. Returns counts of added, updated, unchanged
+    # and removed entries.
+    def refresh(self, ids):
+        ids = list(dict.fromkeys(ids))
+        with self._db() as db:
+            known = {
+                r[0]
+                for batch in _batches(ids, SYNC_BATCH_SIZE)
+                for r in db.execute(
+                    "SELECT kind_id FROM instances WHERE kind_id IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            }
+
+        counts, seen = self._write(self._fetch_ids(ids), known)
+        with self._db() as db:
+            counts["removed"] = self._remove(db, set(ids) - seen)
+        return counts
+
+    def _remove(self, db, kind_ids):
+        removed = db.executemany(
+            "DELETE FROM instances WHERE kind_id = ?", [(k,) for k in kind_ids]
+        ).rowcount
+        return max(removed, 0)
+
+    # insert or update records, given the kind_ids already in the mirror.
+    # Returns counts and the kind_ids written.
+    def _write(self, records, known):
+        counts = dict(added=0, updated=0, unchanged=0, removed=0)
+        seen = set()
+
+        for batch in _batches(map(_row, records), SYNC_BATCH_SIZE):
+            new, old = [], []
+            for r in batch:
+                if r[0] in known or r[0] in seen:
+                    old.append((r[1], r[2], r[3], r[4], r[0], r[4]))
+                else:
+                    new.append(r)
+                seen.add(r[0])
+            with self._db() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?)", new
+                )
+                updated = db.executemany(
+                    "UPDATE instances SET kind_type = ?, created_at = ?, uid = ?, "
+                    "record = ? WHERE kind_id = ? AND record IS NOT ?",
+                    old,
+                ).rowcount
+            counts["added"] += len(new)
+            counts["updated"] += max(updated, 0)
+            counts["unchanged"] += len(old) - max(updated, 0)
+        return counts, seen
+
+    def _fetch_ids(self, ids):
+        def one(kind_id):
+            return Instance(self.api_url, self.token).one(kind_id).all() or []
+
+        with ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY) as pool:
+            for records in pool.map(one, ids):
+                yield from records
+
+    # run a WHERE clause, returns Results
+    def select(self, where="1", params=()):
+        with self._db() as db:
+            rows = db.execute(
+                f"SELECT record FROM instances WHERE {where} ORDER BY kind_id",
+                params,
+            ).fetchall()
+        return Results(dict(data=[json.loads(r[0]) for r in rows]))
+
+
+def _condition(key):
+    column = INDEXED_KEYS.get(key)
+    if column is not None:
+        return f"{column} IS ?"
+    return "json_extract(record, ?) IS ?"
+
+
+def _params(key, value):
+    if key in INDEXED_KEYS:
+        return [None if value is None else str(value)]
+    return ["$.kind_metadata." + key, value]
+
+
+# Instance's query surface over a CatalogMirror
+class MirrorInstance:
+    def __init__(self, mirror=None):
+        self.mirror = CatalogMirror() if mirror is None else mirror
+
+        self.query = []
+        self.type = None
+        self.id = None
+
+    def _with(self, key, value):
+        self.__reset()
+        self.query.append(dict(key=key, value=value))
+        return self
+
+    def _type(self, type):
+        self.type = type
+        return self
+
+    def _and(self, key, value):
+        self.query.append(dict(key=key, value=value, operator="AND"))
+        return self
+
+    def _or(self, key, value):
+        self.query.append(dict(key=key, value=value, operator="OR"))
+        return self
+
+    def _not(self, key, value):
+        self.query.append(dict(key=key, value=value, operator="NOT"))
+        return self
+
+    def __reset(self):
+        self.query = []
+        self.type = None
+
+    def one(self, id):
+        self.id = id
+        r = self.search()
+        self.id = None
+        return r
+
+    def search(self):
+        return self.mirror.select(*self._where())
+
+    # the query as a SQL condition and its parameters
+    def _where(self):
+        where, params = None, []
+        for clause in self.query:
+            key = clause["key"]
+            condition = _condition(key)
+            operator = clause.get("operator")
+            if where is None:
+                where = f"({condition})" if operator != "NOT" else f"NOT ({condition})"
+            elif operator == "OR":
+                where = f"({where} OR {condition})"
+            elif operator == "NOT":
+                where = f"({where} AND NOT {condition})"
+            else:
+                where = f"({where} AND {condition})"
+            params += _params(key, clause["value"])
+
+        conditions = [] if where is None else [where]
+        if self.type is not None:
+            conditions.append("kind_type = ?")
+            params.append(self.type)
+        if self.id is not None:
+            conditions.append("kind_id = ?")
+            params.append(self.id)
+        return " AND ".join(conditions) or "1", params
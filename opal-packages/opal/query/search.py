@@ -3,6 +3,19 @@ import requests
 import pandas as pd
 import time
 import json
+import itertools
+
+from .stream import iter_json_array
+from .cache import default_cache
+from .frame import records_to_frame, frame_to_arrow
+
+# columns Results.where returns when it isn't given fields
+DEFAULT_FIELDS = ["kind_id", "kind_type"]
+
+# records per request for Instance.iter_search
+DEFAULT_PAGE_SIZE = 500
+# bytes per read of a streamed response body
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class Instance:
@@ -10,9 +23,12 @@ class Instance:
         self,
         api_url=os.environ.get("CATALOG_BACKEND_URL"),
         token=os.environ.get("JUPYTERHUB_API_TOKEN"),
+        cache=None,
     ):
         self.url = api_url
         self.token = token
+        # cache=True uses the shared QueryCache, or pass your own
+        self.cache = default_cache() if cache is True else cache
 
         self.query = []
         self.type = None
@@ -39,12 +55,6 @@ class Instance:
         self.query.append(dict(key=key, value=value, operator="NOT"))
         return self
 
-    def __hexify(self, d):
-        d = json.dumps(d)
-        d = d.encode("utf-8")
-        d = d.hex()
-        return d
-
     def __reset(self):
         self.query = []
         self.type = None
@@ -56,43 +66,158 @@ class Instance:
         return r
 
     def search(self):
-        query_str = self.url + "/instance"
-        query_parts = []
-
-        if len(self.query) > 0:
-            hex_querystring = self.__hexify(self.query)
-            query_parts.append(f"search={hex_querystring}")
+        if self.cache is not None:
+            return Results(self.cache.get_json(self._query_url(), self.token))
 
-        if self.type is not None:
-            query_parts.append(f"kind_type={self.type}")
-
-        if self.id is not None:
-            query_parts.append(f"kind_id={self.id}")
-
-        joined_parts = "&".join(query_parts) if len(query_parts) > 0 else None
-
-        if joined_parts is not None:
-            query_str += f"?{joined_parts}"
-
-        r = requests.get(query_str,
-                         headers={"Authorization": "token %s" % self.token})
+        r = requests.get(
+            self._query_url(), headers={"Authorization": "token %s" % self.token}
+        )
 
         json_response = r.json()
         return Results(json_response)
 
-
+    # Search a page at a time, returning lazy Results that request pages
+    # and parse each response body incrementally as they're iterated over.
+    # Pages are requested with limit and offset. Paging stops at an empty
+    # or short page. A server that ignores limit (returns more than
+    # page_size records) has sent the whole result in the first response.
+    # A page starting with a record already seen means the server ignores
+    # offset: paging stops there, and since the records seen may not be
+    # all of them, the Results' `complete` is False (it's True once every
+    # record has been read from a listing known to be whole).
+    def iter_search(self, page_size=DEFAULT_PAGE_SIZE):
+        # the query as it is now, later changes to self don't affect it
+        query_url = self._query_url()
+        sep = "&" if "?" in query_url else "?"
+        headers = {"Authorization": "token %s" % self.token}
+
+        def records():
+            seen = set()
+            for offset in itertools.count(0, page_size):
+                r = requests.get(
+                    f"{query_url}{sep}limit={page_size}&offset={offset}",
+                    headers=headers,
+                    stream=True,
+                )
+                with r:
+                    r.raise_for_status()
+                    n = 0
+                    for record in iter_json_array(
+                        r.iter_content(STREAM_CHUNK_SIZE), "data"
+                    ):
+                        kind_id = record.get("kind_id")
+                        if n == 0 and offset > 0 and kind_id in seen:
+                            # the same page again
+                            res.complete = False
+                            return
+                        seen.add(kind_id)
+                        n += 1
+                        yield record
+                if n != page_size:
+                    res.complete = True
+                    return
+
+        res = Results.lazy(records())
+        return res
+
+    def _query_url(self):
+        return query_url(self.url, self.query, self.type, self.id)
+
+
+def _hexify(d):
+    d = json.dumps(d)
+    d = d.encode("utf-8")
+    d = d.hex()
+    return d
+
+
+# the /instance URL for a query (a list of key/value/operator dicts),
+# kind_type and kind_id
+def query_url(api_url, query, type=None, id=None):
+    query_str = api_url + "/instance"
+    query_parts = []
+
+    if len(query) > 0:
+        hex_querystring = _hexify(list(query))
+        query_parts.append(f"search={hex_querystring}")
+
+    if type is not None:
+        query_parts.append(f"kind_type={type}")
+
+    if id is not None:
+        query_parts.append(f"kind_id={id}")
+
+    joined_parts = "&".join(query_parts) if len(query_parts) > 0 else None
+
+    if joined_parts is not None:
+        query_str += f"?{joined_parts}"
+
+    return query_str
+
+
+# Search results. Results from Instance.iter_search are lazy: records are
+# fetched as they're iterated over, and ids, filter and reduce consume
+# them one at a time without keeping them. A lazy Results can only be
+# iterated once, unless all() is called first to load every record.
 class Results:
     def __init__(self, response_dict):
         self.results = response_dict.get("data")
+        self._records = None
+        self._consumed = False
+        # whether every record of the query is here, see iter_search
+        self.complete = True
+
+    @classmethod
+    def lazy(cls, records):
+        res = cls({})
+        res._records = records
+        res.complete = None
+        return res
+
+    def __iter__(self):
+        if self._records is not None:
+            records, self._records = self._records, None
+            self._consumed = True
+            return iter(records)
+        if self._consumed:
+            raise RuntimeError("lazy Results can only be iterated once")
+        return iter(self.results)
 
     def all(self):
+        if self._records is not None:
+            self.results = list(self)
+            self._consumed = False
         return self.results
 
     def ids(self):
-        return [i.get("kind_id") for i in self.results]
+        return [i.get("kind_id") for i in self]
 
     def filter(self, lx):
-        return [i for i in self.results if lx(i) is True]
+        return [i for i in self if lx(i) is True]
 
     def reduce(self, lx):
-        return [lx(i) for i in self.results]
+        return [lx(i) for i in self]
+
+    # A DataFrame with a column for each dotted path in `fields`, like
+    # "kind_metadata.ch10_metadata.uid". Only those fields are extracted.
+    # Without fields, every record is flattened into columns.
+    def to_frame(self, fields=None):
+        if fields is None:
+            return pd.json_normalize(list(self))
+        return records_to_frame(self, fields)
+
+    # to_frame as a pyarrow Table (needs pyarrow)
+    def to_arrow(self, fields=None):
+        return frame_to_arrow(self.to_frame(fields))
+
+    # The rows matching `predicate`, an expression of opal.query.field()s,
+    # as a DataFrame of `fields` (default kind_id, kind_type and the fields
+    # used by the predicate). The predicate is evaluated on columns, and
+    # only the fields it needs plus `fields` are extracted from the records.
+    def where(self, predicate, fields=None):
+        used = sorted(predicate.fields())
+        if fields is None:
+            fields = DEFAULT_FIELDS + [f for f in used if f not in DEFAULT_FIELDS]
+        frame = records_to_frame(self, list(fields) + used)
+        mask = predicate.evaluate(frame)
+        return frame.loc[mask, list(dict.fromkeys(fields))].reset_index(drop=True)
@@ -0,0 +1,19 @@
+import sqlite3
+import contextlib
+
+# Connections to the local SQLite files opal keeps (the catalog mirror,
+# publish digests and spool, the S3 file cache). These files are shared
+# between threads and processes, so every use opens its own connection,
+# and closes it again afterwards.
+#
+#   with connect(path) as db:
+#       db.execute(...)  # committed on exit, rolled back on an exception
+
+DEFAULT_TIMEOUT = 60  # seconds to wait for another writer's lock
+
+
+@contextlib.contextmanager
+def connect(path, timeout=DEFAULT_TIMEOUT, **kwargs):
+    with contextlib.closing(sqlite3.connect(path, timeout=timeout, **kwargs)) as db:
+        with db:
+            yield db
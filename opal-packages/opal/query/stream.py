@@ -0,0 +1,109 @@
+import json
+import codecs
+
+# Incremental parsing of catalog responses, {"data": [record, ...], ...},
+# yielding records one at a time as the body arrives instead of loading
+# the whole body and every record into memory first.
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+
+class _Buffer:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    # Read more of the body, at least `min_chars` characters of it if it
+    # has them (and always at least one chunk). Returns False at the end.
+    def fill(self, min_chars=0):
+        if self.eof:
+            return False
+        # drop what's been parsed so the buffer stays small
+        parts = [self.text[self.pos :]]
+        self.pos = 0
+        added = 0
+        for chunk in self.chunks:
+            if chunk:
+                parts.append(self.utf8.decode(chunk))
+                added += len(parts[-1])
+                if added >= min_chars:
+                    break
+        else:
+            parts.append(self.utf8.decode(b"", final=True))
+            self.eof = True
+        self.text = "".join(parts)
+        return True
+
+    # the next non-whitespace character, without consuming it
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError("unexpected end of JSON body")
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"expected {char!r} in JSON body, found {found!r}")
+        self.pos += 1
+
+    # decode one JSON value, reading more of the body until it's complete
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # at least double the unparsed text before trying again,
+                # so a value spanning many chunks is parsed O(1) times
+                # per byte rather than once per chunk
+                if not self.fill(len(self.text) - self.pos):
+                    raise
+                continue
+            if (
+                isinstance(value, (int, float))
+                and not self.eof
+                and (end == len(self.text) or self.text[end] not in _DELIMITERS)
+            ):
+                # a number may continue in the next chunk ("12" of "12.5")
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+# Yield the items of the array under `key` in a JSON object body, given
+# as an iterable of bytes chunks (like response.iter_content()). Other
+# keys are skipped. Nothing is yielded if the key is missing or null.
+def iter_json_array(chunks, key="data"):
+    buf = _Buffer(chunks)
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+
+    while True:
+        name = buf.value()
+        buf.expect(":")
+        if name == key and buf.peek() == "[":
+            buf.expect("[")
+            if buf.peek() != "]":
+                while True:
+                    yield buf.value()
+                    if buf.peek() == "]":
+                        break
+                    buf.expect(",")
+            buf.expect("]")
+        else:
+            buf.value()
+
+        if buf.peek() == "}":
+            return
+        buf.expect(",")
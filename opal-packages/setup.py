@@ -4,6 +4,14 @@ setup(
     name="opal-packages",
     version="0.1",
     packages=["opal.flow", "opal.publish", "opal.query"],
-    install_requires=["metaflow", "numpy", "pandas", "s3fs", "requests"],
+    install_requires=[
+        "metaflow",
+        "numpy",
+        "pandas",
+        "s3fs",
+        "boto3",
+        "requests",
+        "aiohttp",
+    ],
     package_data={"opal.flow_utils": ["resources/flow_script_upload.py"]},
 )
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import uuid
+import pytest
+from fsspec.asyn import AsyncFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+
+from opal.flow.bulk import bulk_exists, bulk_ls, bulk_cat_json, unwrap
+
+
+# async filesystem over a dict that records how many calls overlap
+class DictAsyncFileSystem(AsyncFileSystem):
+    cachable = False
+
+    def __init__(self, files, **kwargs):
+        super().__init__(**kwargs)
+        self.files = files
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _call(self, result):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return result()
+
+    async def _exists(self, path, **kwargs):
+        return await self._call(
+            lambda: any(p == path or p.startswith(path + "/") for p in self.files)
+        )
+
+    async def _ls(self, path, detail=False, **kwargs):
+        def ls():
+            out = sorted(p for p in self.files if p.startswith(path + "/"))
+            if not out:
+                raise FileNotFoundError(path)
+            return out
+
+        return await self._call(ls)
+
+    async def _cat_file(self, path, start=None, end=None, **kwargs):
+        def cat():
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            return self.files[path]
+
+        return await self._call(cat)
+
+
+@pytest.fixture
+def baskets():
+    files = {}
+    paths = []
+    for i in range(20):
+        basket = f"bucket/ch10/basket{i}"
+        files[f"{basket}/basket_metadata.json"] = json.dumps(
+            {"ch10name": f"flight{i}"}
+        ).encode()
+        files[f"{basket}/flight{i}.ch10"] = b"ch10"
+        paths.append(basket)
+    return DictAsyncFileSystem(files), paths
+
+
+def test_bulk_cat_json(baskets):
+    fs, paths = baskets
+    metadata_paths = [f"{p}/basket_metadata.json" for p in paths]
+
+    out = bulk_cat_json(metadata_paths, fs=fs, concurrency=4)
+
+    assert list(out) == metadata_paths
+    assert out[metadata_paths[3]] == {"ch10name": "flight3"}
+
+
+def test_concurrency_is_limited(baskets):
+    fs, paths = baskets
+
+    bulk_exists([f"{p}/basket_metadata.json" for p in paths], fs=fs, concurrency=4)
+
+    assert 1 < fs.max_in_flight <= 4
+
+
+def test_bulk_exists_and_ls(baskets):
+    fs, paths = baskets
+
+    exists = bulk_exists([paths[0], "bucket/ch10/nope"], fs=fs)
+    listing = bulk_ls(paths[:2], fs=fs)
+
+    assert exists == {paths[0]: True, "bucket/ch10/nope": False}
+    assert listing[paths[1]] == [
+        f"{paths[1]}/basket_metadata.json",
+        f"{paths[1]}/flight1.ch10",
+    ]
+
+
+def test_errors_raise_by_default(baskets):
+    fs, paths = baskets
+
+    with pytest.raises(FileNotFoundError):
+        bulk_cat_json([f"{paths[0]}/basket_manifest.json"], fs=fs)
+
+
+def test_return_exceptions(baskets):
+    fs, paths = baskets
+    good = f"{paths[0]}/basket_metadata.json"
+    missing = f"{paths[0]}/basket_manifest.json"
+
+    out = bulk_cat_json([good, missing], fs=fs, return_exceptions=True)
+
+    assert unwrap(out[good]) == {"ch10name": "flight0"}
+    assert isinstance(out[missing], FileNotFoundError)
+    with pytest.raises(FileNotFoundError):
+        unwrap(out[missing])
+
+
+def test_sync_filesystem_fallback():
+    fs = MemoryFileSystem()
+    root = f"/bucket-{uuid.uuid4().hex}"
+    fs.pipe_file(f"{root}/a/basket_manifest.json", b'{"uuid": "a"}')
+
+    out = bulk_cat_json(
+        [f"{root}/a/basket_manifest.json", f"{root}/b/basket_manifest.json"],
+        fs=fs,
+        return_exceptions=True,
+    )
+    exists = bulk_exists([f"{root}/a", f"{root}/b"], fs=fs)
+
+    assert out[f"{root}/a/basket_manifest.json"] == {"uuid": "a"}
+    assert isinstance(out[f"{root}/b/basket_manifest.json"], FileNotFoundError)
+    assert exists == {f"{root}/a": True, f"{root}/b": False}
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import uuid
+import pytest
+from fsspec.implementations.memory import MemoryFileSystem
+
+from opal.flow.cache import LocalCacheFileSystem
+
+
+# memory filesystem that reports ETags like S3 and counts reads
+class ETagMemoryFileSystem(MemoryFileSystem):
+    cachable = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gets = 0
+
+    def info(self, path, **kwargs):
+        out = super().info(path, **kwargs)
+        if out["type"] == "file":
+            out["ETag"] = hashlib.md5(self.cat_file(path)).hexdigest()
+        return out
+
+    def get_file(self, rpath, lpath, **kwargs):
+        self.gets += 1
+        return super().get_file(rpath, lpath, **kwargs)
+
+
+@pytest.fixture
+def remote():
+    fs = ETagMemoryFileSystem()
+    root = f"/bucket-{uuid.uuid4().hex}"
+    fs.pipe_file(f"{root}/NAV.parquet/part_00.parquet", b"a" * 100)
+    fs.pipe_file(f"{root}/NAV.parquet/part_01.parquet", b"b" * 100)
+    return fs, root
+
+
+def test_repeated_reads_hit_cache(remote, tmp_path):
+    fs, root = remote
+    cache = LocalCacheFileSystem(fs, cache_dir=str(tmp_path))
+    path = f"{root}/NAV.parquet/part_00.parquet"
+
+    assert cache.cat_file(path) == b"a" * 100
+    assert cache.cat_file(path) == b"a" * 100
+
+    assert fs.gets == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["cached_bytes"] == 100
+
+
+def test_changed_etag_invalidates(remote, tmp_path):
+    fs, root = remote
+    cache = LocalCacheFileSystem(fs, cache_dir=str(tmp_path))
+    path = f"{root}/NAV.parquet/part_00.parquet"
+
+    cache.cat_file(path)
+    fs.pipe_file(path, b"new")
+
+    assert cache.cat_file(path) == b"new"
+    assert fs.gets == 2
+    assert cache.stats()["cached_bytes"] == 3
+
+
+def test_lru_eviction(remote, tmp_path):
+    fs, root = remote
+    cache = LocalCacheFileSystem(fs, cache_dir=str(tmp_path), max_bytes=150)
+    part_00 = f"{root}/NAV.parquet/part_00.parquet"
+    part_01 = f"{root}/NAV.parquet/part_01.parquet"
+
+    cache.cat_file(part_00)
+    cache.cat_file(part_01)
+    # only one fits, the least recently used one went
+    assert cache.stats()["cached_bytes"] == 100
+
+    cache.cat_file(part_01)
+    assert cache.stats()["hits"] == 1
+    cache.cat_file(part_00)
+    assert fs.gets == 3
+
+
+def test_listing_passes_through(remote, tmp_path):
+    fs, root = remote
+    cache = LocalCacheFileSystem(fs, cache_dir=str(tmp_path))
+
+    assert sorted(cache.find(f"{root}/NAV.parquet")) == sorted(
+        fs.find(f"{root}/NAV.parquet")
+    )
+    assert cache.info(f"{root}/NAV.parquet/part_00.parquet")["size"] == 100
+
+
+def test_cache_shared_across_instances(remote, tmp_path):
+    fs, root = remote
+    path = f"{root}/NAV.parquet/part_00.parquet"
+
+    LocalCacheFileSystem(fs, cache_dir=str(tmp_path)).cat_file(path)
+    # e.g. a new notebook kernel
+    assert (
+        LocalCacheFileSystem(fs, cache_dir=str(tmp_path)).cat_file(path) == b"a" * 100
+    )
+    assert fs.gets == 1
+
+
+def test_file_evicted_after_lookup_is_refetched(remote, tmp_path):
+    fs, root = remote
+    cache = LocalCacheFileSystem(fs, cache_dir=str(tmp_path))
+    path = f"{root}/NAV.parquet/part_00.parquet"
+    cache.cat_file(path)
+
+    # another process evicts it between the lookup and the open
+    lookup = cache._lookup
+
+    def lookup_then_evict(path, etag):
+        local_path = lookup(path, etag)
+        os.remove(local_path)
+        return local_path
+
+    cache._lookup = lookup_then_evict
+    assert cache.cat_file(path) == b"a" * 100
+    assert fs.gets == 2
+    assert cache.stats()["misses"] == 2
@@ -0,0 +1,127 @@
+import os
+import fsspec
+import pytest
+from unittest.mock import patch
+
+from opal.flow.compression import (
+    compress_file,
+    compress_upload_files,
+    compress_basket_items,
+    open_artifact,
+    strip_codec_extension,
+)
+
+CH10 = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "..",
+    "..",
+    "resources",
+    "652200104150842.ch10",
+)
+
+
+@pytest.fixture
+def local_fs():
+    return fsspec.filesystem("file")
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_open_artifact_roundtrip(codec, tmp_path, local_fs):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+
+    src = tmp_path / "_metadata.yaml"
+    src.write_text("type: MILSTD1553_F1\n" * 100)
+    stored = compress_file(
+        str(src), str(src) + (".gz" if codec == "gzip" else ".zst"), codec
+    )
+    assert os.path.getsize(stored) < os.path.getsize(src)
+    os.remove(src)
+
+    # found by its original name, and by its stored name
+    with open_artifact(str(src), "r", fs=local_fs) as f:
+        assert f.read() == "type: MILSTD1553_F1\n" * 100
+    with open_artifact(stored, "rb", fs=local_fs) as f:
+        assert f.read() == b"type: MILSTD1553_F1\n" * 100
+
+    # closing it closes the file underneath
+    opened = []
+    fs_open = local_fs.open
+    with patch.object(
+        local_fs, "open", lambda *a: opened.append(fs_open(*a)) or opened[-1]
+    ):
+        open_artifact(stored, "rb", fs=local_fs).close()
+    assert opened[0].closed
+
+
+def test_open_artifact_uncompressed(tmp_path, local_fs):
+    src = tmp_path / "plain.txt"
+    src.write_text("hello")
+    with open_artifact(str(src), "r", fs=local_fs) as f:
+        assert f.read() == "hello"
+
+
+def test_compression_is_deterministic(tmp_path):
+    a = compress_file(CH10, str(tmp_path / "a.gz"), "gzip")
+    b = compress_file(CH10, str(tmp_path / "b.gz"), "gzip")
+    assert open(a, "rb").read() == open(b, "rb").read()
+    # keeps the source mtime so upload checkpoints still match
+    assert os.stat(a).st_mtime_ns == os.stat(CH10).st_mtime_ns
+
+
+def test_compress_upload_files(tmp_path):
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    part = tmp_path / "part.parquet"
+    part.write_bytes(b"p")
+    meta = tmp_path / "_metadata.yaml"
+    meta.write_text("m")
+
+    out = list(
+        compress_upload_files(
+            [("k/part.parquet", str(part)), ("k/_metadata.yaml", str(meta), 1)],
+            str(staging),
+            "gzip",
+        )
+    )
+
+    assert out[0] == ("k/part.parquet", str(part), 1)
+    assert out[1][0] == "k/_metadata.yaml.gz"
+    assert os.path.dirname(out[1][1]) == str(staging)
+
+
+def test_compress_basket_items(tmp_path):
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    parsed = tmp_path / "data.parquet"
+    parsed.mkdir()
+    (parsed / "part.parquet").write_bytes(b"p")
+    (parsed / "_metadata.yaml").write_text("m")
+    tmats = tmp_path / "_TMATS.txt"
+    tmats.write_text("t")
+
+    items, compressed = compress_basket_items(
+        [
+            {"path": str(parsed), "stub": False},
+            {"path": str(tmats), "stub": False},
+            {"path": str(tmats), "stub": True},
+        ],
+        str(staging),
+        "gzip",
+    )
+
+    assert items[0] == {"path": str(staging / "data.parquet"), "stub": False}
+    assert items[1] == {"path": str(staging / "_TMATS.txt.gz"), "stub": False}
+    assert items[2] == {"path": str(tmats), "stub": True}
+    assert sorted(compressed) == ["_TMATS.txt.gz", "data.parquet/_metadata.yaml.gz"]
+    assert sorted(os.listdir(staging / "data.parquet")) == [
+        "_metadata.yaml.gz",
+        "part.parquet",
+    ]
+
+
+def test_strip_codec_extension():
+    assert strip_codec_extension("b/x.ch10.zst") == "b/x.ch10"
+    assert strip_codec_extension("b/x.ch10.gz") == "b/x.ch10"
+    assert strip_codec_extension("b/x.ch10") == "b/x.ch10"
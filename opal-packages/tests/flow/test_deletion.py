@@ -0,0 +1,108 @@
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from opal.flow.deletion import delete_keys, delete_s3_urls, MAX_KEYS_PER_DELETE
+from opal.flow.flow_script_utils import delete_run_data
+
+
+# a fake s3 client over {bucket: {key: size}}
+def fake_client(objects, errors=(), unlistable=()):
+    client = MagicMock()
+
+    def paginate(Bucket, Prefix):
+        if Prefix in unlistable:
+            raise ClientError({"Error": {"Code": "AccessDenied"}}, "ListObjectsV2")
+        keys = sorted(k for k in objects[Bucket] if k.startswith(Prefix))
+        for i in range(0, len(keys), 700):
+            page = keys[i : i + 700]
+            yield {"Contents": [{"Key": k, "Size": objects[Bucket][k]} for k in page]}
+
+    def delete_objects(Bucket, Delete):
+        assert len(Delete["Objects"]) <= MAX_KEYS_PER_DELETE
+        keys = [o["Key"] for o in Delete["Objects"]]
+        for key in keys:
+            if key not in errors:
+                del objects[Bucket][key]
+        return {
+            "Errors": [
+                {"Key": k, "Code": "AccessDenied", "Message": "no"}
+                for k in keys
+                if k in errors
+            ]
+        }
+
+    client.get_paginator.return_value.paginate.side_effect = paginate
+    client.delete_objects.side_effect = delete_objects
+    return client
+
+
+def test_delete_in_batches():
+    objects = {"bucket": {f"run/data.parquet/part_{i}": 10 for i in range(2500)}}
+    objects["bucket"]["run/data.parquet_old"] = 1
+    objects["bucket"]["run/meta.yaml"] = 5
+    client = fake_client(objects)
+
+    report = delete_s3_urls(
+        ["s3://bucket/run/data.parquet", "s3://bucket/run/meta.yaml"], client=client
+    )
+
+    assert report.ok
+    assert (report.objects, report.bytes) == (2501, 25005)
+    assert client.delete_objects.call_count == 4
+    # the sibling with the same prefix is left alone
+    assert objects["bucket"] == {"run/data.parquet_old": 1}
+
+
+def test_delete_keys():
+    objects = {"bucket": {f"run/{i}": 1 for i in range(1500)}}
+    client = fake_client(objects, errors={"run/7"})
+
+    errors = delete_keys(client, "bucket", [f"run/{i}" for i in range(1200)])
+
+    assert errors == {"run/7": "AccessDenied: no"}
+    assert client.delete_objects.call_count == 2
+    assert len(objects["bucket"]) == 301
+
+
+def test_failures_are_reported():
+    objects = {"bucket": {"run/a/0": 1, "run/a/1": 2, "run/b/0": 3}}
+    client = fake_client(objects, errors={"run/a/1"}, unlistable={"run/b"})
+
+    report = delete_s3_urls(["s3://bucket/run/a", "s3://bucket/run/b"], client=client)
+
+    assert not report.ok
+    assert (report.objects, report.bytes) == (1, 1)
+    assert report.failed["s3://bucket/run/a/1"] == "AccessDenied: no"
+    assert "AccessDenied" in report.failed["s3://bucket/run/b"]
+
+
+def test_connection_errors_are_reported():
+    objects = {"bucket": {"run/a/0": 1}}
+    client = fake_client(objects)
+    client.delete_objects.side_effect = EndpointConnectionError(
+        endpoint_url="http://minio"
+    )
+
+    report = delete_s3_urls(["s3://bucket/run/a"], client=client)
+
+    assert not report.ok
+    assert "Could not connect" in report.failed["s3://bucket/run/a/0"]
+
+
+@patch("opal.publish.delete")
+def test_delete_run_data_deletes_from_catalog_last(mock_delete):
+    run = MagicMock(id="123")
+    run.data.data_files = {"parsed": "s3://bucket/run/a"}
+
+    objects = {"bucket": {"run/a/0": 1}}
+    report = delete_run_data(run, client=fake_client(objects, errors={"run/a/0"}))
+    assert not report.ok
+    mock_delete.assert_not_called()
+    # not tagged, so it's still picked up for deletion
+    run.add_tag.assert_not_called()
+
+    report = delete_run_data(run, client=fake_client(objects))
+    assert report.ok and report.objects == 1
+    mock_delete.assert_called_once_with("123")
+    run.add_tag.assert_called_with("no_data")
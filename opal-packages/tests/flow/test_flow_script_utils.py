@@ -1,3 +1,4 @@
+from unittest.mock import MagicMock, patch
 from opal.flow.flow_script_utils import *
 
 # two levels up from this file
@@ -20,3 +21,117 @@ def test_folder_upload_with_key():
     upload_struct = get_metaflow_s3_folder_upload_structure(dir, key)
 
     assert all([k.startswith(key) for k, _ in upload_struct])
+
+
+def test_folder_upload_structure_repeated_root_name(tmp_path):
+    # a subdirectory with the same name as the root
+    root = tmp_path / "data"
+    (root / "data").mkdir(parents=True)
+    (root / "data" / "f.txt").write_text("x")
+
+    upload_struct = get_metaflow_s3_folder_upload_structure(str(root), "key")
+
+    assert upload_struct == [("key/data/f.txt", str(root / "data" / "f.txt"))]
+
+
+def test_walk_upload_tree_sizes_and_filters(tmp_path):
+    (tmp_path / "a.parquet").mkdir()
+    (tmp_path / "a.parquet" / "part_0.parquet").write_bytes(b"xxx")
+    (tmp_path / "a.parquet" / "_metadata.yaml").write_text("y")
+    (tmp_path / "tmp").mkdir()
+    (tmp_path / "tmp" / "scratch.parquet").write_bytes(b"z")
+
+    walker = walk_upload_tree(str(tmp_path), "k")
+    # lazy
+    assert not isinstance(walker, list)
+    assert sorted(walker) == [
+        (
+            "k/a.parquet/_metadata.yaml",
+            str(tmp_path / "a.parquet" / "_metadata.yaml"),
+            1,
+        ),
+        (
+            "k/a.parquet/part_0.parquet",
+            str(tmp_path / "a.parquet" / "part_0.parquet"),
+            3,
+        ),
+        ("k/tmp/scratch.parquet", str(tmp_path / "tmp" / "scratch.parquet"), 1),
+    ]
+
+    keys = [
+        k
+        for k, _, _ in walk_upload_tree(
+            str(tmp_path), "k", include=["*.parquet"], exclude=["tmp"]
+        )
+    ]
+    assert keys == ["k/a.parquet/part_0.parquet"]
+
+
+def test_walk_upload_tree_symlinks(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "f").write_text("x")
+    (root / "link_f").symlink_to(root / "f")
+    (root / "loop").symlink_to(root)
+
+    def keys(symlinks):
+        return sorted(
+            k for k, _, _ in walk_upload_tree(str(root), "k", symlinks=symlinks)
+        )
+
+    assert keys("files") == ["k/f", "k/link_f"]
+    assert keys("skip") == ["k/f"]
+    # the loop back to root isn't followed forever
+    assert keys("follow") == ["k/f", "k/link_f"]
+
+
+def _fake_run(run_id, successful=True, tags=()):
+    run = MagicMock(id=run_id, successful=successful, tags=set(tags), _tags=list(tags))
+    run.data._artifacts = {"data_files": MagicMock(data={})}
+    run.parent.id = "TestFlow"
+    return run
+
+
+def test_publish_runs_skips_unpublishable_runs():
+    runs = [
+        _fake_run("1"),
+        _fake_run("2", successful=False),
+        _fake_run("3", tags=["no_data"]),
+        _fake_run("4"),
+    ]
+
+    with patch("opal.publish.publish_many") as mock_publish_many:
+        mock_publish_many.side_effect = lambda instances, **kw: [
+            (True, 201) for _ in instances
+        ]
+        results = publish_runs(runs, concurrency=2)
+
+    assert results == {"1": (True, 201), "4": (True, 201)}
+    assert mock_publish_many.call_args.kwargs == {"concurrency": 2, "force": False}
+
+
+def test_publish_run_spool():
+    with patch("opal.publish.spool.enqueue") as mock_enqueue, patch(
+        "opal.publish.publish"
+    ) as mock_publish:
+        assert publish_run(_fake_run("1"), spool=True) == (True, None)
+
+    mock_publish.assert_not_called()
+    kind_id, kind_type, run_data = mock_enqueue.call_args.args
+    assert (kind_id, kind_type, run_data["id"]) == ("1", "TestFlow", "1")
+
+
+def test_publish_run_force_and_repost():
+    run = _fake_run("1", successful=False)
+    with patch("opal.publish.publish") as mock_publish:
+        mock_publish.return_value = (True, 201)
+        assert publish_run(run) is False
+        mock_publish.assert_not_called()
+
+        # force only overrides should_publish_run, delta still applies
+        publish_run(run, force=True, delta=True)
+        assert mock_publish.call_args.kwargs == {"force": False, "delta": True}
+
+        # repost sends it even if its digest is unchanged
+        publish_run(_fake_run("2"), repost=True, delta=True)
+        assert mock_publish.call_args.kwargs == {"force": True, "delta": True}
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from opal.flow.opal_flowspec import OpalFlowSpec
+
+
+@patch("opal.flow.opal_flowspec.current", SimpleNamespace(run_id="1", flow_name="F"))
+@patch("weave.upload.UploadBasket")
+def test_upload_basket_metadata_is_per_call(mock_upload, tmp_path):
+    src = tmp_path / "meta.yaml"
+    src.write_text("type: MILSTD1553_F1\n" * 100)
+    items = [{"path": str(src), "stub": False}]
+    flow = SimpleNamespace()
+
+    OpalFlowSpec.metaflow_upload_basket(flow, items, "parsed", compression="gzip")
+    OpalFlowSpec.metaflow_upload_basket(flow, items, "parsed")
+
+    first, second = (c.kwargs["metadata"] for c in mock_upload.call_args_list)
+    assert first["opal_compression"]["codec"] == "gzip"
+    # the second upload wasn't compressed, and doesn't say it was
+    assert "opal_compression" not in second
+    assert second["metaflow_manifest"] == {"run_id": "1", "flow_name": "F"}
+
+
+def test_upload_dedup_is_not_resumable(tmp_path):
+    with pytest.raises(ValueError, match="dedup and resumable"):
+        OpalFlowSpec.upload(
+            SimpleNamespace(), str(tmp_path), dedup=True, resumable=True
+        )
@@ -0,0 +1,49 @@
+import pytest
+
+from opal.flow import other_utils
+from opal.flow.other_utils import get_s3fs, get_s3_client, minio_s3fs
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("S3_ENDPOINT", "http://minio:9000")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    other_utils._clear_caches()
+
+
+def test_s3fs_is_reused():
+    assert minio_s3fs() is minio_s3fs()
+    assert minio_s3fs() is get_s3fs("http://minio:9000")
+
+
+def test_s3fs_keyed_on_endpoint_and_credentials(monkeypatch):
+    fs = minio_s3fs()
+    assert get_s3fs("http://other:9000") is not fs
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "new-key")
+    assert minio_s3fs() is not fs
+
+
+def test_s3fs_connection_settings(monkeypatch):
+    monkeypatch.setenv("OPAL_S3_POOL_SIZE", "7")
+    fs = get_s3fs("http://minio:9000", max_attempts=3)
+
+    assert fs.config_kwargs["max_pool_connections"] == 7
+    assert fs.config_kwargs["retries"]["max_attempts"] == 3
+    assert fs.config_kwargs["tcp_keepalive"] is True
+    assert fs.client_kwargs["endpoint_url"] == "http://minio:9000"
+
+
+def test_s3_client_is_reused():
+    client = get_s3_client("http://minio:9000", max_pool_connections=4)
+    assert client is get_s3_client("http://minio:9000", max_pool_connections=4)
+    assert client is not get_s3_client("http://minio:9000", max_pool_connections=8)
+    assert client.meta.config.max_pool_connections == 4
+
+
+def test_caches_cleared_after_fork():
+    fs = minio_s3fs()
+    # what os.register_at_fork runs in the child
+    other_utils._clear_caches()
+    assert minio_s3fs() is not fs
@@ -0,0 +1,136 @@
+from unittest.mock import MagicMock, patch
+import time
+import pytest
+
+from opal.flow.streaming import UploadWatcher
+
+
+def uploaded_keys(manager):
+    return [c.args[2] for c in manager.upload.call_args_list]
+
+
+def make_watcher(folder):
+    return UploadWatcher(
+        str(folder),
+        "parsed_data",
+        "s3://bucket/run",
+        quiet_period=0.05,
+        poll_interval=0.01,
+        client=MagicMock(),
+        progress=False,
+    )
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_quiet_files_upload_while_writing(mock_create, tmp_path):
+    manager = mock_create.return_value
+    data = tmp_path / "data.parquet"
+    data.mkdir()
+
+    with make_watcher(tmp_path):
+        (data / "part_000.parquet").write_bytes(b"x" * 10)
+        (data / "_metadata.yaml").write_text("type: data")
+
+        # the finished part goes up before the writer is done ...
+        deadline = time.monotonic() + 5
+        while not manager.upload.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert uploaded_keys(manager) == [
+            "run/parsed_data/data.parquet/part_000.parquet"
+        ]
+
+        (data / "part_001.parquet").write_bytes(b"x" * 10)
+
+    # ... and the metadata file always goes last
+    assert uploaded_keys(manager) == [
+        "run/parsed_data/data.parquet/part_000.parquet",
+        "run/parsed_data/data.parquet/part_001.parquet",
+        "run/parsed_data/data.parquet/_metadata.yaml",
+    ]
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_changed_files_upload_again(mock_create, tmp_path):
+    manager = mock_create.return_value
+    part = tmp_path / "part_000.parquet"
+
+    watcher = make_watcher(tmp_path)
+    watcher.start()
+    part.write_bytes(b"x")
+    deadline = time.monotonic() + 5
+    while not manager.upload.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # rewritten after it was uploaded
+    part.write_bytes(b"xx")
+    watcher.finish()
+
+    assert uploaded_keys(manager) == ["run/parsed_data/part_000.parquet"] * 2
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_no_final_files_on_error(mock_create, tmp_path):
+    manager = mock_create.return_value
+
+    with pytest.raises(RuntimeError):
+        with make_watcher(tmp_path):
+            (tmp_path / "_metadata.yaml").write_text("type: data")
+            raise RuntimeError("tip failed")
+
+    assert "run/parsed_data/_metadata.yaml" not in uploaded_keys(manager)
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_changed_file_waits_for_earlier_upload(mock_create, tmp_path):
+    manager = mock_create.return_value
+    events = []
+
+    def upload(*args, **kwargs):
+        n = len(events)
+        events.append("upload")
+        future = MagicMock()
+        future.result.side_effect = lambda: events.append(f"done {n}")
+        return future
+
+    manager.upload.side_effect = upload
+    part = tmp_path / "part_000.parquet"
+
+    watcher = make_watcher(tmp_path)
+    watcher.start()
+    part.write_bytes(b"x")
+    deadline = time.monotonic() + 5
+    while not events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    part.write_bytes(b"xx")
+    watcher.finish()
+
+    # the first upload finished before the second one started
+    assert events == ["upload", "done 0", "upload", "done 2"]
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_files_gone_before_finish_are_deleted(mock_create, tmp_path):
+    manager = mock_create.return_value
+    tmp = tmp_path / "part_000.parquet.tmp"
+
+    watcher = make_watcher(tmp_path)
+    watcher.engine.client.delete_objects.return_value = {}
+    watcher.start()
+    tmp.write_bytes(b"x")
+    deadline = time.monotonic() + 5
+    while not manager.upload.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the writer renames its temp file when it's done with it
+    tmp.rename(tmp_path / "part_000.parquet")
+    uploaded = watcher.finish()
+
+    assert uploaded == [
+        ("parsed_data/part_000.parquet", "s3://bucket/run/parsed_data/part_000.parquet")
+    ]
+    watcher.engine.client.delete_objects.assert_called_once_with(
+        Bucket="bucket",
+        Delete={
+            "Objects": [{"Key": "run/parsed_data/part_000.parquet.tmp"}],
+            "Quiet": True,
+        },
+    )
@@ -0,0 +1,270 @@
+from unittest.mock import MagicMock, patch
+import os
+import json
+import pytest
+from botocore.exceptions import ClientError
+
+from opal.flow.transfer import (
+    UploadEngine,
+    DedupUploadEngine,
+    UploadCheckpoint,
+    checkpoint_path,
+    get_upload_config,
+    hash_file,
+    split_s3_url,
+)
+
+
+@pytest.fixture
+def files(tmp_path):
+    out = []
+    for name, size in [("small", 10), ("big", 1000), ("medium", 100)]:
+        p = tmp_path / name
+        p.write_bytes(b"x" * size)
+        out.append((f"key/{name}", str(p)))
+    return out
+
+
+def test_split_s3_url():
+    assert split_s3_url("s3://bucket/a/b/") == ("bucket", "a/b")
+    assert split_s3_url("bucket/a") == ("bucket", "a")
+    assert split_s3_url("bucket") == ("bucket", "")
+
+
+def test_upload_config_env(monkeypatch):
+    monkeypatch.setenv("OPAL_UPLOAD_PART_SIZE", str(8 * 1024 * 1024))
+    monkeypatch.setenv("OPAL_UPLOAD_CONCURRENCY", "3")
+    assert get_upload_config() == (8 * 1024 * 1024, 3)
+
+    # explicit arguments win over the environment
+    assert get_upload_config(16 * 1024 * 1024, 5) == (16 * 1024 * 1024, 5)
+
+
+def test_upload_config_invalid():
+    with pytest.raises(ValueError):
+        get_upload_config(part_size=1024)
+    with pytest.raises(ValueError):
+        get_upload_config(concurrency=0)
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_upload_largest_first(mock_create, files):
+    manager = mock_create.return_value
+
+    engine = UploadEngine("s3://bucket/run/prefix", client=MagicMock(), progress=False)
+    result = engine.upload(files)
+
+    uploaded = [c.args[2] for c in manager.upload.call_args_list]
+    assert uploaded == [
+        "run/prefix/key/big",
+        "run/prefix/key/medium",
+        "run/prefix/key/small",
+    ]
+    assert all(c.args[1] == "bucket" for c in manager.upload.call_args_list)
+
+    # results come back in the order given, like metaflow's put_files
+    assert result == [(k, f"s3://bucket/run/prefix/{k}") for k, _ in files]
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_upload_transfer_config(mock_create, files):
+    engine = UploadEngine(
+        "s3://bucket/run",
+        part_size=8 * 1024 * 1024,
+        concurrency=4,
+        client=MagicMock(),
+        progress=False,
+    )
+    engine.upload(files)
+
+    config = mock_create.call_args.args[1]
+    assert config.multipart_chunksize == 8 * 1024 * 1024
+    assert config.multipart_threshold == 8 * 1024 * 1024
+    assert config.max_request_concurrency == 4
+
+
+def not_found(*args, **kwargs):
+    raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+
+# finished uploads call their subscribers, like the transfer manager
+def finish_upload(*args, subscribers):
+    for subscriber in subscribers:
+        subscriber.on_done(MagicMock())
+    return MagicMock()
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_dedup_copies_stored_contents(mock_create, tmp_path):
+    manager = mock_create.return_value
+    manager.upload.side_effect = finish_upload
+    (tmp_path / "a").write_bytes(b"same")
+    (tmp_path / "b").write_bytes(b"same")
+    (tmp_path / "c").write_bytes(b"stored")
+    (tmp_path / "d").write_bytes(b"stale")
+    files = [(f"key/{n}", str(tmp_path / n)) for n in "abcd"]
+
+    client = MagicMock()
+    engine = DedupUploadEngine(
+        "s3://bucket/run", "m.json", cas_prefix="cas", client=client, progress=False
+    )
+    digests = {n: hash_file(str(tmp_path / n)) for n in "abcd"}
+    index = {
+        engine.index_key(digests["c"]): {"bucket": "b", "key": "old/c", "etag": "c"},
+        # the indexed object was overwritten since
+        engine.index_key(digests["d"]): {"bucket": "b", "key": "old/d", "etag": "d"},
+    }
+
+    def get_object(Bucket, Key):
+        if Key not in index:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": MagicMock(read=lambda: json.dumps(index[Key]))}
+
+    client.get_object.side_effect = get_object
+    client.head_object.side_effect = (
+        lambda Bucket, Key: {
+            "old/c": {"ETag": "c"},
+            "old/d": {"ETag": "changed"},
+            "run/key/a": {"ETag": "a"},
+            "run/key/d": {"ETag": "d2"},
+        }.get(Key)
+        or not_found()
+    )
+
+    engine.upload(files)
+
+    # new contents go straight to their key, once, and nothing under cas/
+    uploads = sorted(c.args[2] for c in manager.upload.call_args_list)
+    assert uploads == ["run/key/a", "run/key/d"]
+
+    # stored and duplicate contents are copied server side
+    copies = sorted((c.args[0]["Key"], c.args[2]) for c in manager.copy.call_args_list)
+    assert copies == [("old/c", "run/key/c"), ("run/key/a", "run/key/b")]
+
+    # uploads are indexed, and the manifest has every key's hash
+    puts = {
+        c.kwargs["Key"]: json.loads(c.kwargs["Body"])
+        for c in client.put_object.call_args_list
+    }
+    assert puts[engine.index_key(digests["a"])] == {
+        "bucket": "bucket",
+        "key": "run/key/a",
+        "etag": "a",
+    }
+    assert puts[engine.index_key(digests["d"])]["key"] == "run/key/d"
+    assert puts["run/m.json"]["files"]["key/c"] == {"sha256": digests["c"], "size": 6}
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_dedup_index_failures_are_raised(mock_create, files):
+    mock_create.return_value.upload.side_effect = finish_upload
+    client = MagicMock()
+    client.get_object.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+    )
+    client.put_object.side_effect = ClientError(
+        {"Error": {"Code": "AccessDenied"}}, "PutObject"
+    )
+    engine = DedupUploadEngine(
+        "s3://bucket/run", "m.json", cas_prefix="cas", client=client, progress=False
+    )
+
+    # uploaded but not indexed, which the transfer manager would swallow
+    with pytest.raises(Exception, match="3 uploaded files couldn't be recorded"):
+        engine.upload(files)
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    path = str(tmp_path / "ckpt")
+    ckpt = UploadCheckpoint(path)
+    ckpt.record("a", 1, 2, '"etag"', "bucket", "run")
+    ckpt.record("b", 1, 2, '"etag"', "bucket", "run")
+
+    # a cut off last line (died mid-write) is ignored
+    with open(path, "a") as f:
+        f.write('{"key": "c", "si')
+
+    loaded = UploadCheckpoint(path)
+    assert set(loaded.entries) == {"a", "b"}
+    assert loaded.completed("a", 1, 2)["etag"] == '"etag"'
+    # changed size or mtime -> not completed
+    assert loaded.completed("a", 1, 3) is None
+    assert loaded.completed("a", 5, 2) is None
+
+    loaded.remove()
+    assert not (tmp_path / "ckpt").exists()
+
+
+def test_checkpoint_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPAL_UPLOAD_CHECKPOINT_DIR", str(tmp_path / "ckpts"))
+    data = tmp_path / "data"
+
+    path = checkpoint_path("Flow/1", str(data))
+    assert os.path.dirname(path) == str(tmp_path / "ckpts")
+    # one per run and path
+    assert path == checkpoint_path("Flow/1", str(data))
+    assert path != checkpoint_path("Flow/2", str(data))
+    assert path != checkpoint_path("Flow/1", str(tmp_path / "other"))
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_checkpoint_resume(mock_create, files, tmp_path):
+    manager = mock_create.return_value
+    path = str(tmp_path / "ckpt")
+
+    stats = {k: os.stat(p) for k, p in files}
+    ckpt = UploadCheckpoint(path)
+    # "big" was finished at this root, "medium" under an earlier run's root
+    st = stats["key/big"]
+    ckpt.record("key/big", st.st_size, st.st_mtime_ns, "e1", "bucket", "run2")
+    st = stats["key/medium"]
+    ckpt.record("key/medium", st.st_size, st.st_mtime_ns, "e2", "bucket", "run1")
+
+    client = MagicMock()
+    etags = {"run2/key/big": "e1", "run1/key/medium": "e2"}
+    client.head_object.side_effect = lambda Bucket, Key: (
+        {"ETag": etags[Key]} if Key in etags else not_found()
+    )
+    client.get_paginator.return_value.paginate.return_value = [
+        {"Uploads": [{"Key": "run1/key/small", "UploadId": "u1"}]}
+    ]
+
+    engine = UploadEngine(
+        "s3://bucket/run2", client=client, progress=False, checkpoint=path
+    )
+    engine.upload(files, batch_size=1)
+
+    # only "small" is sent, "medium" is copied from the earlier run
+    assert [c.args[2] for c in manager.upload.call_args_list] == ["run2/key/small"]
+    copy = manager.copy.call_args
+    assert copy.args[0] == {"Bucket": "bucket", "Key": "run1/key/medium"}
+    assert copy.args[2] == "run2/key/medium"
+
+    # a leftover multipart upload for one of our keys is aborted
+    client.abort_multipart_upload.assert_called_with(
+        Bucket="bucket", Key="run1/key/small", UploadId="u1"
+    )
+    # found with one listing per root, not one per batch
+    assert client.get_paginator.return_value.paginate.call_count == 2
+
+    # the checkpoint is cleaned up once everything is uploaded
+    assert not os.path.exists(path)
+
+
+@patch("opal.flow.transfer.create_transfer_manager")
+def test_checkpoint_failures_are_raised(mock_create, files, tmp_path):
+    mock_create.return_value.upload.side_effect = finish_upload
+    client = MagicMock()
+    client.head_object.return_value = {"ETag": "e"}
+    client.get_paginator.return_value.paginate.return_value = []
+    engine = UploadEngine(
+        "s3://bucket/run",
+        client=client,
+        progress=False,
+        checkpoint=str(tmp_path / "ckpt"),
+    )
+
+    with patch.object(UploadCheckpoint, "record", side_effect=OSError("disk full")):
+        with pytest.raises(Exception, match="couldn't be recorded") as e:
+            engine.upload(files)
+    assert isinstance(e.value.__cause__, OSError)
@@ -0,0 +1,105 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from opal.publish import publish, publish_many, delete
+from opal.publish.delta import DigestStore, verify, NOT_MODIFIED
+
+
+@pytest.fixture(autouse=True)
+def digests_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "digests.sqlite")
+    monkeypatch.setenv("OPAL_PUBLISH_DIGESTS", path)
+    return path
+
+
+def _publish(metadata, **kwargs):
+    return publish(
+        kind_id="testid",
+        kind_type="testtype",
+        kind_metadata=metadata,
+        api_url="http://test-be",
+        token="t",
+        **kwargs,
+    )
+
+
+@patch("requests.post")
+def test_unchanged_payload_is_skipped(mock_post):
+    mock_post.return_value = MagicMock(status_code=201)
+
+    assert _publish({"foo": "bar"}, delta=True) == (True, 201)
+    assert _publish({"foo": "bar"}, delta=True) == (True, NOT_MODIFIED)
+    assert mock_post.call_count == 1
+
+    assert _publish({"foo": "baz"}, delta=True) == (True, 201)
+    assert _publish({"foo": "baz"}, delta=True, force=True) == (True, 201)
+    assert mock_post.call_count == 3
+
+
+@patch("requests.post")
+def test_failed_publish_is_not_remembered(mock_post):
+    mock_post.return_value = MagicMock(status_code=500)
+    assert _publish({"foo": "bar"}, delta=True) == (False, 500)
+
+    mock_post.return_value = MagicMock(status_code=201)
+    assert _publish({"foo": "bar"}, delta=True) == (True, 201)
+    assert mock_post.call_count == 2
+
+
+@patch("requests.post")
+def test_without_delta_nothing_is_recorded(mock_post, digests_path):
+    mock_post.return_value = MagicMock(status_code=201)
+    _publish({"foo": "bar"})
+    _publish({"foo": "bar"})
+
+    assert mock_post.call_count == 2
+    assert DigestStore(digests_path).entries() == {}
+
+
+@patch("requests.delete")
+@patch("requests.post")
+def test_delete_forgets_digest(mock_post, mock_delete):
+    mock_post.return_value = MagicMock(status_code=201)
+    mock_delete.return_value = MagicMock(status_code=204)
+
+    _publish({"foo": "bar"}, delta=True)
+    delete("testid", api_url="http://test-be", token="t")
+
+    assert _publish({"foo": "bar"}, delta=True) == (True, 201)
+
+
+@patch("requests.Session.post")
+def test_publish_many_delta(mock_post):
+    mock_post.return_value = MagicMock(status_code=201, headers={})
+    instances = [
+        dict(kind_id=f"id{i}", kind_type="testtype", kind_metadata={"i": i})
+        for i in range(3)
+    ]
+    publish_many(instances, api_url="http://test-be", token="t", delta=True)
+
+    instances[1]["kind_metadata"] = {"i": "changed"}
+    results = publish_many(instances, api_url="http://test-be", token="t", delta=True)
+
+    assert results == [(True, NOT_MODIFIED), (True, 201), (True, NOT_MODIFIED)]
+    assert mock_post.call_count == 4
+
+
+@patch("requests.get")
+def test_verify_forgets_entries_missing_from_catalog(mock_get, digests_path):
+    store = DigestStore(digests_path)
+    store.put("1", "FlowA", "d1")
+    store.put("2", "FlowA", "d2")
+    store.put("3", "FlowB", "d3")
+    mock_get.return_value.json.return_value = {
+        "data": [
+            {"kind_id": "1", "kind_type": "FlowA"},
+            {"kind_id": "3", "kind_type": "FlowC"},
+        ]
+    }
+
+    stale = verify(store, api_url="http://test-be", token="t")
+
+    assert sorted(stale) == ["2", "3"]
+    assert store.entries() == {"1": "FlowA"}
+    assert mock_get.call_args.args == ("http://test-be/instance",)
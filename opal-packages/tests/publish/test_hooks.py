@@ -0,0 +1,25 @@
+from opal.publish.hooks import on_catalog_change, remove_hook, catalog_changed
+
+
+def test_hooks_run_even_if_one_fails(capsys):
+    calls = []
+
+    @on_catalog_change
+    def failing():
+        raise RuntimeError("broken")
+
+    @on_catalog_change
+    def recording():
+        calls.append(1)
+
+    try:
+        catalog_changed()
+    finally:
+        remove_hook(failing)
+        remove_hook(recording)
+
+    assert calls == [1]
+    assert "broken" in capsys.readouterr().err
+
+    catalog_changed()
+    assert calls == [1]
@@ -1,5 +1,7 @@
 from unittest.mock import MagicMock, patch
-from opal.publish import publish, publish_serializer
+from opal.publish import publish, publish_many, publish_serializer
+from opal.publish.publish import make_session, REQUEST_TIMEOUT
+import requests
 import json
 
 import numpy as np
@@ -81,3 +83,81 @@ def test_publish_serializer_pandas():
     # assert publish_serializer(df) == expected
     # really this is all we need to test
     json.dumps(publish_serializer(df))
+
+
+def _response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+def _instances(n):
+    return (
+        dict(kind_id=f"id{i}", kind_type="testtype", kind_metadata={"i": i})
+        for i in range(n)
+    )
+
+
+@patch("requests.Session.post")
+def test_publish_many_returns_status_per_item(mock_post):
+    def post(url, data, headers, timeout):
+        kind_id = json.loads(data)["kind_id"]
+        return _response(400 if kind_id == "id3" else 201)
+
+    mock_post.side_effect = post
+
+    results = publish_many(
+        _instances(10), api_url="http://test-be", token="t", chunk_size=4
+    )
+
+    assert results == [(i != 3, 400 if i == 3 else 201) for i in range(10)]
+    assert mock_post.call_count == 10
+    assert all(c.args[0] == "http://test-be/instance" for c in mock_post.call_args_list)
+
+
+@patch("time.sleep")
+@patch("requests.Session.post")
+def test_publish_many_retries_server_errors(mock_post, mock_sleep):
+    mock_post.side_effect = [
+        _response(503),
+        _response(429, {"Retry-After": "2"}),
+        _response(201),
+    ]
+
+    results = publish_many(_instances(1), api_url="http://test-be", token="t")
+
+    assert results == [(True, 201)]
+    assert mock_post.call_count == 3
+    # jittered backoff, then the server's Retry-After
+    assert 0 <= mock_sleep.call_args_list[0].args[0] <= 0.5
+    assert mock_sleep.call_args_list[1].args[0] == 2.0
+
+
+@patch("time.sleep")
+@patch("requests.Session.post")
+def test_publish_many_gives_up(mock_post, mock_sleep):
+    mock_post.side_effect = requests.exceptions.ConnectionError()
+
+    results = publish_many(
+        _instances(1), api_url="http://test-be", token="t", max_retries=2
+    )
+
+    assert results == [(False, None)]
+    assert mock_post.call_count == 3
+
+
+@patch("time.sleep")
+@patch("requests.Session.post")
+def test_publish_many_retries_timeouts(mock_post, mock_sleep):
+    mock_post.side_effect = [requests.exceptions.ReadTimeout(), _response(201)]
+
+    results = publish_many(_instances(1), api_url="http://test-be", token="t")
+
+    assert results == [(True, 201)]
+    assert mock_post.call_args.kwargs["timeout"] == REQUEST_TIMEOUT
+
+
+def test_make_session_headers():
+    session = make_session("atesttoken", pool_size=4)
+
+    assert session.headers["content-type"] == "application/json"
+    assert session.headers["Authorization"] == "token atesttoken"
+    assert session.get_adapter("http://test-be")._pool_maxsize == 4
@@ -0,0 +1,134 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from opal.query import Results
+from opal.publish.reconcile import reconcile, RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def digests_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPAL_PUBLISH_DIGESTS", str(tmp_path / "digests.sqlite"))
+
+
+def instance(kind_id, **metadata):
+    return dict(kind_id=kind_id, kind_type="test", kind_metadata=metadata)
+
+
+# the catalog has 1 and 2 as wanted, 3 out of date and 4 not wanted
+CATALOG = [
+    instance("1", a=1),
+    instance("2", b=[1, 2], c="x"),
+    instance("3", a=1),
+    instance("4", a=1),
+]
+WANTED = [
+    instance("1", a=1),
+    instance("2", c="x", b=[1, 2]),
+    instance("3", a=2),
+    instance("5", a=1),
+]
+
+
+# a listing of records, as Instance.iter_search returns
+def listing(records, complete=True):
+    res = Results.lazy(iter(records))
+    res.complete = complete
+    return res
+
+
+@pytest.fixture
+def catalog():
+    with patch(
+        "opal.query.search.Instance.iter_search",
+        side_effect=lambda *a: listing(CATALOG),
+    ) as mock_iter_search:
+        yield mock_iter_search
+
+
+def _response(status):
+    return MagicMock(status_code=status, headers={})
+
+
+@patch("requests.Session.delete")
+@patch("requests.Session.post")
+def test_reconcile_applies_only_changes(mock_post, mock_delete, catalog):
+    mock_post.return_value = _response(201)
+    mock_delete.return_value = _response(204)
+
+    report = reconcile(WANTED, api_url="http://test-be", token="t")
+
+    assert report.inserted == ["5"]
+    assert report.updated == ["3"]
+    assert report.deleted == ["4"]
+    assert report.unchanged == 2
+    assert report.failed == {}
+    posted = sorted(
+        json.loads(c.kwargs["data"])["kind_id"] for c in mock_post.call_args_list
+    )
+    assert posted == ["3", "5"]
+    assert [json.loads(c.kwargs["data"]) for c in mock_delete.call_args_list] == [
+        {"kind_id": "4"}
+    ]
+
+
+@patch("requests.Session.delete")
+@patch("requests.Session.post")
+def test_dry_run_sends_nothing(mock_post, mock_delete, catalog):
+    report = reconcile(WANTED, api_url="http://test-be", token="t", dry_run=True)
+
+    assert (report.inserted, report.updated, report.deleted) == (["5"], ["3"], ["4"])
+    assert "1 would be inserted, 1 updated, 1 deleted, 2 unchanged" in report.summary()
+    mock_post.assert_not_called()
+    mock_delete.assert_not_called()
+
+
+@patch("requests.Session.delete")
+@patch("requests.Session.post")
+def test_failures_are_reported(mock_post, mock_delete, catalog):
+    mock_post.return_value = _response(400)
+
+    report = reconcile(WANTED, api_url="http://test-be", token="t", delete=False)
+
+    assert report.failed == {"3": 400, "5": 400}
+    assert "1 stale (kept)" in report.summary()
+    mock_delete.assert_not_called()
+
+
+@patch("requests.Session.delete")
+@patch("requests.Session.post")
+def test_no_deletes_without_a_complete_listing(mock_post, mock_delete, catalog):
+    mock_post.return_value = _response(201)
+    catalog.side_effect = lambda *a: listing(CATALOG, complete=False)
+
+    report = reconcile(WANTED, api_url="http://test-be", token="t")
+
+    assert report.deleted == ["4"]
+    assert not report.listing_complete
+    assert "1 stale (kept, the catalog listing was incomplete)" in report.summary()
+    mock_delete.assert_not_called()
+
+
+@patch("opal.query.search.Instance.__init__", return_value=None)
+@patch("requests.Session.delete")
+@patch("requests.Session.post")
+def test_catalog_is_listed_with_the_query_token(
+    mock_post, mock_delete, mock_init, catalog
+):
+    mock_post.return_value = _response(201)
+    mock_delete.return_value = _response(204)
+
+    reconcile(WANTED, api_url="http://test-be", token="t", query_token="q")
+
+    mock_init.assert_called_once_with("http://test-be", "q")
+
+
+@patch("time.sleep")
+@patch("time.monotonic", return_value=100.0)
+def test_rate_limiter(mock_monotonic, mock_sleep):
+    limiter = RateLimiter(rate=4)
+    for _ in range(3):
+        limiter.wait()
+
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [0.25, 0.5]
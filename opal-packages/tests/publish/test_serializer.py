@@ -0,0 +1,86 @@
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from opal.publish import publish_serializer
+from opal.publish.serializer import encode_payload, encode_body
+
+
+def slow_encode(payload):
+    return json.dumps(payload, default=publish_serializer)
+
+
+def test_plain_payload_is_unchanged():
+    payload = {"kind_id": "1", "kind_metadata": {"a": [1, 2.5, None], "b": "x"}}
+    assert encode_payload(payload) == slow_encode(payload)
+
+
+def test_tables_decode_like_publish_serializer():
+    payload = {
+        "df": pd.DataFrame({"num": [1, 2, 3], "alph": ["x", "y", None]}),
+        "arr": np.array([[1, 2, 3], [4, 5, 6]]),
+        "floats": np.array([0.1, 0.25, np.nan]),
+        "objects": np.array(["a", "b"], dtype=object),
+        "nested": {"df": pd.DataFrame({"x": [1.5]}), "set": frozenset([1])},
+    }
+
+    fast = json.loads(encode_payload(payload))
+    slow = json.loads(slow_encode(payload).replace("NaN", "null"))
+
+    assert fast == slow
+
+
+def test_array_float_precision():
+    out = json.loads(encode_payload({"x": np.array([1 / 3, 2e-20, 123456.789])}))
+    assert out["x"] == pytest.approx([1 / 3, 2e-20, 123456.789], rel=1e-14)
+
+
+def test_array_floats_differ_from_publish_serializer():
+    payload = {"x": np.array([0.1 + 0.2, 1 / 3, np.nan, np.inf, -np.inf])}
+
+    assert slow_encode(payload) == (
+        '{"x": [0.30000000000000004, 0.3333333333333333, NaN, Infinity, -Infinity]}'
+    )
+    # rounded to 15 decimal places, and anything that isn't a number is null
+    assert encode_payload(payload) == ('{"x": [0.3,0.333333333333333,null,null,null]}')
+
+
+def test_oversized_tables_are_stubbed():
+    df = pd.DataFrame({"x": np.arange(1000), "name": ["n"] * 1000})
+    payload = {"big": df, "small": np.array([1, 2])}
+
+    out = json.loads(encode_payload(payload, max_artifact_bytes=200))
+
+    assert out["small"] == [1, 2]
+    stub = out["big"]
+    assert stub["opal_stub"] is True
+    assert stub["type"] == "DataFrame"
+    assert stub["shape"] == [1000, 2]
+    assert stub["columns"] == {"x": "int64", "name": str(df.dtypes["name"])}
+    assert stub["summary"] == {"x": {"min": 0, "max": 999, "mean": 499.5}}
+    assert stub["encoded_bytes"] > 200
+
+
+def test_max_artifact_bytes_from_env(monkeypatch):
+    monkeypatch.setenv("OPAL_PUBLISH_MAX_ARTIFACT_BYTES", "10")
+
+    out = json.loads(encode_payload({"arr": np.zeros((10, 10))}))
+
+    assert out["arr"]["opal_stub"] is True
+    assert out["arr"]["dtype"] == "float64"
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_encode_body(compress):
+    body, headers = encode_body({"arr": np.arange(3)}, compress=compress)
+
+    if compress:
+        assert headers["content-encoding"] == "gzip"
+        body = gzip.decompress(body).decode("utf-8")
+    else:
+        assert "content-encoding" not in headers
+    assert headers["content-type"] == "application/json"
+    assert json.loads(body) == {"arr": [0, 1, 2]}
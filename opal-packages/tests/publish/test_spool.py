@@ -0,0 +1,159 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from opal.publish.spool import PublishSpool, SpoolWorker, main
+
+
+def _response(status_code):
+    return MagicMock(status_code=status_code, headers={})
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return PublishSpool(str(tmp_path / "spool.sqlite"))
+
+
+@patch("requests.Session.post")
+def test_flush_publishes_and_empties(mock_post, spool):
+    mock_post.return_value = _response(201)
+    spool.enqueue("1", "TestFlow", {"foo": "bar"})
+    spool.enqueue("2", "TestFlow", {"foo": "baz"})
+
+    result = spool.flush(api_url="http://test-be", token="t")
+
+    assert result == {"published": 2, "pending": 0, "failed": 0}
+    bodies = [json.loads(c.kwargs["data"]) for c in mock_post.call_args_list]
+    assert sorted(b["kind_id"] for b in bodies) == ["1", "2"]
+    assert mock_post.call_args.args == ("http://test-be/instance",)
+
+
+@patch("requests.Session.post")
+def test_duplicate_kind_ids_are_coalesced(mock_post, spool):
+    mock_post.return_value = _response(201)
+    spool.enqueue("1", "TestFlow", {"version": 1})
+    spool.enqueue("1", "TestFlow", {"version": 2})
+
+    spool.flush(api_url="http://test-be", token="t")
+
+    assert mock_post.call_count == 1
+    body = json.loads(mock_post.call_args.kwargs["data"])
+    assert body["kind_metadata"] == {"version": 2}
+
+
+@patch("requests.Session.post")
+def test_server_errors_are_retried_later(mock_post, spool):
+    mock_post.return_value = _response(503)
+    spool.enqueue("1", "TestFlow", {})
+
+    result = spool.flush(api_url="http://test-be", token="t", backoff=0)
+    assert result == {"published": 0, "pending": 1, "failed": 0}
+
+    mock_post.return_value = _response(201)
+    result = spool.flush(api_url="http://test-be", token="t")
+    assert result == {"published": 1, "pending": 0, "failed": 0}
+
+
+@patch("requests.Session.post")
+def test_rejected_entries_fail_until_retried(mock_post, spool):
+    mock_post.return_value = _response(400)
+    spool.enqueue("1", "TestFlow", {})
+
+    result = spool.flush(api_url="http://test-be", token="t")
+    assert result == {"published": 0, "pending": 0, "failed": 1}
+    assert spool.failed() == [("1", "TestFlow", 1, 400)]
+
+    # failed entries are left alone by a normal flush
+    mock_post.return_value = _response(201)
+    assert spool.flush(api_url="http://test-be", token="t")["published"] == 0
+    assert spool.flush(api_url="http://test-be", token="t", retry_failed=True) == {
+        "published": 1,
+        "pending": 0,
+        "failed": 0,
+    }
+
+
+@patch("requests.Session.post")
+def test_entries_being_posted_are_not_claimed_twice(mock_post, spool):
+    spool.enqueue("1", "TestFlow", {})
+
+    def post(*args, **kwargs):
+        # another flush while this one is posting
+        assert spool.flush(api_url="http://test-be", token="t")["published"] == 0
+        return _response(201)
+
+    mock_post.side_effect = post
+
+    assert spool.flush(api_url="http://test-be", token="t")["published"] == 1
+    assert mock_post.call_count == 1
+
+
+@patch("requests.Session.post")
+def test_worker_drains_spool(mock_post, spool):
+    mock_post.return_value = _response(201)
+    spool.enqueue("1", "TestFlow", {})
+
+    worker = SpoolWorker(spool, interval=0.01, api_url="http://test-be", token="t")
+    worker.start()
+    worker.stop(timeout=5)
+
+    assert mock_post.call_count == 1
+    assert spool.status() == {"pending": 0, "failed": 0}
+
+
+@patch("requests.Session.post")
+def test_stopped_worker_releases_its_claims(mock_post, spool):
+    spool.enqueue("1", "TestFlow", {})
+    spool.enqueue("2", "TestFlow", {})
+    posting, unblock = threading.Event(), threading.Event()
+
+    def slow_post(*args, **kwargs):
+        posting.set()
+        unblock.wait(5)
+        return _response(201)
+
+    mock_post.side_effect = slow_post
+    worker = SpoolWorker(
+        spool, interval=60, api_url="http://test-be", token="t", concurrency=1
+    )
+    worker.start()
+    assert posting.wait(5)
+    worker.stop(timeout=0.1)
+
+    # both entries are due again, not claimed for CLAIM_SECONDS
+    other = PublishSpool(spool.path)
+    mock_post.side_effect = None
+    mock_post.return_value = _response(201)
+    assert other.flush(api_url="http://test-be", token="t")["published"] == 2
+
+    unblock.set()
+    worker.join(5)
+    # the stopped worker didn't go on to post "2"
+    assert mock_post.call_count == 3
+    assert spool.status() == {"pending": 0, "failed": 0}
+
+
+@patch("requests.Session.post")
+def test_cli_flush(mock_post, spool, capsys):
+    mock_post.return_value = _response(201)
+    spool.enqueue("1", "TestFlow", {})
+
+    code = main(["--path", spool.path, "flush", "--api-url", "http://test-be"])
+
+    assert code == 0
+    assert capsys.readouterr().out.strip() == "published=1 pending=0 failed=0"
+
+
+@patch("requests.Session.post")
+def test_delta_enqueue(mock_post, spool, tmp_path, monkeypatch):
+    monkeypatch.setenv("OPAL_PUBLISH_DIGESTS", str(tmp_path / "digests.sqlite"))
+    mock_post.return_value = _response(201)
+
+    assert spool.enqueue("1", "TestFlow", {"foo": "bar"}, delta=True)
+    spool.flush(api_url="http://test-be", token="t")
+
+    # published, so the same payload isn't spooled again
+    assert not spool.enqueue("1", "TestFlow", {"foo": "bar"}, delta=True)
+    assert spool.enqueue("1", "TestFlow", {"foo": "bar"}, delta=True, force=True)
@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from opal.query import AsyncClient, AsyncInstance, Instance
+import opal.publish.aio
+
+
+# a fake catalog backend that records requests and how many overlap
+class Catalog:
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def instance(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            body = await request.read()
+            self.requests.append(
+                (request.method, request.path_qs, request.headers.copy(), body)
+            )
+            if request.method == "POST":
+                return web.Response(status=201)
+            if request.method == "DELETE":
+                return web.Response(status=204)
+            kind_id = request.query.get("kind_id")
+            data = [dict(kind_id=kind_id, kind_type="test")] if kind_id else []
+            return web.json_response(dict(data=data))
+        finally:
+            self.in_flight -= 1
+
+
+def run(test):
+    async def main():
+        catalog = Catalog()
+        app = web.Application()
+        app.router.add_route("*", "/instance", catalog.instance)
+        async with TestServer(app) as server:
+            url = str(server.make_url("")).rstrip("/")
+            async with AsyncClient(url, "atesttoken", concurrency=4) as client:
+                await test(client, catalog, url)
+
+    asyncio.run(main())
+
+
+def test_search_matches_instance_url():
+    async def test(client, catalog, url):
+        inst = AsyncInstance(client)
+        query = inst._with("foo", "bar")._and("boo", "far")._type("giant_yogurt")
+
+        await query.search()
+
+        sync = Instance(api_url=url, token="atesttoken")
+        sync._with("foo", "bar")._and("boo", "far")._type("giant_yogurt")
+        method, path_qs, headers, _ = catalog.requests[0]
+        assert url + path_qs == sync._query_url()
+        assert headers["Authorization"] == "token atesttoken"
+
+    run(test)
+
+
+def test_builders_are_immutable():
+    async def test(client, catalog, url):
+        base = AsyncInstance(client)._with("foo", "bar")
+        narrowed = base._not("hump", "day")
+
+        assert base.query == (dict(key="foo", value="bar"),)
+        assert len(narrowed.query) == 2
+        assert base._type("x").type == "x" and base.type is None
+        assert base._with("a", "b").query == (dict(key="a", value="b"),)
+
+    run(test)
+
+
+def test_gather_ids_is_concurrent_and_limited():
+    async def test(client, catalog, url):
+        ids = [str(i) for i in range(20)]
+
+        results = await AsyncInstance(client).gather_ids(ids)
+
+        assert list(results) == ids
+        assert results["7"].ids() == ["7"]
+        assert 1 < catalog.max_in_flight <= 4
+
+    run(test)
+
+
+def test_async_publish_and_delete():
+    async def test(client, catalog, url):
+        ok = await opal.publish.aio.publish(
+            client, "1", "test", {"foo": "bar"}, token="publishtoken"
+        )
+        deleted = await opal.publish.aio.delete(client, "1", token="publishtoken")
+
+        assert ok == (True, 201)
+        assert deleted == (True, 204)
+        (post, _, headers, body), (delete, _, _, delete_body) = catalog.requests
+        assert (post, delete) == ("POST", "DELETE")
+        assert headers["content-type"] == "application/json"
+        assert headers["Authorization"] == "token publishtoken"
+        assert json.loads(body) == dict(
+            kind_metadata={"foo": "bar"}, kind_type="test", kind_id="1"
+        )
+        assert json.loads(delete_body) == {"kind_id": "1"}
+
+    run(test)
+
+
+def test_async_delta_publish(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPAL_PUBLISH_DIGESTS", str(tmp_path / "digests.sqlite"))
+
+    async def test(client, catalog, url):
+        publish = opal.publish.aio.publish
+        assert await publish(client, "1", "test", {"a": 1}, delta=True) == (True, 201)
+        # unchanged, so not sent again unless forced
+        assert await publish(client, "1", "test", {"a": 1}, delta=True) == (True, 304)
+        assert await publish(client, "1", "test", {"a": 1}, delta=True, force=True) == (
+            True,
+            201,
+        )
+        assert await publish(client, "1", "test", {"a": 2}, delta=True) == (True, 201)
+        assert len(catalog.requests) == 3
+
+    run(test)
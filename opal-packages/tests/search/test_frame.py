@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+import pytest
+
+import opal.query.frame
+from opal.query import Results, field
+
+RECORDS = [
+    dict(
+        kind_id=str(i),
+        kind_type="TipParseFlow" if i % 2 else "TipTranslateFlow",
+        kind_metadata=dict(
+            successful=i != 3,
+            ch10_metadata=dict(uid=f"uid{i}", size=1000 * i),
+            big_table=list(range(100)),
+        ),
+    )
+    for i in range(6)
+]
+# a record without ch10 metadata
+RECORDS.append(dict(kind_id="6", kind_type="TipParseFlow", kind_metadata={}))
+
+
+def results():
+    return Results(dict(data=RECORDS))
+
+
+def test_to_frame_projects_fields():
+    df = results().to_frame(
+        ["kind_id", "kind_metadata.ch10_metadata.size", "kind_metadata.successful"]
+    )
+
+    assert list(df.columns) == [
+        "kind_id",
+        "kind_metadata.ch10_metadata.size",
+        "kind_metadata.successful",
+    ]
+    assert str(df["kind_metadata.ch10_metadata.size"].dtype) == "Int64"
+    assert str(df["kind_metadata.successful"].dtype) == "boolean"
+    assert df["kind_metadata.ch10_metadata.size"].isna().tolist() == [False] * 6 + [
+        True
+    ]
+
+
+def test_to_frame_without_fields_flattens_everything():
+    df = results().to_frame()
+
+    assert "kind_metadata.ch10_metadata.uid" in df.columns
+    assert len(df) == 7
+
+
+def test_where():
+    df = results().where(
+        (field("kind_type") == "TipParseFlow")
+        & (field("kind_metadata.ch10_metadata.size") >= 1000)
+        & ~(field("kind_metadata.successful") == False)
+    )
+
+    assert df["kind_id"].tolist() == ["1", "5"]
+    assert list(df.columns) == [
+        "kind_id",
+        "kind_type",
+        "kind_metadata.ch10_metadata.size",
+        "kind_metadata.successful",
+    ]
+
+
+def test_where_with_fields_and_methods():
+    uid = field("kind_metadata.ch10_metadata.uid")
+
+    df = results().where(uid.isin(["uid2", "uid4"]) | uid.isnull(), fields=["kind_id"])
+    assert df.to_dict("list") == {"kind_id": ["2", "4", "6"]}
+
+    df = results().where(uid.startswith("uid1"), fields=["kind_id"])
+    assert df["kind_id"].tolist() == ["1"]
+
+
+def test_predicate_fields():
+    predicate = (field("a") > 1) | ~field("b.c").contains("x")
+    assert predicate.fields() == {"a", "b.c"}
+
+
+def test_unused_fields_are_not_extracted():
+    with patch.object(
+        opal.query.frame, "_get_path", wraps=opal.query.frame._get_path
+    ) as get_path:
+        results().where(field("kind_type") == "TipParseFlow", fields=["kind_id"])
+
+    assert {tuple(c.args[1]) for c in get_path.call_args_list} == {
+        ("kind_id",),
+        ("kind_type",),
+    }
+
+
+def test_to_arrow():
+    pytest.importorskip("pyarrow")
+    table = results().to_arrow(["kind_id", "kind_metadata.ch10_metadata.size"])
+
+    assert table.num_rows == 7
+    assert table.column_names == ["kind_id", "kind_metadata.ch10_metadata.size"]
+
+
+def test_to_arrow_without_pyarrow():
+    with patch.dict("sys.modules", {"pyarrow": None}):
+        with pytest.raises(ImportError, match="pip install pyarrow"):
+            results().to_arrow(["kind_id"])
@@ -0,0 +1,105 @@
+from unittest.mock import patch
+
+import pytest
+
+from opal.query import CatalogMirror, Results
+
+
+def record(kind_id, kind_type="TipParseFlow", uid=None, **metadata):
+    metadata.setdefault("created_at", f"2022-01-0{kind_id} 00:00:00")
+    if uid is not None:
+        metadata["ch10_metadata"] = dict(uid=uid)
+    return dict(kind_id=kind_id, kind_type=kind_type, kind_metadata=metadata)
+
+
+CATALOG = [
+    record("1", uid="a", successful=True, flow_id="TipParseFlow"),
+    record("2", uid="b", successful=False),
+    record("3", "TipTranslateFlow", uid="a", successful=True),
+    record("4", uid="c", successful=True, tags=["x"]),
+]
+
+
+# a listing of records, as Instance.iter_search returns
+def listing(records, complete=True):
+    res = Results.lazy(iter(records))
+    res.complete = complete
+    return res
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = CatalogMirror(str(tmp_path / "mirror.sqlite"), "http://test-be", "t")
+    with patch("opal.query.search.Instance.iter_search", return_value=listing(CATALOG)):
+        mirror.resync()
+    return mirror
+
+
+def test_sync_fills_the_mirror(mirror):
+    assert len(mirror) == 4
+    assert mirror.last_synced() is not None
+    assert mirror.instance().one("3").all() == [CATALOG[2]]
+
+
+def test_resync_writes_only_changes(mirror):
+    changed = record("2", uid="b", successful=True)
+    catalog = [CATALOG[0], changed, CATALOG[2], record("5", uid="d")]
+
+    with patch("opal.query.search.Instance.iter_search", return_value=listing(catalog)):
+        counts = mirror.resync()
+
+    assert counts == dict(added=1, updated=1, unchanged=2, removed=1, complete=True)
+    assert sorted(mirror.instance().search().ids()) == ["1", "2", "3", "5"]
+    assert mirror.instance().one("2").all() == [changed]
+
+
+def test_incomplete_resync_removes_nothing(mirror):
+    last_synced = mirror.last_synced()
+    catalog = [CATALOG[0], record("5", uid="d")]
+
+    with patch(
+        "opal.query.search.Instance.iter_search",
+        return_value=listing(catalog, complete=False),
+    ):
+        counts = mirror.resync()
+
+    assert counts == dict(added=1, updated=0, unchanged=1, removed=0, complete=False)
+    assert sorted(mirror.instance().search().ids()) == ["1", "2", "3", "4", "5"]
+    assert mirror.last_synced() == last_synced
+
+
+def test_refresh(mirror):
+    changed = record("1", uid="z")
+
+    def one(self, id):
+        return Results(dict(data=[changed] if id == "1" else []))
+
+    with patch("opal.query.search.Instance.one", one):
+        counts = mirror.refresh(["1", "4"])
+
+    assert counts == dict(added=0, updated=1, unchanged=0, removed=1)
+    assert sorted(mirror.instance().search().ids()) == ["1", "2", "3"]
+
+
+def test_queries(mirror):
+    inst = mirror.instance()
+    uid = "ch10_metadata.uid"
+
+    assert inst._with(uid, "a").search().ids() == ["1", "3"]
+    assert inst._with(uid, "a")._type("TipParseFlow").search().ids() == ["1"]
+    assert inst._with("successful", True)._not(uid, "a").search().ids() == ["4"]
+    assert inst._with("successful", False)._or(uid, "c").search().ids() == ["2", "4"]
+    assert inst._with("successful", True)._and(
+        "flow_id", "TipParseFlow"
+    ).search().ids() == ["1"]
+    assert inst._with("created_at", "2022-01-02 00:00:00").search().ids() == ["2"]
+
+
+def test_indexed_keys_use_indexes(mirror):
+    where, params = mirror.instance()._with("ch10_metadata.uid", "a")._where()
+    with mirror._db() as db:
+        plan = db.execute(
+            f"EXPLAIN QUERY PLAN SELECT record FROM instances WHERE {where}", params
+        ).fetchall()
+
+    assert "instances_uid" in str(plan)
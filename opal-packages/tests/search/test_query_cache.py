@@ -0,0 +1,120 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from opal.query import Instance, QueryCache
+from opal.publish import publish, delete
+
+
+def _response(records, status_code=200, etag=None):
+    body = json.dumps(dict(data=records)).encode("utf-8")
+    return MagicMock(
+        status_code=status_code,
+        content=body,
+        headers={"ETag": etag} if etag else {},
+        json=lambda: json.loads(body),
+    )
+
+
+RECORDS = [dict(kind_id="1", kind_type="test")]
+
+
+@pytest.fixture
+def cache():
+    return QueryCache(ttl=60)
+
+
+@patch("requests.get")
+def test_repeated_search_is_cached(mock_get, cache):
+    mock_get.return_value = _response(RECORDS)
+    inst = Instance(api_url="whatever", token="whatever", cache=cache)
+
+    first = inst._with("foo", "bar").search()
+    first.all()[0]["kind_id"] = "changed"
+    second = inst._with("foo", "bar").search()
+
+    assert mock_get.call_count == 1
+    assert second.all() == RECORDS
+    assert cache.stats() == dict(hits=1, revalidated=0, misses=1, entries=1)
+
+    inst._with("foo", "other").search()
+    assert mock_get.call_count == 2
+
+
+@patch("requests.get")
+def test_expired_entries_are_revalidated(mock_get):
+    cache = QueryCache(ttl=0)
+    mock_get.return_value = _response(RECORDS, etag='"v1"')
+    inst = Instance(api_url="whatever", token="whatever", cache=cache)
+    inst._type("test").search()
+
+    mock_get.return_value = MagicMock(status_code=304)
+    res = inst._type("test").search()
+
+    assert res.all() == RECORDS
+    assert mock_get.call_args.kwargs["headers"] == {
+        "Authorization": "token whatever",
+        "If-None-Match": '"v1"',
+    }
+    assert cache.revalidated == 1
+
+
+@patch("requests.get")
+def test_expired_entries_without_etag_are_refetched(mock_get):
+    cache = QueryCache(ttl=0)
+    mock_get.return_value = _response(RECORDS)
+    inst = Instance(api_url="whatever", token="whatever", cache=cache)
+    inst.search()
+
+    mock_get.return_value = _response([])
+    assert inst.search().all() == []
+    assert "If-None-Match" not in mock_get.call_args.kwargs["headers"]
+
+
+@patch("requests.get")
+def test_lru_size_cap(mock_get):
+    cache = QueryCache(max_entries=2)
+    mock_get.return_value = _response(RECORDS)
+    inst = Instance(api_url="whatever", token="whatever", cache=cache)
+
+    for kind_id in ["1", "2", "1", "3"]:
+        inst.one(kind_id)
+    assert len(cache) == 2
+
+    # "2" was least recently used
+    inst.one("1")
+    inst.one("3")
+    assert mock_get.call_count == 3
+    inst.one("2")
+    assert mock_get.call_count == 4
+
+
+@patch("requests.delete")
+@patch("requests.post")
+@patch("requests.get")
+def test_publish_and_delete_invalidate(mock_get, mock_post, mock_delete, cache):
+    mock_get.return_value = _response(RECORDS)
+    mock_post.return_value = MagicMock(status_code=201)
+    mock_delete.return_value = MagicMock(status_code=204)
+    inst = Instance(api_url="whatever", token="whatever", cache=cache)
+
+    inst.search()
+    publish("2", "test", {}, api_url="whatever", token="whatever")
+    assert len(cache) == 0
+
+    inst.search()
+    delete("2", api_url="whatever", token="whatever")
+    assert len(cache) == 0
+    assert mock_get.call_count == 2
+
+
+@patch("requests.get")
+def test_no_cache_by_default(mock_get):
+    mock_get.return_value = _response(RECORDS)
+    inst = Instance(api_url="whatever", token="whatever")
+
+    inst.search()
+    inst.search()
+
+    assert mock_get.call_count == 2
@@ -1,5 +1,5 @@
 from opal.query import Instance, Results
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 import pytest
 import json
 
@@ -77,3 +77,87 @@ def test_result_methods():
     assert res.ids() == [x.get("kind_id") for x in rd.get("data")]
     assert len(res.filter(lambda x: x["kind_metadata"]["foo"] == "bar")) == 2
     assert res.reduce(lambda x: x["kind_type"]) == ["test", "test", "test"]
+
+
+def _page_response(records):
+    body = json.dumps(dict(data=records)).encode("utf-8")
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.iter_content.side_effect = lambda size: (
+        body[i : i + 10] for i in range(0, len(body), 10)
+    )
+    return response
+
+
+def _records(start, stop):
+    return [dict(kind_id=str(i), kind_type="test") for i in range(start, stop)]
+
+
+@patch("requests.get")
+def test_iter_search_pages(mock_get):
+    mock_get.side_effect = [
+        _page_response(_records(0, 2)),
+        _page_response(_records(2, 4)),
+        _page_response(_records(4, 5)),
+    ]
+    inst = Instance(api_url="whatever", token="whatever")
+
+    res = inst._type("TipParseFlow").iter_search(page_size=2)
+    assert mock_get.call_count == 0
+    assert res.ids() == ["0", "1", "2", "3", "4"]
+    assert res.complete
+
+    urls = [c.args[0] for c in mock_get.call_args_list]
+    assert urls == [
+        f"whatever/instance?kind_type=TipParseFlow&limit=2&offset={o}"
+        for o in (0, 2, 4)
+    ]
+    assert all(c.kwargs["stream"] for c in mock_get.call_args_list)
+
+    with pytest.raises(RuntimeError):
+        res.ids()
+
+
+@patch("requests.get")
+def test_iter_search_stops_on_empty_page(mock_get):
+    mock_get.side_effect = [_page_response(_records(0, 2)), _page_response([])]
+    inst = Instance(api_url="whatever", token="whatever")
+
+    res = inst.iter_search(page_size=2)
+
+    assert res.filter(lambda r: r["kind_id"] == "1") == [_records(1, 2)[0]]
+    assert mock_get.call_args.args[0] == "whatever/instance?limit=2&offset=2"
+
+
+@patch("requests.get")
+def test_iter_search_server_without_paging(mock_get):
+    mock_get.side_effect = [_page_response(_records(0, 5))]
+    inst = Instance(api_url="whatever", token="whatever")
+
+    res = inst.iter_search(page_size=2)
+    assert len(res.all()) == 5
+    assert res.complete
+    assert mock_get.call_count == 1
+
+
+@patch("requests.get")
+def test_iter_search_server_ignoring_offset(mock_get):
+    # every request gets the same page back
+    mock_get.side_effect = lambda *a, **kw: _page_response(_records(0, 3))
+    inst = Instance(api_url="whatever", token="whatever")
+
+    res = inst.iter_search(page_size=3)
+    assert res.complete is None
+    assert res.ids() == ["0", "1", "2"]
+    assert res.complete is False
+    assert mock_get.call_count == 2
+
+
+@patch("requests.get")
+def test_lazy_results_all_can_be_reused(mock_get):
+    mock_get.side_effect = [_page_response(_records(0, 3))]
+    res = Instance(api_url="whatever", token="whatever").iter_search(page_size=5)
+
+    assert res.all() == _records(0, 3)
+    assert res.ids() == ["0", "1", "2"]
+    assert res.reduce(lambda r: r["kind_type"]) == ["test"] * 3
@@ -0,0 +1,21 @@
+import sqlite3
+
+import pytest
+
+from opal.query.sqlite import connect
+
+
+def test_connect_commits_and_closes(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    with connect(path) as db:
+        db.execute("CREATE TABLE t (x)")
+        db.execute("INSERT INTO t VALUES (1)")
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+
+    with pytest.raises(ValueError):
+        with connect(path) as db:
+            db.execute("INSERT INTO t VALUES (2)")
+            raise ValueError
+    with connect(path) as db:
+        assert db.execute("SELECT x FROM t").fetchall() == [(1,)]
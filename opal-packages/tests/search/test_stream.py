@@ -0,0 +1,62 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+import opal.query.stream
+
+from opal.query.stream import iter_json_array
+
+
+def chunked(text, size):
+    data = text.encode("utf-8")
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+RECORDS = [
+    dict(kind_id=str(i), kind_type="TipParseFlow", kind_metadata={"n": i, "s": "é" * i})
+    for i in range(50)
+]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 100000])
+def test_records_across_chunk_boundaries(size):
+    body = json.dumps({"meta": {"count": 50, "x": [1, 2]}, "data": RECORDS, "n": 1.5})
+
+    assert list(iter_json_array(chunked(body, size))) == RECORDS
+
+
+def test_numbers_split_across_chunks():
+    body = '{"data": [12345, 678.25, -9e3]}'
+
+    assert list(iter_json_array(chunked(body, 2))) == [12345, 678.25, -9e3]
+
+
+@pytest.mark.parametrize("body", ['{"data": []}', "{}", '{"data": null}', '{"x": 1}'])
+def test_empty(body):
+    assert list(iter_json_array(chunked(body, 4))) == []
+
+
+def test_is_lazy():
+    def chunks():
+        yield b'{"data": [{"kind_id": "1"}, '
+        raise AssertionError("read too far")
+
+    assert next(iter_json_array(chunks())) == {"kind_id": "1"}
+
+
+def test_truncated_body_raises():
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked('{"data": [{"kind_id": "1"}, {"kind', 5)))
+
+
+def test_large_record_is_not_reparsed_per_chunk():
+    record = dict(kind_id="1", kind_metadata={"x": list(range(20000))})
+    chunks = chunked(json.dumps({"data": [record]}), 64)
+    decoder = opal.query.stream._decoder
+
+    with patch.object(opal.query.stream, "_decoder", wraps=decoder) as mock_decoder:
+        assert list(iter_json_array(chunks)) == [record]
+
+    # about log2(len(chunks)) attempts, not one per chunk
+    assert mock_decoder.raw_decode.call_count < 30